@@ -0,0 +1,8 @@
+'''
+Micro benchmarks for the qbay backend.
+
+Every benchmark points qbay at its own temporary sqlite database
+through the db_string environment variable, so they never touch
+the development database. Run them from the repository root, e.g.
+    python -m benchmarks.bench_booking
+'''
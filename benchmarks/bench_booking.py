@@ -0,0 +1,114 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from benchmarks.common import use_temp_database, remove_database, \
+    start_app, timeit
+from qbay.models import db, User, Listing, Booking
+from qbay.models import find_booking_conflict
+
+DB_PATH = use_temp_database()
+
+
+'''
+Compares the old booking overlap check (load every booking of the
+listing and scan it in python) with find_booking_conflict, which
+seeks on the (listing_id, end_date, start_date) index, for stays at
+random dates of the history and for a new stay after the last one.
+
+    python -m benchmarks.bench_booking --bookings 10000 100000
+'''
+
+
+def legacy_conflict(listing_id, start_date, end_date):
+    '''
+    The overlap check create_booking used before the interval index
+    '''
+    bookings = Booking.query.filter_by(listing_id=listing_id).all()
+    for book in bookings:
+        if start_date <= book.end_date and end_date >= book.start_date:
+            return book
+    return None
+
+
+def populate(count):
+    '''
+    Creates one listing holding count back to back two night stays
+      Returns:
+        The listing id and the first free date after the last stay
+    '''
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    guest = User(username='bench guest', email='guest@bench.com',
+                 password='Abc#123')
+    db.session.add_all([owner, guest])
+    db.session.commit()
+
+    listing = Listing(title='bench listing %i' % count,
+                      description='a listing used only for benchmarks',
+                      price=10, last_modified_date=date(2022, 1, 1),
+                      owner_id=owner.id)
+    db.session.add(listing)
+    db.session.commit()
+
+    first = date(2000, 1, 1)
+    rows = []
+    for i in range(count):
+        start = first + timedelta(days=3 * i)
+        rows.append({'user_id': guest.id, 'listing_id': listing.id,
+                     'booking_date': first, 'start_date': start,
+                     'end_date': start + timedelta(days=1)})
+    db.session.execute(Booking.__table__.insert(), rows)
+    db.session.commit()
+    return listing.id, first, first + timedelta(days=3 * count)
+
+
+def run(count, repeat):
+    listing_id, first, last = populate(count)
+    span = (last - first).days
+    probes = []
+    for _ in range(repeat):
+        start = first + timedelta(days=random.randrange(span))
+        probes.append((start, start + timedelta(days=1)))
+    # the common case: a new stay after every existing one
+    after = (last, last + timedelta(days=2))
+
+    for name, check in (('scan', legacy_conflict),
+                        ('index', find_booking_conflict)):
+        it = iter(probes)
+        cost = timeit(lambda: check(listing_id, *next(it)), repeat)
+        print('%8i bookings  %-6s random stay %12.1f us/check'
+              % (count, name, cost))
+        cost = timeit(lambda: check(listing_id, *after), repeat)
+        print('%8i bookings  %-6s after last  %12.1f us/check'
+              % (count, name, cost))
+    probes.append(after)
+
+    # both paths must agree on every probe
+    for start, end in probes:
+        assert (legacy_conflict(listing_id, start, end) is None) == \
+            (find_booking_conflict(listing_id, start, end) is None)
+
+    Booking.query.delete()
+    Listing.query.delete()
+    User.query.delete()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='booking overlap check: scan vs index')
+    parser.add_argument('--bookings', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    start_app()
+    try:
+        for count in args.bookings:
+            run(count, args.repeat)
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from benchmarks.common import use_temp_database, remove_database, \
+    start_app, timeit
+from qbay.models import db, User, Listing, Booking
+from qbay.models import find_booking_conflict, has_booking_conflict, \
+    available_listing_ids, search_available_listings, \
+    calendars
+
+DB_PATH = use_temp_database()
+
+
+'''
+Compares availability checks on the booking index with the bitmap
+calendars, for listings booked every other few days of the next year:
+
+    python -m benchmarks.bench_calendar --listings 1000
+'''
+
+
+def populate(listings):
+    '''
+    Creates listings with a two night stay every three days of the next
+    year, plus some history
+    '''
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    guest = User(username='bench guest', email='guest@bench.com',
+                 password='Abc#123')
+    db.session.add_all([owner, guest])
+    db.session.commit()
+
+    db.session.execute(Listing.__table__.insert(), [
+        {'title': 'bench listing %i' % i,
+         'description': 'a listing used only for benchmarks',
+         'price': 10, 'last_modified_date': date(2022, 1, 1),
+         'owner_id': owner.id, 'booking_version': 0}
+        for i in range(listings)])
+    db.session.commit()
+
+    first = date.today() - timedelta(days=365)
+    for listing_id, in db.session.query(Listing.id):
+        offset = listing_id % 3
+        db.session.execute(Booking.__table__.insert(), [
+            {'user_id': guest.id, 'listing_id': listing_id,
+             'booking_date': first,
+             'start_date': first + timedelta(days=3 * i + offset),
+             'end_date': first + timedelta(days=3 * i + offset + 1)}
+            for i in range(243)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='availability checks: booking index vs bitmaps')
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+    app = start_app()
+    try:
+        populate(args.listings)
+        listings = Listing.query.all()
+        ids = [listing.id for listing in listings]
+        today = date.today()
+
+        def stay():
+            start = today + timedelta(days=random.randrange(360))
+            return start, start + timedelta(days=random.randrange(4))
+
+        def sql_check():
+            listing = random.choice(listings)
+            find_booking_conflict(listing.id, *stay())
+
+        def bitmap_check():
+            listing = random.choice(listings)
+            has_booking_conflict(listing, *stay())
+
+        print('%i listings' % args.listings)
+        cost = timeit(sql_check, args.repeat)
+        print('single listing, index       %10.1f us' % cost)
+
+        app.config['BITMAP_CALENDAR'] = True
+        cost = timeit(lambda: available_listing_ids(ids, *stay()), 1)
+        print('building all calendars      %10.1f us' % cost)
+        cost = timeit(bitmap_check, args.repeat)
+        print('single listing, bitmap      %10.1f us' % cost)
+
+        repeat = max(args.repeat // 100, 1)
+        cost = timeit(lambda: available_listing_ids(ids, *stay()), repeat)
+        print('all listings, bitmap        %10.1f us' % cost)
+
+        def sql_all():
+            start, end = stay()
+            after_id = 0
+            while after_id is not None:
+                found, after_id = search_available_listings(
+                    start, end, after_id=after_id, page_size=100)
+
+        cost = timeit(sql_all, repeat)
+        print('all listings, search query  %10.1f us' % cost)
+
+        bits = sum(calendar.nbytes for calendar in calendars().values())
+        print('calendar bits               %10i bytes' % bits)
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
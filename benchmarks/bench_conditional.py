@@ -0,0 +1,67 @@
+import argparse
+from datetime import date
+
+from benchmarks.common import use_temp_database, remove_database, timeit
+from qbay import create_app
+from qbay.models import db, init_db, register, Listing
+
+DB_PATH = use_temp_database()
+
+
+'''
+Wall time, statements and body bytes of a full GET against a
+revalidation with the ETag of the previous response, as sent by a
+returning browser or a CDN:
+
+    python -m benchmarks.bench_conditional --listings 1000
+'''
+
+PASSWORD = 'Abc#123'
+
+
+def populate(listings):
+    owner = register('bench owner', 'owner@bench.com', PASSWORD)
+    db.session.execute(Listing.__table__.insert(), [
+        {'title': 'bench listing %i' % i,
+         'description': 'a listing used only for benchmarks',
+         'price': 10 + i % 1000, 'last_modified_date': date(2022, 1, 1),
+         'owner_id': owner.id, 'booking_version': 0}
+        for i in range(listings)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='full GET vs conditional GET of the listing pages')
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=300)
+    args = parser.parse_args()
+
+    app = create_app()
+    try:
+        with app.app_context():
+            init_db()
+            populate(args.listings)
+            client = app.test_client()
+            client.post('/login', data={'email': 'owner@bench.com',
+                                        'password': PASSWORD})
+            for page in ('/booking', '/listing/update/1', '/listing'):
+                etag = client.get(page).headers['ETag']
+                for name, headers in (('full', {}),
+                                      ('revalidate', {'If-None-Match': etag})):
+                    responses = []
+                    cost = timeit(lambda: responses.append(
+                        client.get(page, headers=headers)), args.repeat)
+                    last = responses[-1]
+                    print('%-18s %-10s %3i %7i bytes %4s statements '
+                          '%10.1f us/request'
+                          % (page, name, last.status_code, len(last.data),
+                             last.headers['X-Query-Count'], cost))
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
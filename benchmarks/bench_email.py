@@ -0,0 +1,50 @@
+import argparse
+import re
+
+from benchmarks.common import timeit
+from qbay.email_validator import is_valid_email, EMAIL_PATTERN
+
+
+'''
+Compares the email regular expression register, login and
+User.update_email used to compile on every call with
+qbay.email_validator, on normal and adversarial inputs:
+
+    python -m benchmarks.bench_email
+'''
+
+LEGACY_PATTERN = \
+    r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(.[A-Z|a-z]{2,})+'
+
+
+def legacy_is_valid_email(email):
+    email_val = re.compile(LEGACY_PATTERN)
+    return re.fullmatch(email_val, email) is not None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='email validation: legacy regex vs email_validator')
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    for email in ('an.eMa_il@gmail.uk.ca.com', 'improper@gmail..com'):
+        for name, check in (('legacy', legacy_is_valid_email),
+                            ('new', is_valid_email)):
+            cost = timeit(lambda: check(email), args.repeat)
+            print('%-28s %-7s %10.2f us' % (email, name, cost))
+
+    # letters and digits without '@': the legacy pattern backtracks
+    # through every way of splitting the string into groups
+    for length in (16, 20, 24, 28, 32):
+        email = 'a1' * (length // 2)
+        cost = timeit(lambda: legacy_is_valid_email(email), 1)
+        print('%5i chars, no @          legacy  %10.2f us' % (length, cost))
+    for length in (32, 1000, 10000):
+        email = 'a1' * (length // 2)
+        cost = timeit(lambda: EMAIL_PATTERN.fullmatch(email), 10)
+        print('%5i chars, no @          new     %10.2f us' % (length, cost))
+
+
+if __name__ == '__main__':
+    main()
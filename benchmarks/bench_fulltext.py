@@ -0,0 +1,76 @@
+import argparse
+import random
+from datetime import date
+
+from benchmarks.common import use_temp_database, remove_database, \
+    start_app, timeit
+from qbay.models import db, User, Listing
+from qbay.models import search_listings
+
+DB_PATH = use_temp_database()
+
+
+'''
+Times search_listings on a large catalog of generated listings:
+
+    python -m benchmarks.bench_fulltext --listings 1000000
+'''
+
+WORDS = ('lake house cabin loft city farm beach quiet modern cozy view '
+         'river garden pool downtown village forest mountain sunny old '
+         'large small family studio castle barn island harbour').split()
+
+
+# plus a long tail of rarer made up words
+RARE_WORDS = ['%s%i' % (word, i) for word in WORDS for i in range(400)]
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) if rng.random() < 0.2
+                    else rng.choice(RARE_WORDS) for _ in range(words))
+
+
+def populate(listings):
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    db.session.add(owner)
+    db.session.commit()
+
+    rng = random.Random(327)
+    chunk = 10000
+    for first in range(0, listings, chunk):
+        db.session.execute(Listing.__table__.insert(), [
+            {'title': '%s %i' % (sentence(rng, 3), i),
+             'description': sentence(rng, 20),
+             'price': 10, 'last_modified_date': date(2022, 1, 1),
+             'owner_id': owner.id, 'booking_version': 0}
+            for i in range(first, min(first + chunk, listings))])
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='full text search over listings')
+    parser.add_argument('--listings', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    start_app()
+    try:
+        populate(args.listings)
+        print('%i listings' % args.listings)
+        rng = random.Random(1)
+        for name, vocabulary in (('common', WORDS), ('rare', RARE_WORDS)):
+            for words in (1, 2):
+                cost = timeit(lambda: search_listings(
+                    ' '.join(rng.sample(vocabulary, words))), args.repeat)
+                print('%i %-6s word search          %10.2f ms' %
+                      (words, name, cost / 1000))
+        cost = timeit(lambda: search_listings(
+            ' '.join(rng.sample(WORDS, 2)), page=10), args.repeat)
+        print('2 common word search, page 10  %10.2f ms' % (cost / 1000))
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+from datetime import date
+
+from benchmarks.common import use_temp_database, remove_database, timeit
+from qbay import create_app
+from qbay.models import db, init_db, register, Listing
+
+DB_PATH = use_temp_database()
+
+
+'''
+Database statements and wall time per request of the listing pages,
+with no cache, the listing cache (in-memory backend), the cache of the
+rendered listings tables and both. Pages are read repeatedly, as
+between two listing changes:
+
+    python -m benchmarks.bench_listing_cache --listings 1000
+'''
+
+PASSWORD = 'Abc#123'
+
+
+def populate(listings):
+    owner = register('bench owner', 'owner@bench.com', PASSWORD)
+    db.session.execute(Listing.__table__.insert(), [
+        {'title': 'bench listing %i' % i,
+         'description': 'a listing used only for benchmarks',
+         'price': 10 + i % 1000, 'last_modified_date': date(2022, 1, 1),
+         'owner_id': owner.id, 'booking_version': 0}
+        for i in range(listings)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='listing pages: no cache vs listing and fragment '
+        'caches')
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=300)
+    args = parser.parse_args()
+
+    pages = ['/booking', '/booking?after=500', '/create_listing',
+             '/listing/update/1', '/listing']
+    setups = [
+        ('off', {}),
+        ('listing', {'LISTING_CACHE': True}),
+        ('fragment', {'FRAGMENT_CACHE': True}),
+        ('both', {'LISTING_CACHE': True, 'FRAGMENT_CACHE': True}),
+    ]
+    try:
+        for i, (name, config) in enumerate(setups):
+            app = create_app(config)
+            with app.app_context():
+                if i == 0:
+                    init_db()
+                    populate(args.listings)
+                client = app.test_client()
+                client.post('/login', data={'email': 'owner@bench.com',
+                                            'password': PASSWORD})
+                for page in pages:
+                    statements = []
+
+                    def get():
+                        response = client.get(page)
+                        statements.append(
+                            int(response.headers['X-Query-Count']))
+
+                    cost = timeit(get, args.repeat)
+                    print('%-8s %-20s %6.2f statements %10.1f us/request'
+                          % (name, page, sum(statements) / len(statements),
+                             cost))
+                db.session.remove()
+                db.engine.dispose()
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
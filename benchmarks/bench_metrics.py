@@ -0,0 +1,61 @@
+import argparse
+import threading
+import time
+
+from qbay import metrics
+from qbay.metrics import Histogram, registry
+
+
+'''
+Cost of one histogram observation as request threads are added, with
+the updates spread over metrics.SHARDS locks and with a single lock:
+
+    python -m benchmarks.bench_metrics --threads 1 4 16
+'''
+
+
+def observe_cost(threads, repeat):
+    '''
+    Returns:
+        The wall time of one observation in microseconds, with threads
+        observing at the same time
+    '''
+    histogram = Histogram('qbay_bench_seconds', 'bench', ('endpoint',))
+    registry.remove(histogram)
+    barrier = threading.Barrier(threads + 1)
+
+    def work():
+        barrier.wait()
+        for i in range(repeat):
+            histogram.observe(0.001 * (i % 100), 'qbay.home')
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return (time.perf_counter() - start) / (threads * repeat) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='metric update cost: sharded vs single lock')
+    parser.add_argument('--threads', type=int, nargs='+',
+                        default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=100000)
+    args = parser.parse_args()
+
+    shards = metrics.SHARDS
+    for name, count in (('sharded', shards), ('one lock', 1)):
+        metrics.SHARDS = count
+        for threads in args.threads:
+            cost = observe_cost(threads, args.repeat)
+            print('%-9s %3i threads %8.3f us/observe'
+                  % (name, threads, cost))
+    metrics.SHARDS = shards
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+from sqlalchemy import event
+
+from benchmarks.common import use_temp_database, remove_database, \
+    start_app, timeit
+from qbay.models import db, register
+
+DB_PATH = use_temp_database()
+
+
+'''
+Commits and wall time of one profile save: the old update_user, which
+committed after every field, against update_profile, which validates
+everything and commits once. --rtt adds a simulated network round trip
+to every commit to approximate a remote MySQL server.
+
+    python -m benchmarks.bench_profile --rtt 2
+'''
+
+
+def legacy_update_user(user, username, email, ship_addr, postal_code):
+    '''
+    The field by field update_user used before update_profile
+    '''
+    return all([user.update_name(username), user.update_email(email),
+                user.update_address(ship_addr),
+                user.update_postal_code(postal_code)])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='profile save: commit per field vs one transaction')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--rtt', type=float, default=0,
+                        help='simulated round trip per commit in ms')
+    args = parser.parse_args()
+    start_app()
+    try:
+        commits = []
+
+        def on_commit(conn):
+            commits.append(conn)
+            if args.rtt:
+                time.sleep(args.rtt / 1000)
+
+        event.listen(db.engine, 'commit', on_commit)
+        user = register('bench user', 'bench@bench.com', 'Abc#123')
+        saves = {
+            'before': lambda i: legacy_update_user(
+                user, 'bench user %i' % i, 'bench%i@bench.com' % i,
+                '%i Union St' % i, 'K7L 3N6'),
+            'after': lambda i: user.update_user(
+                'bench user %i' % i, 'bench%i@bench.com' % i,
+                '%i Union St' % i, 'K7L 3N6'),
+        }
+        for name, save in saves.items():
+            counter = iter(range(args.repeat * 2))
+            del commits[:]
+            cost = timeit(lambda: save(next(counter)), args.repeat)
+            print('%-7s %5.1f commits/save %10.1f us/save'
+                  % (name, len(commits) / args.repeat, cost))
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+
+from benchmarks.common import use_temp_database, remove_database, timeit
+from qbay import create_app
+from qbay.models import db, init_db, User, Listing
+from qbay.profiler import signature
+
+DB_PATH = use_temp_database()
+
+
+'''
+Cost of the request profiler on GET /booking: with the profiler off,
+on but not sampling, and profiling every request (signed header) at
+the default 5 ms interval and at 1 ms.
+
+    python -m benchmarks.bench_profiler --repeat 500
+'''
+
+
+def populate(listings):
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    db.session.add(owner)
+    db.session.commit()
+    db.session.add_all([Listing(title='bench listing %i' % i,
+                                description='a listing for benchmarks',
+                                price=100 + i, owner_id=owner.id)
+                        for i in range(listings)])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='request profiler overhead on /booking')
+    parser.add_argument('--repeat', type=int, default=500)
+    parser.add_argument('--listings', type=int, default=100)
+    args = parser.parse_args()
+
+    token = 'bench'
+    signed = {'X-Profile': signature(token, '/booking')}
+    setups = [
+        ('off', {}, {}),
+        ('on, unsampled', {'PROFILER': True}, {}),
+        ('profiled 5 ms', {'PROFILER': True}, signed),
+        ('profiled 1 ms', {'PROFILER': True, 'PROFILE_INTERVAL_MS': 1},
+         signed),
+    ]
+    try:
+        for i, (name, config, headers) in enumerate(setups):
+            app = create_app(dict(config, ADMIN_TOKEN=token))
+            with app.app_context():
+                if i == 0:
+                    init_db()
+                    populate(args.listings)
+                client = app.test_client()
+                cost = timeit(
+                    lambda: client.get('/booking', headers=headers),
+                    args.repeat)
+                profiler = app.extensions.get('profiler')
+                routes = profiler.summary() if profiler else {}
+                samples = sum(route['samples'] for route in routes.values())
+                print('%-14s %10.1f us/request %6i samples'
+                      % (name, cost, samples))
+                db.engine.dispose()
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
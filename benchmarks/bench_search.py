@@ -0,0 +1,82 @@
+import argparse
+import random
+from datetime import date, timedelta
+
+from benchmarks.common import use_temp_database, remove_database, \
+    start_app, timeit
+from qbay.models import db, User, Listing, Booking
+from qbay.models import search_available_listings
+
+DB_PATH = use_temp_database()
+
+
+'''
+Times search_available_listings on a catalog with a large booking
+history, e.g. 1000 listings with 1000 stays each:
+
+    python -m benchmarks.bench_search --listings 1000 --stays 1000
+'''
+
+
+def populate(listings, stays):
+    '''
+    Creates listings, each holding stays back to back two night stays
+      Returns:
+        The first date of the booked period and its length in days
+    '''
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    guest = User(username='bench guest', email='guest@bench.com',
+                 password='Abc#123')
+    db.session.add_all([owner, guest])
+    db.session.commit()
+
+    db.session.execute(Listing.__table__.insert(), [
+        {'title': 'bench listing %i' % i,
+         'description': 'a listing used only for benchmarks',
+         'price': 10 + i % 1000, 'last_modified_date': date(2022, 1, 1),
+         'owner_id': owner.id} for i in range(listings)])
+    db.session.commit()
+
+    first = date(2000, 1, 1)
+    for listing_id, in db.session.query(Listing.id):
+        # shift every listing a little so the results are mixed
+        offset = listing_id % 5
+        db.session.execute(Booking.__table__.insert(), [
+            {'user_id': guest.id, 'listing_id': listing_id,
+             'booking_date': first,
+             'start_date': first + timedelta(days=3 * i + offset),
+             'end_date': first + timedelta(days=3 * i + offset + 1)}
+            for i in range(stays)])
+    db.session.commit()
+    return first, 3 * stays
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='availability search over a large booking table')
+    parser.add_argument('--listings', type=int, default=1000)
+    parser.add_argument('--stays', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    start_app()
+    try:
+        first, span = populate(args.listings, args.stays)
+        print('%i listings, %i bookings' %
+              (args.listings, args.listings * args.stays))
+
+        def search(max_price=None):
+            start = first + timedelta(days=random.randrange(span))
+            search_available_listings(start, start + timedelta(days=2),
+                                      max_price=max_price, page_size=20)
+
+        cost = timeit(search, args.repeat)
+        print('search, first page          %10.2f ms' % (cost / 1000))
+        cost = timeit(lambda: search(max_price=100), args.repeat)
+        print('search, max price 100       %10.2f ms' % (cost / 1000))
+    finally:
+        remove_database(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import use_temp_database, remove_database
+
+
+'''
+Load test of python -m qbay: the development server against the
+gunicorn production mode. Each server runs in its own process on a
+throwaway sqlite database while client threads hammer a page over
+keep-alive connections for a fixed time.
+
+    python -m benchmarks.bench_server --clients 16 --seconds 10
+'''
+
+
+def start_server(port, production, workers, threads):
+    '''
+    Starts python -m qbay in a new process group
+      Returns:
+        The Popen object, once the server answers
+    '''
+    command = [sys.executable, '-m', 'qbay', '--port', str(port)]
+    if production:
+        command += ['--production', '--workers', str(workers),
+                    '--threads', str(threads)]
+    server = subprocess.Popen(command, start_new_session=True,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/login')
+            conn.getresponse().read()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    stop_server(server)
+    raise RuntimeError('server on port %i did not start' % port)
+
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    server.wait()
+
+
+def load(port, path, clients, seconds):
+    '''
+    Sends GET path from clients threads for the given seconds
+      Returns:
+        Requests per second, the sorted latencies in milliseconds and
+        the number of connections the server closed under the client,
+        e.g. when --max-requests recycles a worker
+    '''
+    latencies = []
+    dropped = []
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine = []
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 200, response.status
+            except (OSError, http.client.HTTPException) as error:
+                # the server closed the connection, open a new one
+                dropped.append(error)
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port,
+                                                  timeout=30)
+                continue
+            mine.append((time.perf_counter() - start) * 1000)
+        latencies.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return len(latencies) / seconds, latencies, len(dropped)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='requests/sec: development server vs gunicorn')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--path', default='/booking')
+    parser.add_argument('--port', type=int, default=8091)
+    args = parser.parse_args()
+
+    path = use_temp_database()
+    try:
+        for name, production in (('development', False), ('production', True)):
+            server = start_server(args.port, production, args.workers,
+                                  args.threads)
+            try:
+                # until every worker has booted and opened its connections
+                load(args.port, args.path, args.clients, 1)
+                rate, latencies, dropped = load(args.port, args.path,
+                                                args.clients, args.seconds)
+            finally:
+                stop_server(server)
+            print('%-12s %8.1f req/s   p50 %6.1f ms   p99 %6.1f ms   '
+                  '%i dropped' % (name, rate, latencies[len(latencies) // 2],
+                                  latencies[len(latencies) * 99 // 100],
+                                  dropped))
+    finally:
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date
+
+from sqlalchemy.exc import OperationalError
+
+from benchmarks.common import remove_database
+from qbay import create_app
+from qbay.models import db, init_db, User, Listing, page_listings
+
+
+'''
+Concurrent readers and writers on one sqlite file, with the sqlite
+defaults (rollback journal, synchronous=FULL) and with the tuning
+profile (WAL, synchronous=NORMAL, mmap, 64 MB cache). Readers page
+through the listings, writers add listings, each thread with its own
+app context and connection.
+
+    python -m benchmarks.bench_sqlite --readers 4 --writers 2
+'''
+
+
+def populate(count):
+    owner = User(username='bench owner', email='owner@bench.com',
+                 password='Abc#123')
+    db.session.add(owner)
+    db.session.commit()
+    db.session.execute(Listing.__table__.insert(), [
+        {'title': 'bench listing %i' % i,
+         'description': 'a listing used only for benchmarks',
+         'price': 10 + i % 1000, 'last_modified_date': date(2022, 1, 1),
+         'owner_id': owner.id, 'booking_version': 0}
+        for i in range(count)])
+    db.session.commit()
+    return owner.id, count
+
+
+def run(app, readers, writers, seconds, owner_id, listings):
+    '''
+    Runs the reader and writer threads for the given seconds
+      Returns:
+        Reads and writes per second, and how many operations failed
+        with "database is locked"
+    '''
+    counts = {'read': 0, 'write': 0, 'locked': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def work(kind, number):
+        done = locked = 0
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                try:
+                    if kind == 'read':
+                        page_listings(after_id=random.randrange(listings))
+                    else:
+                        db.session.add(Listing(
+                            title='written %s %i' % (number, done),
+                            description='a listing written by the bench',
+                            price=100, last_modified_date=date(2022, 1, 1),
+                            owner_id=owner_id))
+                        db.session.commit()
+                    done += 1
+                except OperationalError:
+                    db.session.rollback()
+                    locked += 1
+            db.session.remove()
+        with lock:
+            counts[kind] += done
+            counts['locked'] += locked
+
+    threads = [threading.Thread(target=work, args=('read', i))
+               for i in range(readers)]
+    threads += [threading.Thread(target=work, args=('write', i))
+                for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return (counts['read'] / seconds, counts['write'] / seconds,
+            counts['locked'])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='sqlite concurrency: default vs tuned profile')
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--listings', type=int, default=10000)
+    args = parser.parse_args()
+
+    for name, pragmas in (('default', {}), ('tuned', None)):
+        fd, path = tempfile.mkstemp(suffix='.sqlite', prefix='qbay_bench_')
+        os.close(fd)
+        config = {'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path}
+        if pragmas is not None:
+            config['SQLITE_PRAGMAS'] = pragmas
+        app = create_app(config)
+        try:
+            with app.app_context():
+                init_db()
+                owner_id, listings = populate(args.listings)
+            reads, writes, locked = run(app, args.readers, args.writers,
+                                        args.seconds, owner_id, listings)
+            print('%-8s %9.1f reads/s %8.1f writes/s %6i locked'
+                  % (name, reads, writes, locked))
+        finally:
+            with app.app_context():
+                db.engine.dispose()
+            remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
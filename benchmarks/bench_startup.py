@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import use_temp_database, remove_database
+
+
+'''
+Cold start of a qbay process, every run in a fresh interpreter: importing
+the package, building the app, and bringing the schema up to date on a
+new database, on a current one, and with the unconditional create_all
+that importing qbay.models used to run.
+
+    python -m benchmarks.bench_startup --runs 20
+'''
+
+STARTUP = '''
+import json, sys, time
+start = time.perf_counter()
+import qbay
+import qbay.models
+import qbay.controllers
+from sqlalchemy import event
+imported = time.perf_counter()
+app = qbay.create_app()
+statements = []
+with app.app_context():
+    event.listen(qbay.models.db.engine, 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+    created = time.perf_counter()
+    getattr(qbay.models, sys.argv[1])()
+done = time.perf_counter()
+print(json.dumps({'import qbay': imported - start,
+                  'create_app': created - imported,
+                  sys.argv[1]: done - created,
+                  'statements': len(statements)}))
+'''
+
+
+def run(step):
+    '''
+    Starts a python process that imports qbay and runs step
+      Returns:
+        The seconds spent in each phase
+    '''
+    output = subprocess.run([sys.executable, '-c', STARTUP, step],
+                            check=True, capture_output=True, text=True,
+                            env=os.environ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='process start: import, app and schema check')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    fresh = []
+    for _ in range(args.runs):
+        path = use_temp_database()
+        timings = run('init_db')
+        fresh.append(timings['init_db'])
+        remove_database(path)
+    print('%-28s %8.2f ms %4i statements' % (
+        'init_db, new database', statistics.median(fresh) * 1e3,
+        timings['statements']))
+
+    path = use_temp_database()
+    try:
+        run('init_db')
+        timings = {}
+        statements = {}
+        for step in ('init_db', 'create_tables'):
+            for _ in range(args.runs):
+                for key, value in run(step).items():
+                    timings.setdefault(key, []).append(value)
+            statements[step] = timings.pop('statements')[-1]
+        for key in ('import qbay', 'create_app'):
+            print('%-28s %8.2f ms' % (key,
+                                      statistics.median(timings[key]) * 1e3))
+        for key in ('init_db', 'create_tables'):
+            print('%-28s %8.2f ms %4i statements' % (
+                key + ', current schema',
+                statistics.median(timings[key]) * 1e3, statements[key]))
+    finally:
+        remove_database(path)
+
+
+if __name__ == '__main__':
+    main()
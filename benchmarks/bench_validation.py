@@ -0,0 +1,89 @@
+import argparse
+import re
+
+from benchmarks.common import timeit
+from qbay.validation import validate, validate_many, \
+    check_str_contains_lower, check_str_contains_upper, \
+    check_str_contains_special
+
+
+'''
+Per call cost of validating a registration (email, password, username)
+and a listing title, with the checks as register and create_listing
+used to run them (patterns compiled on every call) and with the shared
+rules of qbay.validation:
+
+    python -m benchmarks.bench_validation
+'''
+
+
+def legacy_register_checks(name, email, password):
+    if not email or not password:
+        return False
+    if "@" not in email:
+        return False
+    email_val = re.compile(
+        r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(.[A-Z|a-z]{2,})+')
+    if not re.fullmatch(email_val, email):
+        return False
+    if not (len(password) >= 6
+            and check_str_contains_lower(password)
+            and check_str_contains_upper(password)
+            and any(special in password for special in
+                    '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')):
+        return False
+    if name == '':
+        return False
+    name_validation = re.compile('^(?! )[A-Za-z0-9 ]*(?<! )$')
+    if not re.fullmatch(name_validation, name):
+        return False
+    return 3 <= len(name) <= 19
+
+
+def register_checks(name, email, password):
+    return validate('email', email) and validate('password', password) \
+        and validate('username', name)
+
+
+def legacy_title_checks(title):
+    if title == '':
+        return False
+    if title[0] == ' ' or title[-1] == ' ':
+        return False
+    if not title.replace(' ', '').isalnum():
+        return False
+    return len(title) <= 80
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='validation cost: inline checks vs shared rules')
+    parser.add_argument('--repeat', type=int, default=100000)
+    args = parser.parse_args()
+
+    cases = {
+        'valid registration': ('user name', 'an.eMa_il@gmail.com',
+                               'Abc#123xyz'),
+        'bad username': ('user!', 'an.eMa_il@gmail.com', 'Abc#123xyz'),
+        'bad email': ('user name', 'an.eMa_il@gmail..com', 'Abc#123xyz'),
+    }
+    for case, args_ in cases.items():
+        for name, check in (('before', legacy_register_checks),
+                            ('after', register_checks)):
+            cost = timeit(lambda: check(*args_), args.repeat)
+            print('%-20s %-7s %8.2f us' % (case, name, cost))
+
+    for name, check in (('before', legacy_title_checks),
+                        ('after', lambda title: validate('title', title))):
+        cost = timeit(lambda: check('A little house by the lake'),
+                      args.repeat)
+        print('%-20s %-7s %8.2f us' % ('title', name, cost))
+
+    records = [{'email': 'user%i@gmail.com' % i, 'password': 'Abc#123',
+                'username': 'user %i' % i} for i in range(1000)]
+    cost = timeit(lambda: validate_many(records), args.repeat // 1000)
+    print('%-20s %-7s %8.2f us' % ('validate_many/1000', 'after', cost))
+
+
+if __name__ == '__main__':
+    main()
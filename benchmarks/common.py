@@ -0,0 +1,60 @@
+import os
+import tempfile
+import time
+
+
+'''
+Helpers shared by the benchmark scripts
+'''
+
+
+def use_temp_database():
+    '''
+    Points qbay at a fresh sqlite file, for the apps created
+    afterwards and for servers started as child processes.
+      Returns:
+        The path of the temporary database file
+    '''
+    fd, path = tempfile.mkstemp(suffix='.sqlite', prefix='qbay_bench_')
+    os.close(fd)
+    os.environ['db_string'] = 'sqlite:///' + path
+    return path
+
+
+def remove_database(path):
+    '''
+    Deletes a temporary sqlite database with its WAL and shared memory
+    files, which WAL mode leaves next to it
+    '''
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def start_app(config: dict = None):
+    '''
+    Creates an app, pushes its context and creates the tables
+      Attributes:
+        config (dict):   settings overriding the environment
+      Returns:
+        The app
+    '''
+    from qbay import create_app
+    from qbay.models import init_db
+
+    app = create_app(config)
+    app.app_context().push()
+    init_db()
+    return app
+
+
+def timeit(func, repeat):
+    '''
+    Calls func repeat times
+      Returns:
+        The mean wall time of one call in microseconds
+    '''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1e6
@@ -2,7 +2,9 @@
 an init file is required for this folder to be considered as a module
 '''
 from flask import Flask
+from sqlalchemy import event
 import os
+import re
 
 
 package_dir = os.path.dirname(
@@ -13,12 +15,203 @@ templates = os.path.join(
     package_dir, "templates"
 )
 
-app = Flask(__name__)
-db_string = os.getenv('db_string')
-if db_string:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_string
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///../db.sqlite'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = '69cae04b04756f65eabcd2c5a11c8c24'
-app.app_context().push()
+
+def sqlite_pragmas_from_env():
+    '''
+    Reads the sqlite tuning profile from the environment. By default
+    the journal is a write-ahead log, so readers never wait for a
+    commit, and commits only sync the log at checkpoints. The database
+    is memory mapped, the page cache holds 64 MB and temporary tables
+    stay in memory. sqlite_profile=default keeps the sqlite defaults,
+    an empty sqlite_<pragma> skips just that pragma.
+      Returns:
+        A dict of pragma name -> value
+    '''
+    if os.getenv('sqlite_profile') == 'default':
+        return {}
+    pragmas = {
+        'journal_mode': os.getenv('sqlite_journal_mode', 'WAL'),
+        'synchronous': os.getenv('sqlite_synchronous', 'NORMAL'),
+        'mmap_size': os.getenv('sqlite_mmap_size', str(256 * 2 ** 20)),
+        # negative sizes are in KiB
+        'cache_size': os.getenv('sqlite_cache_size', str(-64 * 2 ** 10)),
+        'busy_timeout': os.getenv('sqlite_busy_timeout', '5000'),
+        'temp_store': os.getenv('sqlite_temp_store', 'MEMORY'),
+    }
+    return {name: value for name, value in pragmas.items() if value}
+
+
+def config_from_env():
+    '''
+    Reads the settings of the app from the environment
+      Returns:
+        A dict of flask config keys
+    '''
+    return {
+        'SQLALCHEMY_DATABASE_URI':
+            os.getenv('db_string') or 'sqlite:///../db.sqlite',
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # connection pool of server databases, see engine_options
+        'DB_POOL_SIZE': int(os.getenv('db_pool_size', 10)),
+        'DB_MAX_OVERFLOW': int(os.getenv('db_max_overflow', 20)),
+        'DB_POOL_TIMEOUT': int(os.getenv('db_pool_timeout', 10)),
+        'DB_POOL_RECYCLE': int(os.getenv('db_pool_recycle', 1800)),
+        'DB_POOL_PRE_PING': os.getenv('db_pool_pre_ping', '1') == '1',
+        # run on every new sqlite connection, see tune_sqlite
+        'SQLITE_PRAGMAS': sqlite_pragmas_from_env(),
+        # keep the per-day occupancy table up to date on every booking
+        'OCCUPANCY_TABLE': os.getenv('occupancy_table') == '1',
+        # cache the next days of every booked listing as a bitmap
+        'BITMAP_CALENDAR': os.getenv('bitmap_calendar') == '1',
+        'BITMAP_CALENDAR_DAYS': int(os.getenv('bitmap_calendar_days', 365)),
+        # read listings through a cache, see qbay.listing_cache
+        'LISTING_CACHE': os.getenv('listing_cache') == '1',
+        'LISTING_CACHE_SIZE': int(os.getenv('listing_cache_size', 10000)),
+        'LISTING_CACHE_TTL': float(os.getenv('listing_cache_ttl', 60)),
+        # redis:// url of a cache shared by the workers
+        'LISTING_CACHE_URL': os.getenv('listing_cache_url'),
+        'LISTING_CACHE_BACKEND': None,
+        # keep the rendered listings tables by catalog version
+        'FRAGMENT_CACHE': os.getenv('fragment_cache') == '1',
+        'FRAGMENT_CACHE_SIZE': int(os.getenv('fragment_cache_size', 1000)),
+        'FRAGMENT_CACHE_TTL': float(os.getenv('fragment_cache_ttl', 3600)),
+        # ETag and Last-Modified on the listing pages, 304 when unchanged
+        'CONDITIONAL_GET': os.getenv('conditional_get', '1') == '1',
+        # strong ETags only hold if nothing re-encodes the pages
+        'ETAG_WEAK': os.getenv('etag_weak', '1') == '1',
+        # listings shown per page on /booking and /create_listing
+        'LISTINGS_PAGE_SIZE': int(os.getenv('listings_page_size', 20)),
+        # python -m qbay serves with gunicorn when server_mode is production
+        'SERVER_MODE': os.getenv('server_mode', 'development'),
+        'SERVER_PORT': int(os.getenv('port', 8081)),
+        'SERVER_WORKERS': int(os.getenv('server_workers', 0)) or None,
+        'SERVER_THREADS': int(os.getenv('server_threads', 4)),
+        'SERVER_KEEPALIVE': int(os.getenv('server_keepalive', 5)),
+        'SERVER_TIMEOUT': int(os.getenv('server_timeout', 30)),
+        'SERVER_MAX_REQUESTS': int(os.getenv('server_max_requests', 1000)),
+        # statements a request may run, per endpoint or for all of them
+        'QUERY_BUDGET': int(os.getenv('query_budget', 0)) or None,
+        'QUERY_BUDGETS': {},
+        'QUERY_BUDGET_STRICT': os.getenv('query_budget_strict') == '1',
+        # repeats of one statement in a request logged as N+1
+        'QUERY_REPEAT_LIMIT': int(os.getenv('query_repeat_limit', 5)),
+        # time every statement by fingerprint, log the slower ones
+        'SLOW_QUERY_LOG': os.getenv('slow_query_log') == '1',
+        'SLOW_QUERY_MS': float(os.getenv('slow_query_ms', 100)),
+        'SLOW_QUERY_FINGERPRINTS': int(
+            os.getenv('slow_query_fingerprints', 200)),
+        # sample the stacks of some requests, see qbay.profiler
+        'PROFILER': os.getenv('profiler') == '1',
+        'PROFILE_SAMPLE_RATE': float(os.getenv('profile_sample_rate', 0)),
+        'PROFILE_INTERVAL_MS': float(os.getenv('profile_interval_ms', 5)),
+        # required by the /admin endpoints, which are off without one
+        'ADMIN_TOKEN': os.getenv('admin_token'),
+        'SECRET_KEY': '69cae04b04756f65eabcd2c5a11c8c24',
+    }
+
+
+def engine_options(config):
+    '''
+    Connection pool settings for a server database such as MySQL:
+    pool_size connections are kept open, up to max_overflow more are
+    opened for bursts, a request waits pool_timeout seconds for a free
+    one, connections are replaced after pool_recycle seconds, before
+    the server drops them as idle, and pre-ping checks each one as it
+    is checked out. sqlite keeps the Flask-SQLAlchemy defaults.
+      Attributes:
+        config (dict):   flask config
+      Returns:
+        The keyword arguments for create_engine
+    '''
+    if config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def tune_sqlite(engine, pragmas):
+    '''
+    Runs the pragmas on every connection the engine opens
+      Attributes:
+        engine (Engine):   engine of a sqlite database
+        pragmas (dict):    pragma name -> value
+    '''
+    for name, value in pragmas.items():
+        # they are pasted into the statement
+        if not re.fullmatch(r'\w+', name) or \
+           not re.fullmatch(r'-?\w+', str(value)):
+            raise ValueError('bad sqlite pragma %s=%s' % (name, value))
+
+    def on_connect(connection, record):
+        cursor = connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+    event.listen(engine, 'connect', on_connect)
+
+
+def create_app(config: dict = None):
+    '''
+    Builds an app with its own database engine. Nothing touches the
+    database here, the tables are created by qbay.models.init_db.
+      Attributes:
+        config (dict):   settings overriding the environment
+      Returns:
+        The Flask app with the models and routes registered
+    '''
+    from qbay.models import db
+    from qbay.controllers import blueprint
+    from qbay import listing_cache, metrics, profiler, query_stats, \
+        slow_queries
+
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    # explicit SQLALCHEMY_ENGINE_OPTIONS win over the pool settings
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    db.init_app(app)
+    # listing id -> BitmapCalendar, filled while BITMAP_CALENDAR is on
+    app.extensions['calendars'] = {}
+    if app.config['LISTING_CACHE']:
+        backend = app.config['LISTING_CACHE_BACKEND']
+        if backend is None and app.config['LISTING_CACHE_URL']:
+            backend = listing_cache.RedisBackend(
+                app.config['LISTING_CACHE_URL'],
+                app.config['LISTING_CACHE_TTL'])
+        elif backend is None:
+            backend = listing_cache.MemoryBackend(
+                app.config['LISTING_CACHE_SIZE'],
+                app.config['LISTING_CACHE_TTL'])
+        app.extensions['listing_cache'] = backend
+    if app.config['FRAGMENT_CACHE']:
+        # the keys hold the catalog version, old entries age out of the LRU
+        app.extensions['fragment_cache'] = listing_cache.MemoryBackend(
+            app.config['FRAGMENT_CACHE_SIZE'],
+            app.config['FRAGMENT_CACHE_TTL'], 'fragment')
+    slow_log = None
+    if app.config['SLOW_QUERY_LOG']:
+        slow_log = app.extensions['slow_queries'] = slow_queries.SlowQueryLog(
+            app.config['SLOW_QUERY_MS'] / 1000,
+            app.config['SLOW_QUERY_FINGERPRINTS'])
+    with app.app_context():
+        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            tune_sqlite(db.engine, app.config['SQLITE_PRAGMAS'])
+        query_stats.install(db.engine, slow_log)
+    app.register_blueprint(blueprint)
+    app.register_blueprint(metrics.blueprint)
+    app.register_blueprint(query_stats.blueprint)
+    app.register_blueprint(slow_queries.blueprint)
+    # no hooks at all while profiling is off
+    if app.config['PROFILER']:
+        app.extensions['profiler'] = profiler.Profiler(
+            app.config['PROFILE_INTERVAL_MS'] / 1000)
+        app.register_blueprint(profiler.blueprint)
+    return app
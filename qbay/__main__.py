@@ -1,13 +1,95 @@
+import argparse
+import json
+import urllib.request
+from functools import partial
 
-from qbay import app
-from qbay.models import *
-from qbay.controllers import *
+from qbay import config_from_env, create_app
+from qbay.models import db, init_db, rebuild_occupancy, SCHEMA_VERSION
+from qbay.server import serve, default_workers
+from qbay.slow_queries import format_summary
 
 """
 This file runs the server at a given port
+
+    python -m qbay                      run the server
+    python -m qbay --production         run it under gunicorn
+    python -m qbay init-db              create or update the tables
+    python -m qbay rebuild-occupancy    regenerate the occupancy table
+    python -m qbay slow-queries         print the slow query log of a
+                                        running server (--url)
+
+Every server option defaults to the matching setting of qbay/__init__.py,
+e.g. server_mode=production in the environment selects gunicorn.
 """
 
-FLASK_PORT = 8081
+
+def parse_args(argv=None):
+    config = config_from_env()
+    parser = argparse.ArgumentParser(prog='python -m qbay')
+    parser.add_argument('command', nargs='?', default='run',
+                        choices=('run', 'init-db', 'rebuild-occupancy',
+                                 'slow-queries'))
+    parser.add_argument('--production', action='store_true',
+                        default=config['SERVER_MODE'] == 'production',
+                        help='serve with gunicorn instead of the '
+                             'development server')
+    parser.add_argument('--port', type=int,
+                        default=config['SERVER_PORT'])
+    parser.add_argument('--workers', type=int,
+                        default=config['SERVER_WORKERS'] or
+                        default_workers())
+    parser.add_argument('--threads', type=int,
+                        default=config['SERVER_THREADS'])
+    parser.add_argument('--keepalive', type=int,
+                        default=config['SERVER_KEEPALIVE'])
+    parser.add_argument('--timeout', type=int,
+                        default=config['SERVER_TIMEOUT'])
+    parser.add_argument('--max-requests', type=int,
+                        default=config['SERVER_MAX_REQUESTS'])
+    parser.add_argument('--url', default='http://127.0.0.1:%i'
+                        % config['SERVER_PORT'],
+                        help='server asked by slow-queries')
+    return parser.parse_args(argv)
+
+
+def fetch_slow_queries(url, token):
+    '''
+    Reads the slow query log of a running server, the one of the worker
+    answering when there are several
+    '''
+    request = urllib.request.Request(url + '/admin/slow_queries',
+                                     headers={'X-Admin-Token': token or ''})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
 
 if __name__ == "__main__":
-    app.run(debug=True, port=FLASK_PORT, host='0.0.0.0')
+    args = parse_args()
+    if args.command == 'slow-queries':
+        log = fetch_slow_queries(args.url, config_from_env()['ADMIN_TOKEN'])
+        print('statements over %g ms are slow' % log['threshold_ms'])
+        print(format_summary(log['queries']))
+        raise SystemExit
+
+    app = create_app()
+    with app.app_context():
+        # a single query once the schema is current
+        updated = init_db()
+
+    if args.command == 'init-db':
+        print('schema version %i %s' % (
+            SCHEMA_VERSION,
+            'created or updated' if updated else 'already current'))
+    elif args.command == 'rebuild-occupancy':
+        with app.app_context():
+            print('%i occupied days written' % rebuild_occupancy())
+    elif args.production:
+        # the workers open their own connections after the fork
+        with app.app_context():
+            db.engine.dispose()
+        serve(partial(create_app, {'SERVER_MODE': 'production'}),
+              port=args.port, workers=args.workers,
+              threads=args.threads, keepalive=args.keepalive,
+              timeout=args.timeout, max_requests=args.max_requests)
+    else:
+        app.run(debug=True, port=args.port, host='0.0.0.0')
@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+
+'''
+In-memory availability cache: the next days of a listing packed into
+an int, one bit per day (bit 0 is the first day of the window). A year
+of a listing takes 46 bytes of bits, and overlap checks are one AND.
+'''
+
+
+class BitmapCalendar:
+    '''
+    Booked days of one listing inside a window of days
+      Attributes:
+        version (int):         listing booking_version it was built from
+        first_day (date):      first day of the window
+        days (int):            number of days in the window
+        bits (int):            bit i set when first_day + i is booked
+    '''
+    __slots__ = ('version', 'first_day', 'days', 'bits')
+
+    def __init__(self, version: int, first_day: date, days: int,
+                 stays=()):
+        self.version = version
+        self.first_day = first_day
+        self.days = days
+        self.bits = 0
+        for start_date, end_date in stays:
+            # stays may start before or end after the window
+            start_date = max(start_date, first_day)
+            end_date = min(end_date, self.last_day)
+            if start_date <= end_date:
+                self.bits |= self.mask(start_date, end_date)
+
+    def __repr__(self):
+        return '<BitmapCalendar %r+%r>' % (self.first_day, self.days)
+
+    @property
+    def last_day(self):
+        return self.first_day + timedelta(days=self.days - 1)
+
+    def covers(self, start_date: date, end_date: date):
+        '''
+        Checks whether a stay lies completely inside the window
+        '''
+        return self.first_day <= start_date <= end_date <= self.last_day
+
+    def mask(self, start_date: date, end_date: date):
+        '''
+        Builds the bits of a stay inside the window
+        '''
+        offset = (start_date - self.first_day).days
+        length = (end_date - start_date).days + 1
+        return ((1 << length) - 1) << offset
+
+    def is_free(self, start_date: date, end_date: date):
+        '''
+        Checks whether no day of a stay inside the window is booked
+        '''
+        return not self.bits & self.mask(start_date, end_date)
+
+    def booked(self, start_date: date, end_date: date, version: int):
+        '''
+        Returns a new calendar with a stay inside the window added, so
+        readers in other threads never see a half updated calendar
+        '''
+        calendar = BitmapCalendar(version, self.first_day, self.days)
+        calendar.bits = self.bits | self.mask(start_date, end_date)
+        return calendar
+
+    @property
+    def nbytes(self):
+        '''
+        Size of the packed bits in bytes
+        '''
+        return (self.days + 7) // 8
@@ -1,10 +1,58 @@
-from flask import render_template, request, session, redirect
-from qbay.models import login, User, Listing, register, Booking
+from flask import render_template, request, session, redirect, jsonify, g
+from flask import Blueprint, current_app, make_response
+from markupsafe import Markup
+from qbay.models import login, User, Listing, register, Booking, db
 from qbay.models import update_listing, create_listing, create_booking
-from datetime import date, datetime
+from qbay.models import search_available_listings, create_bookings
+from qbay.models import MAX_BOOKING_BATCH
+from qbay.models import search_listings, cached_page_listings
+from qbay.models import cached_listings, cached_owner_listings
+from qbay.models import catalog_version
+from qbay.listing_cache import cache_events
+from datetime import date, datetime, timezone
+from functools import lru_cache, wraps
+import hashlib
+import hmac
+import os
+import time
 
 
-from qbay import app
+'''
+The routes of the web app, registered on every app by qbay.create_app
+'''
+
+blueprint = Blueprint('qbay', __name__)
+
+
+def current_user():
+    """
+    Returns the logged in user, or None. The user is loaded by primary
+    key at most once per request and kept on flask.g, so every route
+    and decorator can call this freely.
+    """
+    if 'user' not in g:
+        user = None
+        if 'user_id' in session:
+            user = db.session.get(User, session['user_id'])
+        elif 'logged_in' in session:
+            # session cookies issued before the id was stored
+            user = User.query.filter_by(
+                email=session['logged_in']).one_or_none()
+            if user:
+                session['user_id'] = user.id
+        g.user = user
+    return g.user
+
+
+@blueprint.before_app_request
+def forget_current_user():
+    """
+    flask.g belongs to the app context, which outlives a request when one
+    was already pushed (the tests push one), so every request starts
+    without a resolved user or catalog version.
+    """
+    g.pop('user', None)
+    g.pop('catalog_version', None)
 
 
 def authenticate(inner_function):
@@ -20,28 +68,97 @@ def authenticate(inner_function):
         pass
     """
 
-    def wrapped_inner():
+    @wraps(inner_function)
+    def wrapped_inner(*args, **kwargs):
 
-        # check did we store the key in the session
-        if 'logged_in' in session:
-            email = session['logged_in']
-            try:
-                user = User.query.filter_by(email=email).one_or_none()
-                if user:
-                    # if the user exists, call the inner_function
-                    # with user as parameter
-                    return inner_function(user)
-            except Exception:
-                pass
-        else:
-            # else, redirect to the login page
-            return redirect('/login')
+        # check did we store the user in the session
+        user = current_user()
+        if user:
+            # if the user exists, call the inner_function
+            # with user as parameter
+            return inner_function(user, *args, **kwargs)
+        # else, redirect to the login page
+        return redirect('/login')
 
     # return the wrapped version of the inner_function:
     return wrapped_inner
 
 
-@app.route('/login', methods=['GET'])
+@lru_cache(maxsize=None)
+def templates_digest():
+    """
+    Hash of the templates, part of every ETag so a deploy changing the
+    pages does not leave browsers on the old ones
+    """
+    digest = hashlib.sha1()
+    folder = os.path.join(os.path.dirname(__file__), 'templates')
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as template:
+            digest.update(name.encode() + template.read())
+    return digest.hexdigest()
+
+
+# the templates and the config of the pages only change with a restart
+STARTED = int(time.time())
+
+
+def conditional(per_user=False):
+    """
+    Answers GET requests with 304 Not Modified, before the page is read
+    or rendered, when the browser or CDN copy is still current. Pages
+    showing only listings change with the catalog version, which backs
+    the ETag and, with the start of the process as a floor, once its
+    second is over, the Last-Modified header.
+    :param per_user: the page also depends on the logged in user, and
+        may only be kept by the browser
+    """
+    def decorator(inner_function):
+        @wraps(inner_function)
+        def wrapped_inner(*args, **kwargs):
+            config = current_app.config
+            version = catalog_version() if config['CONDITIONAL_GET'] \
+                else None
+            if version is None:
+                return inner_function(*args, **kwargs)
+            # listings_table needs it too
+            g.catalog_version = version
+
+            user = current_user() if per_user else None
+            etag = hashlib.sha1(('%s %i %s %s' % (
+                templates_digest(), version, request.full_path,
+                user.id if user else '-')).encode()).hexdigest()[:20]
+            # the second after the change or the start, sent once it is
+            # over
+            last_modified = max(version, STARTED) + 1
+            if last_modified > time.time():
+                last_modified = None
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                fresh = since is not None and last_modified is not None \
+                    and since.timestamp() >= last_modified
+
+            if fresh:
+                response = make_response('', 304)
+            else:
+                response = make_response(inner_function(*args, **kwargs))
+            response.set_etag(etag, weak=config['ETAG_WEAK'])
+            if last_modified is not None:
+                response.last_modified = datetime.fromtimestamp(
+                    last_modified, timezone.utc)
+            # stored, but revalidated before every use
+            response.headers['Cache-Control'] = \
+                'private, no-cache' if per_user else 'no-cache'
+            if per_user:
+                response.vary.add('Cookie')
+            return response
+        return wrapped_inner
+    return decorator
+
+
+@blueprint.route('/login', methods=['GET'])
 def login_get():
     """
     Handles get command for login page
@@ -49,7 +166,7 @@ def login_get():
     return render_template('login.html', message='Please login')
 
 
-@app.route('/login', methods=['POST'])
+@blueprint.route('/login', methods=['POST'])
 def login_post():
     """
     Handles post command for login page
@@ -58,7 +175,7 @@ def login_post():
     password = request.form.get('password')
     user = login(email, password)
     if user:
-        session['logged_in'] = user.email
+        session['user_id'] = user.id
         """
         Session is an object that contains sharing information
         between a user's browser and the end server.
@@ -75,7 +192,7 @@ def login_post():
         return render_template('login.html', message='login failed')
 
 
-@app.route('/')
+@blueprint.route('/')
 @authenticate
 def home(user):
     # authentication is done in the wrapper function
@@ -90,7 +207,7 @@ def home(user):
     return render_template('index.html', user=user, bookings=bookings)
 
 
-@app.route('/register', methods=['GET'])
+@blueprint.route('/register', methods=['GET'])
 def register_get():
     """
     Handles get command for register page
@@ -99,7 +216,7 @@ def register_get():
     return render_template('register.html', message='')
 
 
-@app.route('/register', methods=['POST'])
+@blueprint.route('/register', methods=['POST'])
 def register_post():
     """
     Handles post command for register page
@@ -125,13 +242,12 @@ def register_post():
         return redirect('/login')
 
 
-@app.route('/profile_update', methods=['GET'])
-def profile_update_get():
+@blueprint.route('/profile_update', methods=['GET'])
+@authenticate
+def profile_update_get(user):
     """
     Handles get command for profile update page
     """
-    # access user by quering for the email in the current session
-    user = User.query.filter_by(email=session['logged_in']).first()
     # render the profile_update html page when linked to /profile_update
     username = user.username
     email = user.email
@@ -152,8 +268,9 @@ def profile_update_get():
                            user_postal_placeholder=postal)
 
 
-@app.route('/profile_update', methods=['POST'])
-def profile_update_post():
+@blueprint.route('/profile_update', methods=['POST'])
+@authenticate
+def profile_update_post(user):
     """
     Handles post command for profile update page
     """
@@ -166,9 +283,6 @@ def profile_update_post():
     err_msg = 'Invalid Input, Please Try Again!'
     success_msg = 'Profile Updated!'
 
-    # access user by quering for the email in the current session
-    user = User.query.filter_by(email=session['logged_in']).first()
-
     # Update only the text boxes that were filled
     if username == '':
         username = user.username
@@ -185,7 +299,6 @@ def profile_update_post():
 
     # If success render html
     if success:
-        session['logged_in'] = user.email
         return render_template('profile_update.html',
                                message=success_msg,
                                user_name_placeholder=user.username,
@@ -202,19 +315,59 @@ def profile_update_post():
                                user_postal_placeholder=user.postal_code)
 
 
-@app.route('/booking', methods=['GET'])
+def listings_table():
+    """
+    Renders the page of the listings table selected by the 'after' and
+    'before' cursors of the query string. With FRAGMENT_CACHE the HTML
+    is kept by catalog version, so it is rendered once per change of
+    the listings.
+    """
+    try:
+        after_id = int(request.args.get('after') or 0)
+        before_id = request.args.get('before')
+        before_id = int(before_id) if before_id else None
+    except ValueError:
+        after_id, before_id = 0, None
+    page_size = current_app.config['LISTINGS_PAGE_SIZE']
+
+    cache = current_app.extensions.get('fragment_cache')
+    # read first, a change committed meanwhile moves to a new key
+    version = g.get('catalog_version')
+    if cache is not None and version is None:
+        version = catalog_version()
+    key = 'fragment:listings:%s:%i:%s:%i' % (version, after_id, before_id,
+                                             page_size)
+    if cache is not None and version is not None:
+        html = cache.get_many([key]).get(key)
+        cache_events.inc('fragment', 'miss' if html is None else 'hit')
+        if html is not None:
+            return Markup(html)
+
+    # the listings of that version too, not what the listing cache of
+    # this process saw before another one changed them
+    listings, prev_before, next_after = cached_page_listings(
+        after_id, before_id, page_size, version)
+    html = render_template('listings_table.html', listings=listings,
+                           prev_before=prev_before, next_after=next_after)
+    if cache is not None and version is not None:
+        cache.set_many({key: html})
+    return Markup(html)
+
+
+@blueprint.route('/booking', methods=['GET'])
+@conditional()
 def booking_get():
     """
     Handles get command for booking page
     """
-    listings = Listing.query.order_by(Listing.id).all()
     return render_template('booking.html',
-                           listings=listings,
+                           listings_table=listings_table(),
                            message='')
 
 
-@app.route('/booking', methods=['POST'])
-def booking_post():
+@blueprint.route('/booking', methods=['POST'])
+@authenticate
+def booking_post(user):
     """
     Handles post command for booking page
     """
@@ -229,39 +382,201 @@ def booking_post():
     err_msg = 'Invalid Input, Please Try Again!'
     success_msg = 'Listing Booked!'
 
-    # access user by quering for the email in the current session
-    user = User.query.filter_by(email=session['logged_in']).first()
-    # access list of listings
-    listings = Listing.query.order_by(Listing.id).all()
-
     # Check for success after booking
     success = create_booking(user_id=user.id, listing_id=l_id,
                              start_date=start_date, end_date=end_date)
 
+    # render the current page of listings, after the commit of the
+    # booking so they are not expired and reloaded one by one
+    table = listings_table()
+
     # If success render html
     if success:
         return render_template('booking.html',
-                               listings=listings,
+                               listings_table=table,
                                message=success_msg)
     else:
         return render_template('booking.html',
-                               listings=listings,
+                               listings_table=table,
                                message=err_msg)
 
 
-@app.route('/create_listing', methods=['GET'])
+def parse_search_args(args):
+    """
+    Reads the stay window, price limit and page cursor of a search
+    from the query string. Returns None if any of them is malformed.
+    """
+    try:
+        search = {
+            'start_date': datetime.strptime(args.get('start_date', ''),
+                                            '%Y-%m-%d').date(),
+            'end_date': datetime.strptime(args.get('end_date', ''),
+                                          '%Y-%m-%d').date(),
+            'max_price': None,
+            'after_id': int(args.get('after') or 0),
+            'page_size': int(args.get('page_size') or 20)
+        }
+        if args.get('max_price'):
+            search['max_price'] = float(args.get('max_price'))
+    except ValueError:
+        return None
+    return search
+
+
+@blueprint.route('/search', methods=['GET'])
+def search_get():
+    """
+    Handles get command for the availability search page
+    """
+    # nothing searched yet, only show the form
+    if not request.args.get('start_date') and \
+       not request.args.get('end_date'):
+        return render_template('search.html', listings=[], next_after=None,
+                               search=request.args, message='')
+
+    search = parse_search_args(request.args)
+    result = None
+    if search:
+        result = search_available_listings(**search)
+
+    if result is None:
+        return render_template('search.html', listings=[], next_after=None,
+                               search=request.args,
+                               message='Invalid Input, Please Try Again!')
+
+    listings, next_after = result
+    return render_template('search.html', listings=listings,
+                           next_after=next_after, search=request.args,
+                           message='%i available listings shown'
+                           % len(listings))
+
+
+@blueprint.route('/api/search', methods=['GET'])
+def search_api():
+    """
+    JSON version of the availability search
+    """
+    search = parse_search_args(request.args)
+    result = None
+    if search:
+        result = search_available_listings(**search)
+
+    if result is None:
+        return jsonify(error='invalid search'), 400
+
+    listings, next_after = result
+    return jsonify(
+        listings=[{'id': listing.id,
+                   'title': listing.title,
+                   'description': listing.description,
+                   'price': float(listing.price)} for listing in listings],
+        next_after=next_after)
+
+
+@blueprint.route('/listings/search', methods=['GET'])
+def text_search_get():
+    """
+    Handles get command for the listing text search page
+    """
+    query = request.args.get('q', '')
+    try:
+        page = int(request.args.get('page') or 1)
+    except ValueError:
+        page = 0
+
+    result = search_listings(query, page)
+    if result is None:
+        return render_template('text_search.html', listings=[], query=query,
+                               page=1, next_page=None,
+                               message='Invalid Input, Please Try Again!')
+
+    listings, next_page = result
+    return render_template('text_search.html', listings=listings,
+                           query=query, page=page, next_page=next_page,
+                           message='')
+
+
+@blueprint.route('/api/listings/search', methods=['GET'])
+def text_search_api():
+    """
+    JSON version of the listing text search
+    """
+    try:
+        page = int(request.args.get('page') or 1)
+        page_size = int(request.args.get('page_size') or 20)
+    except ValueError:
+        return jsonify(error='invalid search'), 400
+
+    result = search_listings(request.args.get('q', ''), page, page_size)
+    if result is None:
+        return jsonify(error='invalid search'), 400
+
+    listings, next_page = result
+    return jsonify(
+        listings=[{'id': listing.id,
+                   'title': listing.title,
+                   'description': listing.description,
+                   'price': float(listing.price)} for listing in listings],
+        next_page=next_page)
+
+
+@blueprint.route('/api/bookings', methods=['POST'])
+@authenticate
+def bookings_api(user):
+    """
+    Books a whole batch of stays in one transaction. Expects a JSON body
+    {"bookings": [{"listing_id", "start_date", "end_date", "user_id"}]}
+    and returns one result code per item. user_id defaults to the logged
+    in user, booking for another user takes the X-Admin-Token header.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or \
+       not isinstance(body.get('bookings'), list):
+        return jsonify(error='expected a list of bookings'), 400
+    if len(body['bookings']) > MAX_BOOKING_BATCH:
+        return jsonify(error='at most %i bookings per batch'
+                       % MAX_BOOKING_BATCH), 413
+
+    token = current_app.config['ADMIN_TOKEN']
+    admin = bool(token) and hmac.compare_digest(
+        request.headers.get('X-Admin-Token', '').encode(), token.encode())
+    batch = []
+    for item in body['bookings']:
+        if not isinstance(item, dict):
+            batch.append(None)
+            continue
+        item = dict(item)
+        if item.setdefault('user_id', user.id) != user.id and not admin:
+            return jsonify(error='bookings for another user need the '
+                           'admin token'), 403
+        for key in ('start_date', 'end_date'):
+            # leave malformed dates to be rejected by create_bookings
+            try:
+                item[key] = datetime.strptime(item.get(key),
+                                              '%Y-%m-%d').date()
+            except (TypeError, ValueError):
+                pass
+        batch.append(item)
+
+    results = create_bookings(batch)
+    return jsonify(results=[
+        {'code': code, 'booking_id': booking.id if booking else None}
+        for code, booking in results])
+
+
+@blueprint.route('/create_listing', methods=['GET'])
 def create_listing_get():
     """
     Handles get command for create listing page
     """
     # templates are stored in the templates folder
-    listings = Listing.query.order_by(Listing.id).all()
     return render_template('create_listing.html',
-                           listings=listings, message='')
+                           listings_table=listings_table(), message='')
 
 
-@app.route('/create_listing', methods=['POST'])
-def create_listing_post():
+@blueprint.route('/create_listing', methods=['POST'])
+@authenticate
+def create_listing_post(user):
     """
     Handles post command for create listing page
     """
@@ -271,63 +586,65 @@ def create_listing_post():
 
     error_message = None
 
-    user_id = User.query.filter_by(email=session['logged_in']).first().id
     # use backend api to create listing
-    success = create_listing(title, description, price, date.today(), user_id)
+    success = create_listing(title, description, price, date.today(),
+                             user.id)
     if not success:
         error_message = "Listing Creation failed."
 
     # Display error message if listing creation failed.
     # Otherwise, display confirmation message.
-    listings = Listing.query.order_by(Listing.id).all()
+    table = listings_table()
     if error_message:
-        return render_template('create_listing.html', listings=listings,
+        return render_template('create_listing.html',
+                               listings_table=table,
                                message=error_message)
     else:
-        return render_template('create_listing.html', listings=listings,
+        return render_template('create_listing.html',
+                               listings_table=table,
                                message='Listing Creation succeeded!')
 
 
-@app.route('/logout')
+@blueprint.route('/logout')
 def logout():
     """
     Logout page
     """
-    if 'logged_in' in session:
-        session.pop('logged_in', None)
+    session.pop('user_id', None)
+    session.pop('logged_in', None)
     return redirect('/')
 
 
-@app.route('/listing', methods=['GET'])
-def listing():
+@blueprint.route('/listing', methods=['GET'])
+@authenticate
+@conditional(per_user=True)
+def listing(user):
     """
     function handling the GET method for /listing
     """
-    # Get the id of the logged on user
-    user_id = User.query.filter_by(email=session['logged_in']).first().id
-
-    # Get all listings in database
-    listings = Listing.query.filter_by(owner_id=user_id).all()
+    # Get all listings of the user, through the listing cache
+    listings = cached_owner_listings(user.id, g.get('catalog_version'))
 
     # load the template
     return render_template('listing.html', listings=listings,
                            message='Here are all your listings')
 
 
-@app.route('/listing/update/<int:id>', methods=['GET'])
+@blueprint.route('/listing/update/<int:id>', methods=['GET'])
+@conditional()
 def update_listing_get(id):
     """
     Function for Get commands
     """
-    # Get all listings in database
-    listing = Listing.query.filter_by(id=id).all()
+    # Get the listing, through the listing cache
+    listing = cached_listings([id], g.get('catalog_version'))
 
     # Render the template
     return render_template('update_listing.html', listing=listing,
                            message='')
 
 
-@app.route('/listing/update/<int:id>', methods=['POST'])
+@blueprint.route('/listing/update/<int:id>', methods=['POST'])
 def update_listing_post(id):
     """
     Function handling post commands for updating listing page
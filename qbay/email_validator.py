@@ -0,0 +1,34 @@
+import re
+
+
+'''
+R1-3 email check shared by register, login and User.update_email.
+
+The local part is words of letters and digits joined by single '.', '-'
+or '_', the domain a label followed by one or more '.' and a top level
+name of two or more letters. Every repetition starts with a character
+the previous one cannot match, so the regular expression never
+backtracks into an earlier group and runs in linear time. Inputs longer
+than the User.email column are rejected before matching.
+'''
+
+
+# length of the User.email column
+MAX_EMAIL_LENGTH = 120
+
+EMAIL_PATTERN = re.compile(
+    r'[A-Za-z0-9]+(?:[._-][A-Za-z0-9]+)*'
+    r'@[A-Za-z0-9-]+(?:\.[A-Za-z]{2,})+')
+
+
+def is_valid_email(email):
+    '''
+    Checks an email against R1-3
+      Parameters:
+        email (string):    email to check
+      Returns:
+        True if the email is valid otherwise False
+    '''
+    if not isinstance(email, str) or len(email) > MAX_EMAIL_LENGTH:
+        return False
+    return EMAIL_PATTERN.fullmatch(email) is not None
@@ -0,0 +1,121 @@
+import re
+from sqlalchemy import inspect, text
+
+
+'''
+Full text search over listing titles and descriptions. sqlite databases
+get an FTS5 table kept in sync with the listing table by triggers,
+MySQL databases a FULLTEXT index, anything else falls back to LIKE.
+'''
+
+
+# Words of a search that are used, the rest is ignored
+MAX_TERMS = 8
+
+SQLITE_DDL = [
+    '''CREATE VIRTUAL TABLE listing_fts USING fts5(
+        title, description, content='listing', content_rowid='id')''',
+    '''CREATE TRIGGER listing_fts_insert AFTER INSERT ON listing BEGIN
+        INSERT INTO listing_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END''',
+    '''CREATE TRIGGER listing_fts_delete AFTER DELETE ON listing BEGIN
+        INSERT INTO listing_fts(listing_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END''',
+    '''CREATE TRIGGER listing_fts_update
+    AFTER UPDATE OF title, description ON listing BEGIN
+        INSERT INTO listing_fts(listing_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO listing_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END''',
+    # index the listings that existed before the table
+    '''INSERT INTO listing_fts(listing_fts) VALUES ('rebuild')''',
+]
+
+MYSQL_DDL = '''ALTER TABLE listing
+    ADD FULLTEXT INDEX ft_listing_text (title, description)'''
+
+# engine -> 'fts5', 'fulltext' or 'like'
+modes = {}
+
+
+def create_index(engine):
+    '''
+    Creates the full text index of the listings if it does not exist
+      Parameters:
+        engine (Engine):   engine of the database holding the listings
+      Returns:
+        The search mode used with this engine
+    '''
+    mode = 'like'
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite':
+            if 'listing_fts' in inspect(connection).get_table_names():
+                mode = 'fts5'
+            else:
+                try:
+                    with connection.begin_nested():
+                        for statement in SQLITE_DDL:
+                            connection.execute(text(statement))
+                    mode = 'fts5'
+                except Exception:
+                    # sqlite built without FTS5
+                    pass
+        elif engine.dialect.name == 'mysql':
+            indexes = inspect(connection).get_indexes('listing')
+            if 'ft_listing_text' not in [ix['name'] for ix in indexes]:
+                connection.execute(text(MYSQL_DDL))
+            mode = 'fulltext'
+
+    modes[engine] = mode
+    return mode
+
+
+def terms_of(query):
+    '''
+    Splits a search into lower case words, dropping any syntax of the
+    underlying full text engine
+    '''
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def search_ids(session, terms, limit, offset=0):
+    '''
+    Finds the listings containing every term, best match first
+      Parameters:
+        session (Session): database session
+        terms (list):      words from terms_of
+        limit (int):       maximum number of ids returned
+        offset (int):      number of best matches skipped
+      Returns:
+        A list of listing ids
+    '''
+    engine = session.get_bind()
+    mode = modes.get(engine) or create_index(engine)
+    params = {'limit': limit, 'offset': offset}
+
+    if mode == 'fts5':
+        params['match'] = ' '.join('"%s"' % term for term in terms)
+        statement = '''SELECT rowid FROM listing_fts
+            WHERE listing_fts MATCH :match
+            ORDER BY rank, rowid LIMIT :limit OFFSET :offset'''
+    elif mode == 'fulltext':
+        params['match'] = ' '.join('+%s' % term for term in terms)
+        statement = '''SELECT id FROM listing
+            WHERE MATCH(title, description) AGAINST (:match IN BOOLEAN MODE)
+            ORDER BY MATCH(title, description)
+                AGAINST (:match IN BOOLEAN MODE) DESC, id
+            LIMIT :limit OFFSET :offset'''
+    else:
+        conditions = []
+        for i, term in enumerate(terms):
+            params['term%i' % i] = '%' + term + '%'
+            conditions.append('(title LIKE :term{0} OR description LIKE '
+                              ':term{0})'.format(i))
+        statement = '''SELECT id FROM listing WHERE %s
+            ORDER BY id LIMIT :limit OFFSET :offset''' % ' AND '.join(
+            conditions)
+
+    return [row[0] for row in session.execute(text(statement), params)]
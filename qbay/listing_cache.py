@@ -0,0 +1,148 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from qbay.metrics import Counter
+
+
+'''
+Read-through cache of listings, turned on by LISTING_CACHE. The pages
+of the listing tables read listings as CachedListing tuples: one per
+listing, plus the ids of every page and of every owner's listings, so a
+page served from the cache runs no query at all. create_listing and
+update_listing drop exactly the entries they make stale, see
+qbay.models.
+
+Entries live in a backend. MemoryBackend, an LRU with a time to live,
+is private to the process, so under gunicorn a worker may serve a
+listing changed through another worker until the entry expires.
+RedisBackend (listing_cache_url, needs the redis package) is shared by
+all workers, and any object with the same four methods can be set as
+LISTING_CACHE_BACKEND.
+'''
+
+# the fields shown by the listing pages, booking_version is left out
+# since every booking changes it
+CachedListing = namedtuple('CachedListing', (
+    'id', 'title', 'description', 'price', 'last_modified_date',
+    'owner_id'))
+
+cache_events = Counter(
+    'qbay_cache_events_total', 'Lookups and evictions of the caches',
+    ('cache', 'event'))
+
+
+def cached_listing(listing):
+    return CachedListing(listing.id, listing.title, listing.description,
+                         listing.price, listing.last_modified_date,
+                         listing.owner_id)
+
+
+class MemoryBackend:
+    '''
+    In-process LRU cache whose entries expire
+      Attributes:
+        size (int):      entries kept, the least recently used one is
+                         evicted first
+        ttl (float):     seconds an entry is served
+        name (str):      cache label of the eviction counter
+    '''
+
+    def __init__(self, size, ttl, name='listing'):
+        self.size = size
+        self.ttl = ttl
+        self.name = name
+        self.lock = threading.Lock()
+        # key -> (expiry, value)
+        self.entries = OrderedDict()
+        self.counters = {}
+
+    def get_many(self, keys):
+        '''
+        Returns:
+            A dict of the keys found -> value
+        '''
+        now = time.monotonic()
+        found = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry[0] <= now:
+                    del self.entries[key]
+                    cache_events.inc(self.name, 'expired')
+                    continue
+                self.entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, values):
+        '''
+          Attributes:
+            values (dict):   key -> value
+        '''
+        expiry = time.monotonic() + self.ttl
+        with self.lock:
+            for key, value in values.items():
+                self.entries[key] = (expiry, value)
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                cache_events.inc(self.name, 'eviction')
+
+    def delete_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key, amount=1):
+        '''
+        Adds to a counter, counters never expire nor get evicted
+          Returns:
+            The new value, amount 0 reads it
+        '''
+        with self.lock:
+            value = self.counters[key] = self.counters.get(key, 0) + amount
+            return value
+
+
+class RedisBackend:
+    '''
+    Cache shared by every worker in a Redis server, which evicts by its
+    own maxmemory policy
+      Attributes:
+        url (str):       e.g. redis://cache:6379/0
+        ttl (float):     seconds an entry is served
+        prefix (str):    prepended to every key
+    '''
+
+    def __init__(self, url, ttl, prefix='qbay:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = max(int(ttl), 1)
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        return {key: pickle.loads(value)
+                for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, values):
+        pipeline = self.client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipeline.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+        pipeline.execute()
+
+    def delete_many(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def incr(self, key, amount=1):
+        # counters have no expiry, a volatile-* maxmemory policy keeps them
+        return self.client.incrby(self.prefix + key, amount)
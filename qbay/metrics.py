@@ -0,0 +1,241 @@
+import itertools
+import threading
+import time
+from functools import wraps
+
+from flask import Blueprint, Response, g, request
+
+
+'''
+Operational metrics in the Prometheus text format, served on /metrics:
+request latency histograms per endpoint and status code, outcome
+counters of the model functions and connection pool gauges.
+
+The numbers live in the process, every gunicorn worker serves its own.
+Every thread is dealt one of SHARDS locks in turn the first time it
+updates a metric, so up to SHARDS threads of a worker never wait for
+each other; a scrape adds the shards up.
+'''
+
+blueprint = Blueprint('metrics', __name__)
+
+SHARDS = 16
+
+# seconds, the default buckets of the Prometheus client libraries
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0,
+           2.5, 5.0, 7.5, 10.0)
+
+# every Counter and Histogram, in the order they are rendered
+registry = []
+
+# the shard of each thread, dealt round robin; thread idents are
+# addresses aligned to pages on Linux, so ident % SHARDS is always 0
+thread_shard = threading.local()
+next_shard = itertools.count()
+
+
+class Counter:
+    '''
+    A monotonic counter for each combination of label values
+      Attributes:
+        name (str):      metric name
+        help (str):      description
+        labels (tuple):  label names
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.shards = [(threading.Lock(), {}) for _ in range(SHARDS)]
+        registry.append(self)
+
+    def shard(self):
+        index = getattr(thread_shard, 'index', None)
+        if index is None:
+            index = thread_shard.index = next(next_shard) % SHARDS
+        return self.shards[index]
+
+    def inc(self, *values, amount=1):
+        lock, counts = self.shard()
+        with lock:
+            counts[values] = counts.get(values, 0) + amount
+
+    def collect(self):
+        '''
+        Returns:
+            A dict of label values -> total over the shards
+        '''
+        totals = {}
+        for lock, counts in self.shards:
+            with lock:
+                for values, count in counts.items():
+                    totals[values] = totals.get(values, 0) + count
+        return totals
+
+    def samples(self):
+        for values, count in sorted(self.collect().items()):
+            yield self.name, dict(zip(self.labels, values)), count
+
+
+class Histogram(Counter):
+    '''
+    Observations sorted into cumulative buckets, for each combination
+    of label values
+      Attributes:
+        name (str):      metric name
+        help (str):      description
+        labels (tuple):  label names
+        buckets (tuple): upper bounds, ascending
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, amount, *values):
+        lock, states = self.shard()
+        with lock:
+            state = states.get(values)
+            if state is None:
+                # one count per bucket, then +Inf and the sum
+                state = states[values] = [0] * (len(self.buckets) + 1) + [0]
+            for i, bound in enumerate(self.buckets):
+                if amount <= bound:
+                    state[i] += 1
+                    break
+            else:
+                state[-2] += 1
+            state[-1] += amount
+
+    def collect(self):
+        totals = {}
+        for lock, states in self.shards:
+            with lock:
+                for values, state in states.items():
+                    total = totals.setdefault(values, [0] * len(state))
+                    for i, count in enumerate(state):
+                        total[i] += count
+        return totals
+
+    def samples(self):
+        for values, state in sorted(self.collect().items()):
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            bounds = [repr(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, state):
+                cumulative += count
+                yield self.name + '_bucket', dict(labels, le=bound), \
+                    cumulative
+            yield self.name + '_sum', labels, state[-1]
+            yield self.name + '_count', labels, cumulative
+
+
+request_duration = Histogram(
+    'qbay_http_request_duration_seconds', 'Time spent serving a request',
+    ('endpoint', 'method', 'status'))
+
+model_outcomes = Counter(
+    'qbay_model_outcomes_total',
+    'Calls of the model functions by result',
+    ('operation', 'outcome'))
+
+
+def counted(operation, outcomes=None):
+    '''
+    Counts the calls of a model function in model_outcomes
+      Attributes:
+        operation (str):      operation label, e.g. 'booking'
+        outcomes (function):  maps a result to its outcome labels, by
+                              default 'rejected' for None else 'ok'
+    '''
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                model_outcomes.inc(operation, 'error')
+                raise
+            if outcomes:
+                for outcome in outcomes(result):
+                    model_outcomes.inc(operation, outcome)
+            else:
+                model_outcomes.inc(
+                    operation, 'rejected' if result is None else 'ok')
+            return result
+        return wrapper
+    return decorator
+
+
+@blueprint.before_app_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@blueprint.after_app_request
+def observe_request(response):
+    if 'request_start' in g:
+        request_duration.observe(
+            time.perf_counter() - g.pop('request_start'),
+            request.endpoint or 'unmatched', request.method,
+            str(response.status_code))
+    return response
+
+
+def pool_gauges(pool):
+    '''
+    Reads the state of a connection pool
+      Attributes:
+        pool (Pool):   pool of the database engine
+      Returns:
+        A list of (name, help, value), empty for pools that do not
+        count their connections, like the one of an in-memory sqlite
+    '''
+    if not hasattr(pool, 'checkedout'):
+        return []
+    return [
+        ('qbay_db_pool_size', 'Connections the pool keeps open',
+         pool.size()),
+        ('qbay_db_pool_checked_out', 'Connections in use',
+         pool.checkedout()),
+        ('qbay_db_pool_checked_in', 'Idle connections in the pool',
+         pool.checkedin()),
+        # negative while the pool itself is not full yet
+        ('qbay_db_pool_overflow', 'Connections open beyond the pool size',
+         max(pool.overflow(), 0)),
+    ]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def render(gauges, metrics=()):
+    '''
+    Formats gauges and metrics in the Prometheus text exposition format
+    '''
+    lines = []
+    for name, help, value in gauges:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s %s' % (name, value))
+    for metric in metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            labels = ','.join('%s="%s"' % (label, escape(label_value))
+                              for label, label_value in labels.items())
+            lines.append('%s{%s} %s' % (name, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+@blueprint.route('/metrics', methods=['GET'])
+def metrics():
+    # qbay.models imports this module
+    from qbay.models import db
+    return Response(render(pool_gauges(db.engine.pool), registry),
+                    mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,15 @@
-import re
-import string
-from qbay import app
+from qbay.calendar_cache import BitmapCalendar
+from qbay.listing_cache import cache_events, cached_listing
+from qbay import fulltext
+from qbay.metrics import counted
+from qbay.validation import validate, check_str_contains_upper, \
+    check_str_contains_lower, check_str_contains_special
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-from datetime import date
+from sqlalchemy import case, func, inspect, select
+from sqlalchemy.exc import IntegrityError, DatabaseError
+from datetime import date, timedelta
+import time
 
 
 '''
@@ -10,7 +17,10 @@ This file defines data models and related business logics
 '''
 
 
-db = SQLAlchemy(app)
+db = SQLAlchemy()
+
+# bump whenever a model gains a table, a column or an index
+SCHEMA_VERSION = 4
 
 
 class User(db.Model):
@@ -47,38 +57,50 @@ class User(db.Model):
         '''
         Updates user properties.
         '''
-        ut = et = st = pt = True
-        if username:
-            ut = self.update_name(username)
-        if email:
-            et = self.update_email(email)
-        if ship_addr:
-            st = self.update_address(ship_addr)
-        if postal_code:
-            pt = self.update_postal_code(postal_code)
-
-        if ut and et and st and pt:
-            return True
-        else:
-            return False
+        results = self.update_profile(username=username, email=email,
+                                      ship_addr=ship_addr,
+                                      postal_code=postal_code)
+        return all(results.values())
+
+    def update_profile(self, username: str = None, email: str = None,
+                       ship_addr: str = None, postal_code: str = None):
+        '''
+        Updates several user properties in one transaction. Every given
+        field is validated first and nothing is written unless all of
+        them are valid.
+          Attributes:
+            username (string):      new user name
+            email (string):         new user email
+            ship_addr (string):     new billing address
+            postal_code (string):   new postal code
+          Returns:
+            A dict mapping each given field to whether it was accepted
+        '''
+        fields = {'username': username, 'email': email,
+                  'ship_addr': ship_addr, 'postal_code': postal_code}
+        fields = {field: value for field, value in fields.items() if value}
+        # R1-3, R1-5, R1-6 and R3-3, the billing address is free text
+        results = {field: field == 'ship_addr' or validate(field, value)
+                   for field, value in fields.items()}
+        if not all(results.values()):
+            return results
+
+        for field, value in fields.items():
+            setattr(self, field, value)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another user already has this email
+            db.session.rollback()
+            results['email'] = False
+        return results
 
     def update_name(self, name):
         '''
         A user is able to update his/her user name.
         '''
-        # R1-5 Username has to be non-empty
-        if name == '':
-            return False
-
-        # R1-5 Alpahnumerical, and space allowed only as not prefix/suffix
-        name_validation = re.compile('^(?! )[A-Za-z0-9 ]*(?<! )$')
-        if not re.fullmatch(name_validation, name):
-            return False
-
-        # R1-6 Username has to be longer than 2 but shorter than 20
-        if len(name) < 3:
-            return False
-        elif len(name) > 19:
+        # R1-5 and R1-6
+        if not validate('username', name):
             return False
 
         self.username = name
@@ -89,13 +111,8 @@ class User(db.Model):
         '''
         A user is able to update his/her user email.
         '''
-        # R1-1 check if the email is empty
-        if not email:
-            return False
-        # R1-3 The email has to follow addr-spec defined in RFC 5322
-        email_val = re.compile(
-            r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(.[A-Z|a-z]{2,})+')
-        if not re.fullmatch(email_val, email):
+        # R1-1 and R1-3
+        if not validate('email', email):
             return False
 
         self.email = email
@@ -114,8 +131,7 @@ class User(db.Model):
         '''
         A user is able to update his/her postal code.
         '''
-        canadian_postal_code = re.compile('[A-Z][0-9][A-Z] [0-9][A-Z][0-9]')
-        if not re.fullmatch(canadian_postal_code, postal_code):
+        if not validate('postal_code', postal_code):
             return False
 
         self.postal_code = postal_code
@@ -138,7 +154,7 @@ class Review(db.Model):
     user_id = db.Column(
         db.Integer, db.ForeignKey('user.id'), nullable=False)
     listing_id = db.Column(
-        db.Integer, db.ForeignKey('listing.id'), nullable=False)
+        db.Integer, db.ForeignKey('listing.id'), nullable=False, index=True)
     review_text = db.Column(
         db.String(2000), nullable=False)
     date = db.Column(
@@ -158,6 +174,7 @@ class Listing(db.Model):
         price (Decimal):           listing price
         last_modified_date (Date): last modified date of listing
         owner_id (Integer):        listing owner's id
+        booking_version (Integer): bumped by every booking of the listing
     '''
     id = db.Column(
         db.Integer, primary_key=True)
@@ -170,7 +187,9 @@ class Listing(db.Model):
     last_modified_date = db.Column(
         db.Date)
     owner_id = db.Column(
-        db.Integer, db.ForeignKey('user.id'), nullable=False)
+        db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    booking_version = db.Column(
+        db.Integer, nullable=False, default=0)
 
     def __repr__(self):
         return '<Listing %r>' % self.title
@@ -187,8 +206,17 @@ class Booking(db.Model):
         start_date (Date)          start date of stay
         end_date (Date)            end date of stay
     '''
+    __table_args__ = (
+        # per-listing interval index, sorted by the end of the stays so
+        # an overlap check only visits stays ending after the new one
+        # starts, also serves every lookup by listing_id alone
+        db.Index('ix_booking_listing_end',
+                 'listing_id', 'end_date', 'start_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False,
+                        index=True)
     listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'),
                            nullable=False)
     booking_date = db.Column(db.Date, default=date.today())
@@ -197,8 +225,648 @@ class Booking(db.Model):
 
     def __repr__(self):
         return '<Booking %r>' % self.id
-    
-    
+
+
+class SchemaVersion(db.Model):
+    '''
+    Schema version model
+      Attributes:
+        version (Integer):         SCHEMA_VERSION the tables were made for
+    '''
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    def __repr__(self):
+        return '<SchemaVersion %r>' % self.version
+
+
+class CatalogVersion(db.Model):
+    '''
+    Catalog version model, a single row counting the listing changes,
+    so cached renderings of the listings can be keyed by it
+      Attributes:
+        id (Integer):              always 1
+        version (Integer):         bumped by create_listing and
+                                   update_listing, at least the unix
+                                   time of the last change
+    '''
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<CatalogVersion %r>' % self.version
+
+
+class Occupancy(db.Model):
+    '''
+    Occupancy model, one row per booked day of a listing. Only kept up
+    to date when app.config['OCCUPANCY_TABLE'] is set.
+      Attributes:
+        listing_id (Integer):      listing id
+        day (Date):                booked day
+        booking_id (Integer):      booking holding the day
+    '''
+    listing_id = db.Column(db.Integer, db.ForeignKey('listing.id'),
+                           primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    booking_id = db.Column(db.Integer, db.ForeignKey('booking.id'),
+                           nullable=False)
+
+    def __repr__(self):
+        return '<Occupancy %r %r>' % (self.listing_id, self.day)
+
+
+def occupancy_rows(booking):
+    '''
+    Lists the occupancy rows of every day of a booking's stay
+      Attributes:
+        booking (Booking):     a flushed booking
+      Returns:
+        A list of dicts ready for a bulk insert into Occupancy
+    '''
+    days = (booking.end_date - booking.start_date).days + 1
+    return [{'listing_id': booking.listing_id,
+             'day': booking.start_date + timedelta(days=i),
+             'booking_id': booking.id} for i in range(days)]
+
+
+def occupy(bookings):
+    '''
+    Records the days of new bookings in the occupancy table, inside the
+    current transaction. Does nothing unless OCCUPANCY_TABLE is set.
+      Attributes:
+        bookings (list):       bookings added to the session
+    '''
+    if not current_app.config.get('OCCUPANCY_TABLE') or not bookings:
+        return
+
+    # bookings need their ids
+    db.session.flush()
+    rows = []
+    for booking in bookings:
+        rows.extend(occupancy_rows(booking))
+    db.session.execute(Occupancy.__table__.insert(), rows)
+
+
+def rebuild_occupancy(chunk_size: int = 1000):
+    '''
+    Regenerates the whole occupancy table from the bookings. Databases
+    made before create_booking rejected surrounding stays may hold
+    overlapping stays, a day booked twice goes to the earliest booking.
+      Attributes:
+        chunk_size (int):      bookings read and written per round trip
+      Returns:
+        The number of occupancy rows written
+    '''
+    db.session.execute(Occupancy.__table__.delete())
+
+    # bookings come in id order, so the first row of a day wins
+    insert = Occupancy.__table__.insert() \
+        .prefix_with('OR IGNORE', dialect='sqlite') \
+        .prefix_with('IGNORE', dialect='mysql')
+    after_id = 0
+    while after_id is not None:
+        bookings, after_id = paginate_by_id(Booking.query, Booking,
+                                            after_id, chunk_size)
+        rows = []
+        for booking in bookings:
+            rows.extend(occupancy_rows(booking))
+        if rows:
+            db.session.execute(insert, rows)
+
+    db.session.commit()
+    return Occupancy.query.count()
+
+
+def is_listing_free(listing_id: int, day: date):
+    '''
+    Checks whether a listing is free on a day
+      Attributes:
+        listing_id (int):      listing id
+        day (date):            day to check
+      Returns:
+        True if nobody booked the listing on that day otherwise False
+    '''
+    if current_app.config.get('OCCUPANCY_TABLE'):
+        return db.session.get(Occupancy, (listing_id, day)) is None
+    return find_booking_conflict(listing_id, day, day) is None
+
+
+def occupancy_rate(listing_id: int, start_date: date, end_date: date):
+    '''
+    Computes the share of booked days of a listing in a period
+      Attributes:
+        listing_id (int):      listing id
+        start_date (date):     first day of the period
+        end_date (date):       last day of the period
+      Returns:
+        The booked share between 0 and 1, otherwise None if the period
+        is invalid
+    '''
+    if not isinstance(start_date, date) or not isinstance(end_date, date):
+        return None
+    if start_date > end_date:
+        return None
+
+    days = (end_date - start_date).days + 1
+    if current_app.config.get('OCCUPANCY_TABLE'):
+        booked = Occupancy.query \
+            .filter(Occupancy.listing_id == listing_id,
+                    Occupancy.day >= start_date,
+                    Occupancy.day <= end_date) \
+            .count()
+        return booked / days
+
+    booked = 0
+    stays = Booking.query \
+        .filter(Booking.listing_id == listing_id,
+                Booking.start_date <= end_date,
+                Booking.end_date >= start_date)
+    for stay in stays:
+        booked += (min(stay.end_date, end_date) -
+                   max(stay.start_date, start_date)).days + 1
+    return booked / days
+
+
+def find_booking_conflict(listing_id: int, start_date: date,
+                          end_date: date):
+    '''
+    Finds a booking of the listing that overlaps the given stay
+      Attributes:
+        listing_id (int):      listing id
+        start_date (date):     start date of stay (inclusive)
+        end_date (date):       end date of stay (inclusive)
+      Returns:
+        The overlapping booking object if any otherwise None
+    '''
+    # Databases made before create_booking rejected surrounding stays may
+    # hold stays nested in one another, so every overlapping stay is a
+    # candidate. ix_booking_listing_end seeks to the stays ending on or
+    # after start_date: none for a stay after the last booking, and only
+    # the later bookings of the listing otherwise.
+    return Booking.query \
+        .filter(Booking.listing_id == listing_id,
+                Booking.end_date >= start_date,
+                Booking.start_date <= end_date) \
+        .first()
+
+
+def calendars():
+    '''
+    Returns:
+        The app's dict listing id -> BitmapCalendar of its next
+        BITMAP_CALENDAR_DAYS days
+    '''
+    return current_app.extensions['calendars']
+
+
+def load_calendars(versions):
+    '''
+    Makes sure the cached calendars of listings are current, rebuilding
+    the stale ones with one query
+      Attributes:
+        versions (dict):       listing id -> current booking_version
+      Returns:
+        A dict listing id -> BitmapCalendar
+    '''
+    first_day = date.today()
+    days = current_app.config['BITMAP_CALENDAR_DAYS']
+    cached = calendars()
+
+    current = {}
+    for listing_id, version in versions.items():
+        calendar = cached.get(listing_id)
+        if calendar is not None and calendar.version == version and \
+           calendar.first_day == first_day:
+            current[listing_id] = calendar
+
+    stale = [listing_id for listing_id in versions
+             if listing_id not in current]
+    if stale:
+        last_day = first_day + timedelta(days=days - 1)
+        stays = {listing_id: [] for listing_id in stale}
+        rows = db.session.query(Booking.listing_id, Booking.start_date,
+                                Booking.end_date) \
+            .filter(Booking.listing_id.in_(stale),
+                    Booking.start_date <= last_day,
+                    Booking.end_date >= first_day)
+        for listing_id, start_date, end_date in rows:
+            stays[listing_id].append((start_date, end_date))
+
+        for listing_id in stale:
+            calendar = BitmapCalendar(versions[listing_id], first_day, days,
+                                      stays[listing_id])
+            cached[listing_id] = current[listing_id] = calendar
+
+    return current
+
+
+def has_booking_conflict(listing, start_date: date, end_date: date):
+    '''
+    Checks whether a stay overlaps a booking of the listing, from the
+    bitmap calendar when enabled and the stay lies inside its window
+      Attributes:
+        listing (Listing):     listing to check
+        start_date (date):     start date of stay (inclusive)
+        end_date (date):       end date of stay (inclusive)
+      Returns:
+        True if the stay overlaps a booking otherwise False
+    '''
+    if current_app.config.get('BITMAP_CALENDAR'):
+        current = load_calendars({listing.id: listing.booking_version})
+        calendar = current[listing.id]
+        if calendar.covers(start_date, end_date):
+            return not calendar.is_free(start_date, end_date)
+
+    return find_booking_conflict(listing.id, start_date,
+                                 end_date) is not None
+
+
+def calendar_booked(listing_id: int, version: int,
+                    start_date: date, end_date: date):
+    '''
+    Adds a committed stay to the cached calendar of its listing, or drops
+    the calendar if it cannot be updated in place
+      Attributes:
+        listing_id (int):      listing id
+        version (int):         booking_version the booking claimed
+        start_date (date):     start date of stay (inclusive)
+        end_date (date):       end date of stay (inclusive)
+    '''
+    cached = calendars()
+    calendar = cached.get(listing_id)
+    if calendar is None:
+        return
+    if calendar.version == version and \
+       calendar.covers(start_date, end_date):
+        cached[listing_id] = calendar.booked(start_date, end_date,
+                                             version + 1)
+    else:
+        cached.pop(listing_id, None)
+
+
+def available_listing_ids(listing_ids, start_date: date, end_date: date):
+    '''
+    Picks the listings that are free for a whole stay, from the bitmap
+    calendars when the stay lies inside their window
+      Attributes:
+        listing_ids (list):    ids of the listings to check
+        start_date (date):     start date of stay (inclusive)
+        end_date (date):       end date of stay (inclusive)
+      Returns:
+        A sorted list of the free listing ids, otherwise None if the
+        stay is invalid
+    '''
+    if not isinstance(start_date, date) or not isinstance(end_date, date):
+        return None
+    if start_date > end_date:
+        return None
+
+    versions = dict(db.session.query(Listing.id, Listing.booking_version)
+                    .filter(Listing.id.in_(listing_ids)))
+
+    free = []
+    for listing_id, calendar in sorted(load_calendars(versions).items()):
+        if calendar.covers(start_date, end_date):
+            if calendar.is_free(start_date, end_date):
+                free.append(listing_id)
+        elif find_booking_conflict(listing_id, start_date,
+                                   end_date) is None:
+            free.append(listing_id)
+    return free
+
+
+# Largest page a listing search may ask for
+MAX_PAGE_SIZE = 100
+
+
+def paginate_by_id(query, model, after_id: int = 0, page_size: int = 20):
+    '''
+    Reads one page of a query with keyset pagination on the primary key
+      Attributes:
+        query (Query):         query to paginate
+        model (db.Model):      model the query returns
+        after_id (int):        last id of the previous page (0 for first)
+        page_size (int):       maximum number of rows in the page
+      Returns:
+        A tuple (rows, next_after_id), next_after_id is None on the
+        last page
+    '''
+    # fetch one extra row to know whether another page follows
+    rows = query.filter(model.id > after_id) \
+        .order_by(model.id) \
+        .limit(page_size + 1) \
+        .all()
+
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def page_listings(after_id: int = 0, before_id: int = None,
+                  page_size: int = 20):
+    '''
+    Reads one page of all listings ordered by id, seeking from a cursor
+    instead of skipping rows with OFFSET
+      Attributes:
+        after_id (int):        last id of the previous page (next page)
+        before_id (int):       first id of the following page (previous
+                               page), used instead of after_id if given
+        page_size (int):       maximum number of listings in the page
+      Returns:
+        A tuple (listings, prev_before_id, next_after_id), the cursors
+        are None when there is no page in that direction
+    '''
+    if before_id is None:
+        listings, next_after = paginate_by_id(Listing.query, Listing,
+                                              after_id, page_size)
+        prev_before = listings[0].id if listings and after_id > 0 else None
+        return listings, prev_before, next_after
+
+    # walk backwards from the cursor, one extra row tells if more exist
+    listings = Listing.query \
+        .filter(Listing.id < before_id) \
+        .order_by(Listing.id.desc()) \
+        .limit(page_size + 1) \
+        .all()
+    more = len(listings) > page_size
+    listings = listings[:page_size][::-1]
+    if not listings:
+        return listings, None, None
+    return listings, listings[0].id if more else None, listings[-1].id
+
+
+def listing_cache():
+    '''
+    Returns:
+        The listing cache backend of the app, None if LISTING_CACHE is
+        off
+    '''
+    return current_app.extensions.get('listing_cache')
+
+
+def cache_get(cache, keys):
+    '''
+    Looks keys up in the listing cache, counting the hits and misses
+    '''
+    found = cache.get_many(keys)
+    cache_events.inc('listing', 'hit', amount=len(found))
+    cache_events.inc('listing', 'miss', amount=len(keys) - len(found))
+    return found
+
+
+def cache_fill(cache, values, generation: int):
+    '''
+    Stores values read from the database, unless a listing was created
+    or updated since generation was read: they could predate the change
+    and outlive its invalidation
+    '''
+    if cache.incr('listing:generation', 0) == generation:
+        cache.set_many(values)
+
+
+def listing_prefix(version: int = None):
+    '''
+    Prefix of the listing cache keys. Entries read for a known catalog
+    version are kept under it: the version is read before the listings,
+    so they are at least that recent, and a change made through any
+    process moves every reader to new keys.
+    '''
+    return 'listing:' if version is None else 'listing:%i:' % version
+
+
+def listing_entries(listings, prefix='listing:'):
+    return {'%s%i' % (prefix, listing.id): cached_listing(listing)
+            for listing in listings}
+
+
+def cached_listings(listing_ids, version: int = None):
+    '''
+    Reads listings through the listing cache, the missing ones with one
+    query
+      Attributes:
+        listing_ids (list):    ids of the listings
+        version (int):         catalog version read by the request, if
+                               any, see listing_prefix
+      Returns:
+        A list of the listings that exist, in the order of listing_ids,
+        as CachedListing or as Listing when the cache is off
+    '''
+    cache = listing_cache()
+    if cache is None:
+        listings = {listing.id: listing for listing in
+                    Listing.query.filter(Listing.id.in_(listing_ids))}
+        return [listings[listing_id] for listing_id in listing_ids
+                if listing_id in listings]
+
+    prefix = listing_prefix(version)
+    keys = ['%s%i' % (prefix, listing_id) for listing_id in listing_ids]
+    found = cache_get(cache, keys)
+    missing = [listing_id for listing_id, key in zip(listing_ids, keys)
+               if key not in found]
+    if missing:
+        generation = cache.incr('listing:generation', 0)
+        loaded = listing_entries(
+            Listing.query.filter(Listing.id.in_(missing)), prefix)
+        cache_fill(cache, loaded, generation)
+        found.update(loaded)
+    return [found[key] for key in keys if key in found]
+
+
+def cached_page_listings(after_id: int = 0, before_id: int = None,
+                         page_size: int = 20, version: int = None):
+    '''
+    page_listings through the listing cache, which keeps the ids of the
+    page apart from the listings so an update only drops the listing
+      Returns:
+        A tuple (listings, prev_before_id, next_after_id)
+    '''
+    cache = listing_cache()
+    if cache is None:
+        return page_listings(after_id, before_id, page_size)
+
+    # every created listing moves the pages to new keys
+    prefix = listing_prefix(version)
+    key = '%spage:%i:%i:%s:%i' % (prefix, cache.incr('listing:pages', 0),
+                                  after_id, before_id, page_size)
+    page = cache_get(cache, [key]).get(key)
+    if page is not None:
+        listing_ids, prev_before, next_after = page
+        return cached_listings(listing_ids, version), prev_before, \
+            next_after
+
+    generation = cache.incr('listing:generation', 0)
+    listings, prev_before, next_after = page_listings(after_id, before_id,
+                                                      page_size)
+    values = listing_entries(listings, prefix)
+    values[key] = ([listing.id for listing in listings], prev_before,
+                   next_after)
+    cache_fill(cache, values, generation)
+    return [values['%s%i' % (prefix, listing.id)] for listing in listings], \
+        prev_before, next_after
+
+
+def cached_owner_listings(owner_id: int, version: int = None):
+    '''
+    Reads the listings of an owner through the listing cache
+      Returns:
+        A list of CachedListing, or of Listing when the cache is off
+    '''
+    cache = listing_cache()
+    if cache is None:
+        return Listing.query.filter_by(owner_id=owner_id).all()
+
+    prefix = listing_prefix(version)
+    key = '%sowner:%i' % (prefix, owner_id)
+    listing_ids = cache_get(cache, [key]).get(key)
+    if listing_ids is not None:
+        return cached_listings(listing_ids, version)
+
+    generation = cache.incr('listing:generation', 0)
+    listings = Listing.query.filter_by(owner_id=owner_id).all()
+    values = listing_entries(listings, prefix)
+    values[key] = [listing.id for listing in listings]
+    cache_fill(cache, values, generation)
+    return [values['%s%i' % (prefix, listing.id)] for listing in listings]
+
+
+def listings_changed(listing_ids=(), owner_ids=(), created=False):
+    '''
+    Drops the cached entries made stale by a committed change
+      Attributes:
+        listing_ids (list):    ids of the updated listings
+        owner_ids (list):      owners whose set of listings changed
+        created (bool):        whether listings were added, which
+                               changes the pages
+    '''
+    cache = listing_cache()
+    if cache is None:
+        return
+    # first, so reads running meanwhile do not store what they read
+    cache.incr('listing:generation')
+    if created:
+        cache.incr('listing:pages')
+    cache.delete_many(['listing:%i' % listing_id
+                       for listing_id in listing_ids] +
+                      ['listing:owner:%i' % owner_id
+                       for owner_id in owner_ids])
+
+
+def search_available_listings(start_date: date, end_date: date,
+                              max_price: float = None, after_id: int = 0,
+                              page_size: int = 20):
+    '''
+    Finds listings that are free for the whole stay
+      Attributes:
+        start_date (date):     start date of stay (inclusive)
+        end_date (date):       end date of stay (inclusive)
+        max_price (float):     highest accepted price (optional)
+        after_id (int):        last listing id of the previous page
+        page_size (int):       maximum number of listings returned
+      Returns:
+        A tuple (listings, next_after_id) if succeeded otherwise None
+    '''
+    # Check types
+    if not isinstance(start_date, date) or not isinstance(end_date, date):
+        return None
+
+    if start_date > end_date:
+        return None
+
+    if max_price is not None and \
+       not isinstance(max_price, (int, float)):
+        return None
+
+    if not isinstance(after_id, int) or after_id < 0:
+        return None
+
+    if not isinstance(page_size, int) or \
+       page_size < 1 or page_size > MAX_PAGE_SIZE:
+        return None
+
+    # Same seek as find_booking_conflict, correlated to every listing:
+    # the stays ending on or after start_date, the listing is free when
+    # none of them starts by end_date
+    booked = db.session.query(Booking.id) \
+        .filter(Booking.listing_id == Listing.id,
+                Booking.end_date >= start_date,
+                Booking.start_date <= end_date) \
+        .correlate(Listing) \
+        .exists()
+
+    query = Listing.query.filter(~booked)
+
+    if max_price is not None:
+        query = query.filter(Listing.price <= max_price)
+
+    return paginate_by_id(query, Listing, after_id, page_size)
+
+
+# How many times a booking is retried when another booking of the same
+# listing is committed concurrently
+BOOKING_RETRIES = 5
+
+# Largest batch create_bookings accepts, its ids go into IN (...) lists
+MAX_BOOKING_BATCH = 100
+
+
+def claim_listing(listing):
+    '''
+    Bumps the booking version of a listing, unless another transaction
+    has already done so since the listing was read. The update takes the
+    listing's row lock until commit, so bookings of one listing are
+    serialized while other listings stay independent.
+      Attributes:
+        listing (Listing):     listing about to be booked
+      Returns:
+        True if the listing was claimed otherwise False
+    '''
+    claimed = Listing.query \
+        .filter_by(id=listing.id,
+                   booking_version=listing.booking_version) \
+        .update({Listing.booking_version: Listing.booking_version + 1},
+                synchronize_session=False)
+    return claimed == 1
+
+
+def search_listings(query: str, page: int = 1, page_size: int = 20):
+    '''
+    Finds listings whose title or description contain every word of a
+    search, best match first
+      Attributes:
+        query (str):           words to search for
+        page (int):            page of the results, starting at 1
+        page_size (int):       maximum number of listings returned
+      Returns:
+        A tuple (listings, next_page) if succeeded otherwise None,
+        next_page is None on the last page
+    '''
+    if not isinstance(query, str):
+        return None
+
+    if not isinstance(page, int) or page < 1:
+        return None
+
+    if not isinstance(page_size, int) or \
+       page_size < 1 or page_size > MAX_PAGE_SIZE:
+        return None
+
+    terms = fulltext.terms_of(query)
+    if not terms:
+        return [], None
+
+    # fetch one extra id to know whether another page follows
+    ids = fulltext.search_ids(db.session, terms, page_size + 1,
+                              (page - 1) * page_size)
+    next_page = page + 1 if len(ids) > page_size else None
+    ids = ids[:page_size]
+
+    found = {listing.id: listing for listing in
+             Listing.query.filter(Listing.id.in_(ids))}
+    return [found[i] for i in ids if i in found], next_page
+
+
+@counted('booking')
 def create_booking(user_id: int, listing_id: int, 
                    start_date: date, end_date: date):
     '''
@@ -229,55 +897,328 @@ def create_booking(user_id: int, listing_id: int,
     if start_date > end_date:
         return None
     
-    listing = Listing.query.filter_by(id=listing_id).first()
-    
-    # listing does not exist
-    if listing is None:
-        return None
-    
-    # cannot book for user's own listing
-    if user_id == listing.owner_id:
-        return None
-    
-    user = User.query.filter_by(id=user_id).first()
-    
-    # user does not exist
-    if user is None:
-        return None
-    
-    # user is too poor
-    if listing.price > user.balance:
-        return None
-    
-    bookings = Booking.query.filter_by(listing_id=listing_id).all()
-    
-    # check for date overlaps
-    for book in bookings:
-        if start_date >= book.start_date and \
-           start_date <= book.end_date:
+    for _ in range(BOOKING_RETRIES):
+        listing = Listing.query.filter_by(id=listing_id).first()
+
+        # listing does not exist
+        if listing is None:
             return None
-        
-        if end_date >= book.start_date and \
-           end_date <= book.end_date:
+
+        # cannot book for user's own listing
+        if user_id == listing.owner_id:
             return None
-    
-    # create booking object
-    booking = Booking(user_id=user_id, listing_id=listing_id, 
-                      booking_date=date.today(), start_date=start_date,
-                      end_date=end_date)
-    
-    # add it to the current database session
-    db.session.add(booking)
-    # actually save the user object
+
+        user = User.query.filter_by(id=user_id).first()
+
+        # user does not exist
+        if user is None:
+            return None
+
+        # user is too poor
+        if listing.price > user.balance:
+            return None
+
+        # check for date overlaps
+        if has_booking_conflict(listing, start_date, end_date):
+            return None
+
+        # another booking of the listing was committed since we read
+        # it, start over with fresh data
+        version = listing.booking_version
+        if not claim_listing(listing):
+            db.session.rollback()
+            continue
+
+        # create booking object
+        booking = Booking(user_id=user_id, listing_id=listing_id,
+                          booking_date=date.today(), start_date=start_date,
+                          end_date=end_date)
+
+        # add it to the current database session
+        db.session.add(booking)
+        occupy([booking])
+        # actually save the user object
+        db.session.commit()
+        calendar_booked(listing_id, version, start_date, end_date)
+
+        return booking
+
+    return None
+
+
+# Result codes of create_bookings, one per batch item
+BOOKING_OK = 'ok'
+BOOKING_INVALID = 'invalid'
+BOOKING_NO_LISTING = 'listing_not_found'
+BOOKING_NO_USER = 'user_not_found'
+BOOKING_OWN_LISTING = 'own_listing'
+BOOKING_NO_FUNDS = 'insufficient_balance'
+BOOKING_CONFLICT = 'conflict'
+BOOKING_BATCH_CONFLICT = 'batch_conflict'
+BOOKING_BUSY = 'busy'
+
+
+@counted('booking_batch',
+         lambda results: [code for code, booking in results or ()])
+def create_bookings(batch):
+    '''
+    Creates many bookings at once, committed in a single transaction
+      Attributes:
+        batch (list):          dicts with the create_booking arguments
+                               user_id, listing_id, start_date, end_date
+      Returns:
+        A list with one (result code, booking object or None) tuple per
+        item of the batch, in order, otherwise None if batch is not a list
+        or longer than MAX_BOOKING_BATCH. Items are BOOKING_BUSY if the
+        batch kept racing other bookings.
+    '''
+    if not isinstance(batch, list) or len(batch) > MAX_BOOKING_BATCH:
+        return None
+
+    # Check types, same rules as create_booking
+    items = []
+    for item in batch:
+        if not isinstance(item, dict):
+            items.append(None)
+            continue
+        user_id = item.get('user_id')
+        listing_id = item.get('listing_id')
+        start_date = item.get('start_date')
+        end_date = item.get('end_date')
+        if not isinstance(user_id, int) or \
+           not isinstance(listing_id, int) or \
+           not isinstance(start_date, date) or \
+           not isinstance(end_date, date) or \
+           start_date > end_date:
+            items.append(None)
+            continue
+        items.append((user_id, listing_id, start_date, end_date))
+
+    valid = [item for item in items if item is not None]
+    if not valid:
+        return [(BOOKING_INVALID, None)] * len(items)
+
+    for _ in range(BOOKING_RETRIES):
+        results, listings = plan_bookings(items, valid)
+
+        # claim every booked listing, start over with fresh data if any
+        # of them was booked concurrently
+        booked = {booking.listing_id for code, booking in results
+                  if code == BOOKING_OK}
+        if all(claim_listing(listings[listing_id])
+               for listing_id in sorted(booked)):
+            # save every accepted booking in one transaction
+            bookings = [booking for code, booking in results
+                        if code == BOOKING_OK]
+            db.session.add_all(bookings)
+            occupy(bookings)
+            db.session.commit()
+            cached = calendars()
+            for listing_id in booked:
+                cached.pop(listing_id, None)
+            return results
+
+        db.session.rollback()
+
+    return [(BOOKING_BUSY, None) if code == BOOKING_OK else (code, None)
+            for code, booking in results]
+
+
+def plan_bookings(items, valid):
+    '''
+    Decides the result of every batch item without writing anything
+      Attributes:
+        items (list):          (user_id, listing_id, start_date, end_date)
+                               tuples, None for invalid items
+        valid (list):          the items that are not None
+      Returns:
+        A tuple (results, listings) with the create_bookings results and
+        the listings of the batch keyed by id
+    '''
+    # One query per entity type for the whole batch
+    listing_ids = {item[1] for item in valid}
+    listings = {listing.id: listing for listing in
+                Listing.query.filter(Listing.id.in_(listing_ids))}
+    users = {user.id: user for user in
+             User.query.filter(User.id.in_({item[0] for item in valid}))}
+    stored = Booking.query \
+        .filter(Booking.listing_id.in_(listing_ids),
+                Booking.start_date <= max(item[3] for item in valid),
+                Booking.end_date >= min(item[2] for item in valid))
+
+    # Stored stays per listing, then the stays accepted from this batch.
+    # Stored stays may overlap each other on databases made before
+    # create_booking rejected surrounding stays, so every one is checked.
+    stays = {listing_id: [] for listing_id in listing_ids}
+    for book in stored:
+        stays[book.listing_id].append((book.start_date, book.end_date))
+    accepted = {listing_id: [] for listing_id in listing_ids}
+
+    def overlaps(listing_stays, start_date, end_date):
+        return any(start <= end_date and end >= start_date
+                   for start, end in listing_stays)
+
+    results = []
+    for item in items:
+        if item is None:
+            results.append((BOOKING_INVALID, None))
+            continue
+        user_id, listing_id, start_date, end_date = item
+
+        listing = listings.get(listing_id)
+        user = users.get(user_id)
+        if listing is None:
+            results.append((BOOKING_NO_LISTING, None))
+            continue
+        if user_id == listing.owner_id:
+            results.append((BOOKING_OWN_LISTING, None))
+            continue
+        if user is None:
+            results.append((BOOKING_NO_USER, None))
+            continue
+        if listing.price > user.balance:
+            results.append((BOOKING_NO_FUNDS, None))
+            continue
+
+        if overlaps(stays[listing_id], start_date, end_date):
+            results.append((BOOKING_CONFLICT, None))
+            continue
+        if overlaps(accepted[listing_id], start_date, end_date):
+            results.append((BOOKING_BATCH_CONFLICT, None))
+            continue
+        accepted[listing_id].append((start_date, end_date))
+
+        booking = Booking(user_id=user_id, listing_id=listing_id,
+                          booking_date=date.today(), start_date=start_date,
+                          end_date=end_date)
+        results.append((BOOKING_OK, booking))
+
+    return results, listings
+
+
+# Columns added to tables that existed before, with the statement adding
+# them. The default fills the rows already there.
+COLUMN_MIGRATIONS = [
+    ('listing', 'booking_version',
+     'ALTER TABLE listing ADD booking_version INTEGER NOT NULL DEFAULT 0'),
+]
+
+
+def add_missing_columns():
+    '''
+    Adds the COLUMN_MIGRATIONS columns missing from existing tables
+    '''
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table, column, statement in COLUMN_MIGRATIONS:
+            columns = [info['name'] for info in inspector.get_columns(table)]
+            if column not in columns:
+                connection.exec_driver_sql(statement)
+
+
+# Indexes replaced by others, dropped from existing tables
+DROPPED_INDEXES = [
+    ('booking', 'ix_booking_listing_stay'),
+]
+
+
+def drop_old_indexes():
+    '''
+    Drops the DROPPED_INDEXES still present
+    '''
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table, index in DROPPED_INDEXES:
+            names = [info['name'] for info in inspector.get_indexes(table)]
+            if index not in names:
+                continue
+            if connection.dialect.name == 'mysql':
+                connection.exec_driver_sql(
+                    'DROP INDEX %s ON %s' % (index, table))
+            else:
+                connection.exec_driver_sql('DROP INDEX %s' % index)
+
+
+def create_tables():
+    '''
+    Creates the missing tables, the missing columns and indexes of
+    existing tables and the full text index of the current app's
+    database, and drops the indexes that were replaced
+    '''
+    db.create_all()
+    # create_all skips the columns and indexes of tables that already
+    # exist
+    add_missing_columns()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    # after their replacements, a foreign key may need one of them
+    drop_old_indexes()
+    fulltext.create_index(db.engine)
+
+
+def schema_version():
+    '''
+    Returns:
+        The schema version recorded by init_db, or None if it never ran
+        on this database
+    '''
+    try:
+        # on the table, the mappers need not be configured for this
+        return db.session.scalar(
+            select(func.max(SchemaVersion.__table__.c.version)))
+    except DatabaseError:
+        # no schema_version table yet
+        db.session.rollback()
+        return None
+
+
+def init_db():
+    '''
+    Brings the schema of the current app's database up to
+    SCHEMA_VERSION. Costs a single query when it already is.
+      Returns:
+        True if the schema was created or updated, False if it was
+        already current
+    '''
+    version = schema_version()
+    if version is not None and version >= SCHEMA_VERSION:
+        return False
+
+    create_tables()
+    db.session.merge(SchemaVersion(version=SCHEMA_VERSION))
+    if db.session.get(CatalogVersion, 1) is None:
+        db.session.add(CatalogVersion(id=1, version=0))
     db.session.commit()
+    return True
 
-    return booking
-    
 
-# create all tables
-db.create_all()
+def catalog_version():
+    '''
+    Returns:
+        The number of listing changes so far, None if init_db has not
+        created the counter
+    '''
+    table = CatalogVersion.__table__
+    return db.session.scalar(
+        select(table.c.version).where(table.c.id == 1))
+
+
+def bump_catalog_version():
+    '''
+    Counts a listing change, in the transaction making it. The version
+    grows by one and to at least the current unix time, so it also
+    bounds when the listings last changed, see the Last-Modified header
+    of qbay.controllers.conditional.
+    '''
+    table = CatalogVersion.__table__
+    now = int(time.time())
+    db.session.execute(table.update().where(table.c.id == 1).values(
+        version=case((table.c.version + 1 > now, table.c.version + 1),
+                     else_=now)))
 
 
+@counted('listing_update')
 def update_listing(listing, title=None, description=None, price=None):
     '''
     Updates a listing
@@ -301,22 +1242,8 @@ def update_listing(listing, title=None, description=None, price=None):
     # If title was given
     if title is not None:
 
-        # If title is of instance str
-        if not isinstance(title, str):
-            return None
-
-        # If title is a empty str
-        if title == "":
-            return None
-
-        # Satisfy R4-2
-        if len(title) > 80:
-            return None
-
-        # Satisfy R4-1
-        check = re.match("^(?! )[A-Za-z0-9 ]*(?<! )$", title)
-
-        if check is None:
+        # Satisfy R4-1 and R4-2
+        if not validate('title', title):
             return None
 
         # Satisfy R4-8
@@ -380,12 +1307,15 @@ def update_listing(listing, title=None, description=None, price=None):
         return None
 
     # Commit updates
+    bump_catalog_version()
     db.session.commit()
+    listings_changed(listing_ids=[listing.id])
 
     # Return listing
     return listing
 
 
+@counted('listing')
 def create_listing(title: str, description: str, price: float,
                    last_modified_date: date, owner_id: int):
     '''
@@ -399,18 +1329,8 @@ def create_listing(title: str, description: str, price: float,
       Returns:
         The listing object if succeeded otherwise None
     '''
-    # Satisfy R4-1
-    if title == '':
-        return None
-
-    if title[0] == ' ' or title[-1] == ' ':
-        return None
-
-    if not title.replace(' ', '').isalnum():
-        return None
-
-    # Satisfy R4-2
-    if len(title) > 80:
+    # Satisfy R4-1 and R4-2
+    if not validate('title', title):
         return None
 
     # Satisfy R4-3
@@ -455,12 +1375,15 @@ def create_listing(title: str, description: str, price: float,
 
     # add it to the current database session
     db.session.add(listing)
+    bump_catalog_version()
     # actually save the user object
     db.session.commit()
+    listings_changed(owner_ids=[owner_id], created=True)
 
     return listing
 
 
+@counted('registration')
 def register(name, email, password):
     '''
     Register a new user
@@ -472,10 +1395,6 @@ def register(name, email, password):
         The object User otherwise None
     '''
 
-    # R1-1 check if the email or password are empty
-    if not email or not password:
-        return None
-
     # ensure password is a string
     password = str(password)
 
@@ -483,38 +1402,12 @@ def register(name, email, password):
     # User.id is a primary_key and automatically generates a
     # new unique id for each new User
 
+    # R1-1 Email and password cannot be empty
     # R1-3 The email has to follow addr-spec defined in RFC 5322
-    # initial simple check
-    if ("@" not in email):
-        return None
-    # thorough check
-    email_val = re.compile(
-        r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(.[A-Z|a-z]{2,})+')
-    if not re.fullmatch(email_val, email):
-        return None
-
     # R1-4 Password has to meet the required complexity
-    # check if password is at least 6 characters,
-    # with upper, lower and special characters
-    if not (len(password) >= 6
-            and check_str_contains_lower(password)
-            and check_str_contains_upper(password)
-            and check_str_contains_special(password)):
-        return None
-
-    # R1-5 Username has to be non-empty
-    if name == '':
-        return None
-
-    # R1-5 Alpahnumerical, and space allowed only as not prefix/suffix
-    name_validation = re.compile('^(?! )[A-Za-z0-9 ]*(?<! )$')
-    if not re.fullmatch(name_validation, name):
-        return None
-
-    # R1-6 Username has to be longer than 2 but shorter than 20
-    if len(name) < 3:
-        return None
-    elif len(name) > 19:
+    # R1-5 and R1-6 Username requirements
+    if not (validate('email', email) and validate('password', password)
+            and validate('username', name)):
         return None
 
     # R1-7 check if the email has been used:
@@ -542,33 +1435,7 @@ def register(name, email, password):
     return user
 
 
-def check_str_contains_upper(str):
-    '''
-    Checks if str contains an upper case letter
-    '''
-    for x in str:
-        if x == x.upper():
-            return True
-    return False
-
-
-def check_str_contains_lower(str):
-    '''
-    Checks if str contains a lower case letter
-    '''
-    for x in str:
-        if x == x.lower():
-            return True
-    return False
-
-
-def check_str_contains_special(str):
-    '''
-    Checks if str contains punctuations
-    '''
-    return any(special in str for special in string.punctuation)
-
-
+@counted('login')
 def login(email, password):
     '''
     Check login information
@@ -583,21 +1450,9 @@ def login(email, password):
     # before checking the database.
 
     # R1-1 check if the email or password are empty
-    if not email or not password:
-        return None
     # R1-3 The email has to follow addr-spec defined in RFC 5322
-    email_val = re.compile(
-        r'([A-Za-z0-9]+[.-_])*[A-Za-z0-9]+@[A-Za-z0-9-]+(.[A-Z|a-z]{2,})+')
-    if not re.fullmatch(email_val, email):
-        return None
-
     # R1-4 Password has to meet the required complexity
-    # check if password is at least 6 characters,
-    # with upper, lower and special characters
-    if not (len(password) >= 6
-            and check_str_contains_lower(password)
-            and check_str_contains_upper(password)
-            and check_str_contains_special(password)):
+    if not (validate('email', email) and validate('password', password)):
         return None
 
     valids = User.query.filter_by(email=email, password=password).all()
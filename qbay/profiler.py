@@ -0,0 +1,208 @@
+import hashlib
+import hmac
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import (Blueprint, Response, abort, current_app, g, jsonify,
+                   request)
+
+
+'''
+Sampling request profiler. A profiled request has its thread's stack
+read every PROFILE_INTERVAL_MS by a background thread; the stacks are
+counted by route, so a route's profile shows where its wall time goes
+in Flask, Jinja and SQLAlchemy, waits on the database included.
+
+Requests are profiled at random with PROFILE_SAMPLE_RATE, or when they
+carry an unexpired X-Profile header signed with the ADMIN_TOKEN, see
+signature.
+The hooks are only registered when PROFILER is set, so a disabled
+profiler costs nothing, and requests that are not profiled pay for one
+random number. /admin/profiles summarizes the routes and
+/admin/profiles/collapsed exports the stacks in the collapsed format of
+flamegraph.pl and speedscope.
+'''
+
+blueprint = Blueprint('profiler', __name__)
+
+# frames kept per sample, from the outermost one
+DEPTH = 64
+
+
+def signature(token, path, ttl=300):
+    '''
+    Value of the X-Profile header that asks for profiles of path, the
+    path and an expiry signed with the admin token
+      Attributes:
+        token (str):   ADMIN_TOKEN of the app
+        path (str):    path of the request, without the query string
+        ttl (float):   seconds the header is accepted for
+    '''
+    expiry = int(time.time() + ttl)
+    return '%i:%s' % (expiry, path_digest(token, path, expiry))
+
+
+def path_digest(token, path, expiry):
+    return hmac.new(token.encode(), ('%i:%s' % (expiry, path)).encode(),
+                    hashlib.sha256).hexdigest()
+
+
+def signed(token, header, path):
+    '''
+    Returns:
+        True if header is a signature of path that has not expired
+    '''
+    expiry, _, digest = header.partition(':')
+    if not (expiry.isascii() and expiry.isdigit()) or \
+       int(expiry) < time.time():
+        return False
+    return hmac.compare_digest(
+        digest.encode(), path_digest(token, path, int(expiry)).encode())
+
+
+def frame_name(frame):
+    return '%s:%s' % (frame.f_globals.get('__name__', '?'),
+                      frame.f_code.co_name)
+
+
+class Profiler:
+    '''
+    Stack samples of the profiled requests of one app, by route
+      Attributes:
+        interval (float):   seconds between two samples
+    '''
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        # thread ident -> route of the profiled requests in flight
+        self.active = {}
+        self.stacks = {}
+        self.requests = Counter()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self, route):
+        '''
+        Starts sampling the current thread for route
+        '''
+        with self.lock:
+            self.active[threading.get_ident()] = route
+            # started in the gunicorn worker, not before the fork
+            if self.thread is None:
+                self.thread = threading.Thread(
+                    target=self.run, name='qbay-profiler', daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def stop(self):
+        with self.lock:
+            route = self.active.pop(threading.get_ident(), None)
+            if route is not None:
+                self.requests[route] += 1
+
+    def run(self):
+        while True:
+            # sleeps until a profiled request starts
+            self.wake.wait()
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.wake.clear()
+            self.sample()
+
+    def sample(self):
+        '''
+        Counts the current stack of every profiled request
+        '''
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, route in self.active.items():
+                frame = frames.get(ident)
+                names = []
+                while frame is not None:
+                    names.append(frame_name(frame))
+                    frame = frame.f_back
+                stack = ';'.join(reversed(names[-DEPTH:]))
+                self.stacks.setdefault(route, Counter())[stack] += 1
+
+    def summary(self, top=10):
+        '''
+        Returns:
+            A dict of route -> profiled requests, samples and the
+            functions most often on top of the stack
+        '''
+        with self.lock:
+            stacks = {route: Counter(counts)
+                      for route, counts in self.stacks.items()}
+            requests = Counter(self.requests)
+        routes = {}
+        for route in sorted(set(stacks) | set(requests)):
+            counts = stacks.get(route, Counter())
+            leaves = Counter()
+            for stack, count in counts.items():
+                leaves[stack.rsplit(';', 1)[-1]] += count
+            routes[route] = {
+                'requests': requests[route],
+                'samples': sum(counts.values()),
+                'top': leaves.most_common(top)}
+        return routes
+
+    def collapsed(self, route=None):
+        '''
+        Formats the samples as collapsed stacks, one "frames count" line
+        per distinct stack with the route as the root frame
+          Attributes:
+            route (str):   only the samples of this route
+        '''
+        with self.lock:
+            lines = ['%s;%s %i' % (name, stack, count)
+                     for name, counts in sorted(self.stacks.items())
+                     if route in (None, name)
+                     for stack, count in counts.items()]
+        return '\n'.join(lines) + '\n'
+
+
+@blueprint.before_app_request
+def start_profile():
+    config = current_app.config
+    token = config['ADMIN_TOKEN']
+    header = request.headers.get('X-Profile')
+    if (header and token and signed(token, header, request.path)) or \
+       random.random() < config['PROFILE_SAMPLE_RATE']:
+        current_app.extensions['profiler'].start(
+            request.endpoint or 'unmatched')
+        g.profiled = True
+
+
+@blueprint.teardown_app_request
+def stop_profile(error):
+    if g.pop('profiled', False):
+        current_app.extensions['profiler'].stop()
+
+
+def profiler_or_404():
+    token = current_app.config['ADMIN_TOKEN']
+    profiler = current_app.extensions.get('profiler')
+    if not token or profiler is None or not hmac.compare_digest(
+            request.headers.get('X-Admin-Token', '').encode(),
+            token.encode()):
+        abort(404)
+    return profiler
+
+
+@blueprint.route('/admin/profiles', methods=['GET'])
+def profiles():
+    profiler = profiler_or_404()
+    return jsonify({'interval_ms': profiler.interval * 1000,
+                    'routes': profiler.summary()})
+
+
+@blueprint.route('/admin/profiles/collapsed', methods=['GET'])
+def collapsed_profiles():
+    profiler = profiler_or_404()
+    return Response(profiler.collapsed(request.args.get('route')),
+                    mimetype='text/plain')
@@ -0,0 +1,91 @@
+import logging
+import time
+from collections import Counter
+
+from flask import Blueprint, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+'''
+Counts the SQL statements every request runs and the time spent in
+them. Outside production the numbers are sent back as X-Query-* response
+headers. A statement repeated QUERY_REPEAT_LIMIT times in one request is
+logged as a likely N+1 query, and a route running more statements than
+its QUERY_BUDGETS entry (or QUERY_BUDGET) is logged, or fails the request
+when QUERY_BUDGET_STRICT is set, as the tests do.
+'''
+
+logger = logging.getLogger(__name__)
+
+blueprint = Blueprint('query_stats', __name__)
+
+
+class QueryBudgetExceeded(Exception):
+    '''
+    A route ran more statements than its query budget
+    '''
+
+
+def install(engine, slow_log=None):
+    '''
+    Starts counting the statements run by the engine
+      Attributes:
+        engine (Engine):            engine of the app
+        slow_log (SlowQueryLog):    also gets the timing of every
+                                    statement, if given
+    '''
+    def after_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - context._query_start
+        # statements outside a request, e.g. in python -m qbay init-db
+        in_request = has_request_context()
+        if in_request and 'query_count' in g:
+            g.query_count += 1
+            g.query_time += elapsed
+            g.query_statements[statement] += 1
+        if slow_log is not None:
+            slow_log.record(statement, elapsed,
+                            request.endpoint if in_request else None)
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    event.listen(engine, 'after_cursor_execute', after_execute)
+
+
+def before_execute(conn, cursor, statement, parameters, context, many):
+    # on the execution context, which goes away with the statement even
+    # when it raises and after_cursor_execute never runs
+    context._query_start = time.perf_counter()
+
+
+@blueprint.before_app_request
+def start_counting():
+    g.query_count = 0
+    g.query_time = 0.0
+    g.query_statements = Counter()
+
+
+@blueprint.after_app_request
+def report(response):
+    if 'query_count' not in g:
+        return response
+    config = current_app.config
+
+    statement, repeats = (g.query_statements.most_common(1) or
+                          [(None, 0)])[0]
+    if repeats >= config['QUERY_REPEAT_LIMIT']:
+        logger.warning('%s ran the same statement %i times, N+1 query? %s',
+                       request.endpoint, repeats, statement)
+
+    budget = config['QUERY_BUDGETS'].get(request.endpoint,
+                                         config['QUERY_BUDGET'])
+    if budget is not None and g.query_count > budget:
+        message = '%s %s ran %i statements, its budget is %i' % (
+            request.method, request.path, g.query_count, budget)
+        if config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+    if config['SERVER_MODE'] != 'production':
+        response.headers['X-Query-Count'] = str(g.query_count)
+        response.headers['X-Query-Time'] = '%.3f' % (g.query_time * 1000)
+        response.headers['X-Query-Repeats'] = str(repeats)
+    return response
@@ -0,0 +1,58 @@
+import multiprocessing
+
+
+'''
+Production serving: gunicorn with pre-forked worker processes, each
+running a pool of threads and recycled after a number of requests
+'''
+
+
+def default_workers():
+    '''
+    Returns:
+        The usual gunicorn worker count for this machine
+    '''
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def serve(create_app, port: int, workers: int, threads: int, keepalive: int,
+          timeout: int, max_requests: int):
+    '''
+    Runs the app under gunicorn until the master process is stopped.
+    Every worker builds its own app after the fork, so no engine or
+    connection pool is shared between processes.
+      Attributes:
+        create_app (function): returns the wsgi application
+        port (int):            port to listen on, on every interface
+        workers (int):         number of worker processes
+        threads (int):         threads per worker
+        keepalive (int):       seconds an idle keep-alive connection is kept
+        timeout (int):         seconds before a silent worker is restarted
+        max_requests (int):    requests a worker serves before it is
+                               recycled, 0 to never recycle
+    '''
+    # gunicorn only runs on unix, the development server works anywhere
+    from gunicorn.app.base import BaseApplication
+
+    options = {
+        'bind': '0.0.0.0:%i' % port,
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'keepalive': keepalive,
+        'timeout': timeout,
+        'max_requests': max_requests,
+        # so the workers are not all recycled at the same moment
+        'max_requests_jitter': max_requests // 10,
+    }
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # called in each worker since the app is not preloaded
+            return create_app()
+
+    Server().run()
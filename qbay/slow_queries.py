@@ -0,0 +1,140 @@
+import hmac
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+
+'''
+Opt-in slow query log. Every statement is reduced to a fingerprint, its
+text without literal values, and timed into a bounded table: count,
+total and max over all runs, p50 and p99 over the latest runs. Runs
+slower than SLOW_QUERY_MS are logged with the route that issued them.
+The table is served as JSON on /admin/slow_queries to requests carrying
+the ADMIN_TOKEN, and printed by python -m qbay slow-queries.
+'''
+
+logger = logging.getLogger(__name__)
+
+blueprint = Blueprint('slow_queries', __name__)
+
+# durations kept per fingerprint for the percentiles
+SAMPLES = 512
+
+LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s|:\w+|\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def fingerprint(statement):
+    '''
+    Replaces the literals and placeholders of a statement by ?, and any
+    list of them by (...), so runs with other values or IN list lengths
+    share one fingerprint
+    '''
+    for pattern, replacement in LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class SlowQueryLog:
+    '''
+    Timings of the statements of one app, by fingerprint
+      Attributes:
+        threshold (float):   seconds above which a run is logged
+        size (int):          fingerprints kept, the least recently run
+                             one is dropped first
+    '''
+
+    def __init__(self, threshold, size):
+        self.threshold = threshold
+        self.size = size
+        self.lock = threading.Lock()
+        self.table = OrderedDict()
+
+    def record(self, statement, elapsed, route=None):
+        '''
+        Adds one run of a statement
+          Attributes:
+            statement (str):   statement as sent to the database
+            elapsed (float):   seconds it took
+            route (str):       endpoint of the request that ran it
+        '''
+        key = fingerprint(statement)
+        with self.lock:
+            stats = self.table.get(key)
+            if stats is None:
+                stats = self.table[key] = {
+                    'count': 0, 'slow': 0, 'total': 0.0, 'max': 0.0,
+                    'samples': deque(maxlen=SAMPLES), 'routes': set()}
+                if len(self.table) > self.size:
+                    self.table.popitem(last=False)
+            else:
+                self.table.move_to_end(key)
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            stats['samples'].append(elapsed)
+            if elapsed > self.threshold:
+                stats['slow'] += 1
+                stats['routes'].add(route or '-')
+
+        if elapsed > self.threshold:
+            logger.warning('slow query %.1f ms in %s: %s', elapsed * 1000,
+                           route or '-', key)
+
+    def summary(self):
+        '''
+        Returns:
+            A list of dicts, one per fingerprint, times in milliseconds,
+            the most total time first
+        '''
+        with self.lock:
+            rows = [(key, dict(stats, samples=sorted(stats['samples']),
+                               routes=sorted(stats['routes'])))
+                    for key, stats in self.table.items()]
+        rows = [{'fingerprint': key,
+                 'count': stats['count'],
+                 'slow': stats['slow'],
+                 'routes': stats['routes'],
+                 'total_ms': stats['total'] * 1000,
+                 'max_ms': stats['max'] * 1000,
+                 'p50_ms': percentile(stats['samples'], 0.5) * 1000,
+                 'p99_ms': percentile(stats['samples'], 0.99) * 1000}
+                for key, stats in rows]
+        return sorted(rows, key=lambda row: -row['total_ms'])
+
+
+def format_summary(rows):
+    '''
+    Formats summary() rows as a text table
+    '''
+    lines = ['%8s %6s %9s %9s %9s  %s' % ('count', 'slow', 'p50 ms',
+                                          'p99 ms', 'max ms', 'query')]
+    for row in rows:
+        lines.append('%8i %6i %9.2f %9.2f %9.2f  %s' % (
+            row['count'], row['slow'], row['p50_ms'], row['p99_ms'],
+            row['max_ms'], row['fingerprint']))
+    return '\n'.join(lines)
+
+
+@blueprint.route('/admin/slow_queries', methods=['GET'])
+def slow_queries():
+    token = current_app.config['ADMIN_TOKEN']
+    log = current_app.extensions.get('slow_queries')
+    # hidden unless enabled and asked for with the admin token
+    if not token or log is None or not hmac.compare_digest(
+            request.headers.get('X-Admin-Token', '').encode(),
+            token.encode()):
+        abort(404)
+    return jsonify({'threshold_ms': log.threshold * 1000,
+                    'queries': log.summary()})
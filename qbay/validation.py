@@ -0,0 +1,144 @@
+import re
+import string
+
+from qbay.email_validator import is_valid_email
+
+
+'''
+Input requirements shared by every model entry point. Each kind of
+value (username, password, email, postal code, title) has its
+requirements declared once below as (requirement, check) pairs,
+compiled at import, and checked in order until the first one fails.
+'''
+
+
+def check_str_contains_upper(str):
+    '''
+    Checks if str contains an upper case letter
+    '''
+    for x in str:
+        if x == x.upper():
+            return True
+    return False
+
+
+def check_str_contains_lower(str):
+    '''
+    Checks if str contains a lower case letter
+    '''
+    for x in str:
+        if x == x.lower():
+            return True
+    return False
+
+
+PUNCTUATION = frozenset(string.punctuation)
+
+
+def check_str_contains_special(str):
+    '''
+    Checks if str contains punctuations
+    '''
+    return not PUNCTUATION.isdisjoint(str)
+
+
+# Alphanumeric, and space allowed only as not prefix/suffix
+ALNUM_SPACES = re.compile('(?! )[A-Za-z0-9 ]*(?<! )')
+
+# Canadian postal code, A1A 1A1
+POSTAL_CODE = re.compile('[A-Z][0-9][A-Z] [0-9][A-Z][0-9]')
+
+
+def is_str(value):
+    return isinstance(value, str)
+
+
+RULES = {
+    'username': [
+        ('type', is_str),
+        # R1-5 Username has to be non-empty
+        ('R1-5', lambda name: name != ''),
+        # R1-6 Username has to be longer than 2 but shorter than 20
+        ('R1-6', lambda name: 3 <= len(name) <= 19),
+        # R1-5 Alphanumeric, and space allowed only as not prefix/suffix
+        ('R1-5', lambda name: ALNUM_SPACES.fullmatch(name) is not None),
+    ],
+    'password': [
+        ('type', is_str),
+        # R1-1 Password cannot be empty
+        ('R1-1', lambda password: password != ''),
+        # R1-4 At least 6 characters, with upper, lower and special
+        # characters
+        ('R1-4', lambda password: len(password) >= 6),
+        ('R1-4', check_str_contains_lower),
+        ('R1-4', check_str_contains_upper),
+        ('R1-4', check_str_contains_special),
+    ],
+    'email': [
+        ('type', is_str),
+        # R1-1 Email cannot be empty
+        ('R1-1', lambda email: email != ''),
+        # R1-3 The email has to follow addr-spec defined in RFC 5322
+        ('R1-3', is_valid_email),
+    ],
+    'postal_code': [
+        ('type', is_str),
+        # R3-2 and R3-3 Postal code has to be a valid Canadian postal code
+        ('R3-3', lambda code: POSTAL_CODE.fullmatch(code) is not None),
+    ],
+    'title': [
+        ('type', is_str),
+        # R4-1 Title has to be non-empty
+        ('R4-1', lambda title: title != ''),
+        # R4-2 Title is no longer than 80 characters
+        ('R4-2', lambda title: len(title) <= 80),
+        # R4-1 Alphanumeric, and space allowed only as not prefix/suffix
+        ('R4-1', lambda title: ALNUM_SPACES.fullmatch(title) is not None),
+    ],
+}
+
+
+def broken_requirement(kind, value):
+    '''
+    Checks a value against the requirements of its kind
+      Parameters:
+        kind (string):     'username', 'password', 'email',
+                           'postal_code' or 'title'
+        value:             value to check
+      Returns:
+        The first requirement the value breaks otherwise None
+    '''
+    for requirement, check in RULES[kind]:
+        if not check(value):
+            return requirement
+    return None
+
+
+def validate(kind, value):
+    '''
+    Checks a value against the requirements of its kind
+      Returns:
+        True if the value meets every requirement otherwise False
+    '''
+    return broken_requirement(kind, value) is None
+
+
+def validate_many(records):
+    '''
+    Checks many records at once, e.g. for bulk imports
+      Parameters:
+        records (list):    dicts mapping a kind to the value to check,
+                           e.g. {'email': ..., 'password': ...}
+      Returns:
+        A list with the first broken requirement of every record, None
+        for the valid records
+    '''
+    results = []
+    for record in records:
+        broken = None
+        for kind, value in record.items():
+            broken = broken_requirement(kind, value)
+            if broken is not None:
+                break
+        results.append(broken)
+    return results
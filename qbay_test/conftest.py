@@ -3,8 +3,9 @@ import pytest
 import time
 import tempfile
 import threading
+from flask import current_app
 from werkzeug.serving import make_server
-from qbay import app
+from qbay import create_app
 
 '''
 This file defines what to do BEFORE running any test cases:
@@ -13,15 +14,41 @@ This file defines what to do BEFORE running any test cases:
 '''
 
 
+# statements each page may run, a request running more fails its test
+QUERY_BUDGETS = {
+    'qbay.login_post': 2,
+    'qbay.home': 3,
+    'qbay.register_post': 3,
+    'qbay.profile_update_get': 2,
+    'qbay.profile_update_post': 4,
+    'qbay.booking_get': 2,
+    'qbay.booking_post': 8,
+    'qbay.search_get': 2,
+    'qbay.search_api': 2,
+    'qbay.text_search_get': 3,
+    'qbay.text_search_api': 3,
+    'qbay.create_listing_get': 2,
+    'qbay.create_listing_post': 3,
+    'qbay.listing': 3,
+    'qbay.update_listing_get': 2,
+    'qbay.update_listing_post': 4,
+}
+
+
 def pytest_sessionstart():
     '''
     Delete database file if existed. So testing can start fresh.
     '''
     print('Setting up environment..')
-    db_file = 'db.sqlite'
-    if os.path.exists(db_file):
-        os.remove(db_file)
-    app.app_context().push()
+    # with the write-ahead log and its index
+    for db_file in ('db.sqlite', 'db.sqlite-wal', 'db.sqlite-shm'):
+        if os.path.exists(db_file):
+            os.remove(db_file)
+    # every test runs inside the context of this app
+    from qbay.models import init_db
+    create_app({'TESTING': True, 'QUERY_BUDGET_STRICT': True,
+                'QUERY_BUDGETS': QUERY_BUDGETS}).app_context().push()
+    init_db()
 
 
 def pytest_sessionfinish():
@@ -39,8 +66,7 @@ class ServerThread(threading.Thread):
 
     def __init__(self):
         threading.Thread.__init__(self)
-        # import necessary routes
-        from qbay import controllers
+        app = current_app._get_current_object()
         self.srv = make_server('127.0.0.1', 8081, app)
         self.ctx = app.app_context()
         self.ctx.push()
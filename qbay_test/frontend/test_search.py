@@ -0,0 +1,77 @@
+from seleniumbase import BaseCase
+
+from qbay_test.conftest import base_url
+
+from qbay.models import create_booking, create_listing, register, db
+
+from datetime import date
+
+"""
+This file defines all integration tests for the search page.
+"""
+
+
+class FrontEndSearchTest(BaseCase):
+    valid_password = 'Abc#123'
+    e_message = 'Invalid Input, Please Try Again!'
+
+    def test_1_search(self, *_):
+        '''
+        Only listings free for the whole stay are shown
+
+        Testing method: partition testing
+        '''
+        owner = register('searchfront1', 'searchfront1@email.com',
+                         self.valid_password)
+        guest = register('searchfront2', 'searchfront2@email.com',
+                         self.valid_password)
+        guest.balance = 9999.00
+        db.session.commit()
+
+        booked = create_listing('search front booked',
+                                'A little run down shack on the side street',
+                                100.00, date(2022, 6, 1), owner.id)
+        free = create_listing('search front free',
+                              'A little run down shack on the side street',
+                              100.00, date(2022, 6, 1), owner.id)
+        create_booking(guest.id, booked.id,
+                       date(2031, 3, 1), date(2031, 3, 10))
+
+        # search a window overlapping the booking
+        self.open(base_url + '/search')
+        self.type('#start_date', '2031-03-05')
+        self.type('#end_date', '2031-03-06')
+        self.click('input[type="submit"]')
+
+        # assert only the free listing is shown
+        self.assert_text(free.title, '#results')
+        self.assert_text_not_visible(booked.title, '#results')
+
+        # search a window after the booking
+        self.type('#start_date', '2031-03-11')
+        self.type('#end_date', '2031-03-12')
+        self.click('input[type="submit"]')
+
+        self.assert_text(free.title, '#results')
+        self.assert_text(booked.title, '#results')
+
+    def test_2_search(self, *_):
+        '''
+        An invalid stay window shows an error message
+
+        Testing method: partition testing
+        '''
+        self.open(base_url + '/search')
+        self.type('#start_date', '2031-03-12')
+        self.type('#end_date', '2031-03-11')
+        self.click('input[type="submit"]')
+
+        self.assert_element('#message')
+        self.assert_text(self.e_message, '#message')
+
+        self.type('#start_date', 'not a date')
+        self.type('#end_date', '2031-03-11')
+        self.click('input[type="submit"]')
+
+        self.assert_element('#message')
+        self.assert_text(self.e_message, '#message')
@@ -0,0 +1,188 @@
+from datetime import date, timedelta
+
+from flask import current_app
+
+from qbay import create_app
+from sqlalchemy import text
+
+from qbay.models import db, init_db, register, login, User, \
+    schema_version, SCHEMA_VERSION, create_listing, create_booking, \
+    calendars, Listing
+
+'''
+This file tests the application factory
+'''
+
+valid_password = 'Abc#123'
+
+
+def test_create_app_isolated(tmp_path):
+    '''
+    Apps built in one process each have their own configuration,
+    engine and data
+    '''
+    first = create_app({'SQLALCHEMY_DATABASE_URI':
+                        'sqlite:///%s' % (tmp_path / 'first.sqlite'),
+                        'LISTINGS_PAGE_SIZE': 5})
+    second = create_app({'SQLALCHEMY_DATABASE_URI':
+                         'sqlite:///%s' % (tmp_path / 'second.sqlite')})
+    assert first.config['LISTINGS_PAGE_SIZE'] == 5
+    assert second.config['LISTINGS_PAGE_SIZE'] == 20
+
+    with first.app_context():
+        # building an app does not touch its database
+        assert db.inspect(db.engine).get_table_names() == []
+        init_db()
+        first_engine = db.engine
+        assert register('appuser1', 'appuser1@email.com',
+                        valid_password) is not None
+
+    with second.app_context():
+        assert db.engine is not first_engine
+        init_db()
+        assert login('appuser1@email.com', valid_password) is None
+        assert User.query.count() == 0
+
+    with first.app_context():
+        assert login('appuser1@email.com', valid_password) is not None
+        db.engine.dispose()
+    with second.app_context():
+        db.engine.dispose()
+
+
+def test_create_app_calendars(tmp_path):
+    '''
+    Apps in one process keep their own bitmap calendars, even for
+    listings with the same id and booking version
+    '''
+    apps = [create_app({'SQLALCHEMY_DATABASE_URI':
+                        'sqlite:///%s' % (tmp_path / ('%s.sqlite' % name)),
+                        'BITMAP_CALENDAR': True})
+            for name in ('first', 'second')]
+    first_day = date.today() + timedelta(days=10)
+    for i, app in enumerate(apps):
+        with app.app_context():
+            init_db()
+            owner = register('calowner', 'calowner@email.com',
+                             valid_password)
+            guest = register('calguest', 'calguest@email.com',
+                             valid_password)
+            listing = create_listing('calendar listing', 'a listing with '
+                                     'a bitmap calendar', 10,
+                                     date(2024, 1, 1), owner.id)
+            assert listing.id == 1
+            day = first_day + timedelta(days=i)
+            assert create_booking(guest.id, listing.id, day, day)
+            guest_id = guest.id
+
+    with apps[0].app_context():
+        assert create_booking(guest_id, 1, first_day, first_day) is None
+        assert calendars()[1].is_free(first_day + timedelta(days=1),
+                                      first_day + timedelta(days=1))
+        db.engine.dispose()
+    with apps[1].app_context():
+        assert not calendars()[1].is_free(first_day + timedelta(days=1),
+                                          first_day + timedelta(days=1))
+        db.engine.dispose()
+
+
+def test_create_app_routes():
+    '''
+    Every app gets the routes
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with app.app_context():
+        init_db()
+    response = app.test_client().get('/login')
+    assert response.status_code == 200
+    assert app is not current_app._get_current_object()
+
+
+def test_init_db_schema_version(tmp_path):
+    '''
+    init_db creates the schema once, then only checks its version
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'schema.sqlite')})
+    with app.app_context():
+        assert schema_version() is None
+        assert init_db() is True
+        assert schema_version() == SCHEMA_VERSION
+        assert init_db() is False
+
+        # an older database gets the indexes it is missing
+        with db.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_booking_user_id'))
+            connection.execute(text('DELETE FROM schema_version'))
+        assert init_db() is True
+        indexes = db.inspect(db.engine).get_indexes('booking')
+        assert 'ix_booking_user_id' in [index['name'] for index in indexes]
+        db.engine.dispose()
+
+    # listing and booking tables from before the booking versions and
+    # the end of stay index, on a database stamped with an older version
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'old.sqlite')})
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'CREATE TABLE listing (id INTEGER PRIMARY KEY, '
+                'title VARCHAR(80) NOT NULL UNIQUE, '
+                'description VARCHAR(2000) NOT NULL, '
+                'price FLOAT NOT NULL, last_modified_date DATE, '
+                'owner_id INTEGER NOT NULL)'))
+            connection.execute(text(
+                "INSERT INTO listing VALUES (1, 'old listing', "
+                "'a listing from an older database', 100, NULL, 1)"))
+            connection.execute(text(
+                'CREATE TABLE booking (id INTEGER PRIMARY KEY, '
+                'user_id INTEGER NOT NULL, listing_id INTEGER NOT NULL, '
+                'booking_date DATE, start_date DATE NOT NULL, '
+                'end_date DATE NOT NULL)'))
+            connection.execute(text(
+                'CREATE INDEX ix_booking_listing_stay ON booking '
+                '(listing_id, start_date, end_date)'))
+            connection.execute(text(
+                'CREATE TABLE schema_version (version INTEGER PRIMARY KEY)'))
+            connection.execute(text(
+                'INSERT INTO schema_version VALUES (%i)'
+                % (SCHEMA_VERSION - 1)))
+        assert init_db() is True
+        assert schema_version() == SCHEMA_VERSION
+        assert Listing.query.one().booking_version == 0
+        # the stay index was replaced by one sorted by the end of stays
+        indexes = [index['name'] for index in
+                   db.inspect(db.engine).get_indexes('booking')]
+        assert 'ix_booking_listing_end' in indexes
+        assert 'ix_booking_listing_stay' not in indexes
+        db.engine.dispose()
+
+
+def test_sqlite_profile(tmp_path, monkeypatch):
+    '''
+    sqlite connections get the tuning profile of the environment
+    '''
+    def pragmas(app):
+        with app.app_context(), db.engine.connect() as connection:
+            values = {name: connection.exec_driver_sql(
+                'PRAGMA %s' % name).scalar()
+                for name in ('journal_mode', 'synchronous', 'cache_size')}
+        db.engine.dispose()
+        return values
+
+    uri = 'sqlite:///%s' % (tmp_path / 'tuned.sqlite')
+    monkeypatch.setenv('sqlite_cache_size', '-1024')
+    assert pragmas(create_app({'SQLALCHEMY_DATABASE_URI': uri})) == \
+        {'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -1024}
+
+    monkeypatch.setenv('sqlite_profile', 'default')
+    uri = 'sqlite:///%s' % (tmp_path / 'plain.sqlite')
+    assert pragmas(create_app({'SQLALCHEMY_DATABASE_URI': uri})) == \
+        {'journal_mode': 'delete', 'synchronous': 2, 'cache_size': -2000}
+
+    try:
+        create_app({'SQLALCHEMY_DATABASE_URI': uri,
+                    'SQLITE_PRAGMAS': {'cache_size': '1; DROP TABLE user'}})
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,56 @@
+from qbay.calendar_cache import BitmapCalendar
+from datetime import date
+
+
+def test_bitmap_calendar_build():
+    '''
+    Stays set one bit per day and are clipped to the window
+    '''
+    calendar = BitmapCalendar(0, date(2030, 1, 1), 365, [
+        (date(2030, 1, 1), date(2030, 1, 2)),
+        (date(2029, 12, 20), date(2029, 12, 31)),
+        (date(2030, 12, 30), date(2031, 1, 5)),
+        (date(2030, 1, 10), date(2030, 1, 10))])
+
+    assert calendar.last_day == date(2030, 12, 31)
+    assert calendar.bits == 0b11 | 1 << 9 | 0b11 << 363
+    assert calendar.nbytes == 46
+
+
+def test_bitmap_calendar_is_free():
+    '''
+    A stay is free unless one of its days is booked
+    '''
+    calendar = BitmapCalendar(0, date(2030, 1, 1), 365, [
+        (date(2030, 1, 5), date(2030, 1, 7))])
+
+    assert calendar.is_free(date(2030, 1, 1), date(2030, 1, 4))
+    assert calendar.is_free(date(2030, 1, 8), date(2030, 1, 9))
+    assert not calendar.is_free(date(2030, 1, 4), date(2030, 1, 5))
+    assert not calendar.is_free(date(2030, 1, 7), date(2030, 1, 8))
+    assert not calendar.is_free(date(2030, 1, 1), date(2030, 1, 31))
+    assert not calendar.is_free(date(2030, 1, 6), date(2030, 1, 6))
+
+
+def test_bitmap_calendar_covers():
+    '''
+    Only stays completely inside the window are covered
+    '''
+    calendar = BitmapCalendar(0, date(2030, 1, 1), 10)
+
+    assert calendar.covers(date(2030, 1, 1), date(2030, 1, 10))
+    assert not calendar.covers(date(2029, 12, 31), date(2030, 1, 2))
+    assert not calendar.covers(date(2030, 1, 9), date(2030, 1, 11))
+    assert not calendar.covers(date(2030, 1, 3), date(2030, 1, 2))
+
+
+def test_bitmap_calendar_booked():
+    '''
+    Booking returns a new calendar and leaves the old one untouched
+    '''
+    calendar = BitmapCalendar(3, date(2030, 1, 1), 10)
+    updated = calendar.booked(date(2030, 1, 2), date(2030, 1, 3), 4)
+
+    assert calendar.bits == 0 and calendar.version == 3
+    assert updated.bits == 0b110 and updated.version == 4
+    assert not updated.is_free(date(2030, 1, 3), date(2030, 1, 5))
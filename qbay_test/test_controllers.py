@@ -0,0 +1,336 @@
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+from flask import current_app
+from qbay import create_app, controllers
+from qbay.models import register, db, create_listing, init_db, \
+    CatalogVersion
+from qbay.query_stats import QueryBudgetExceeded
+
+'''
+This file tests request handling in qbay.controllers through the flask
+test client, without a browser.
+'''
+
+valid_password = 'Abc#123'
+
+
+@contextmanager
+def count_statements():
+    '''
+    Collects every SQL statement run inside the with block
+    '''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, many):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def user_lookups(statements):
+    return [statement for statement in statements
+            if 'FROM user' in statement]
+
+
+def test_current_user_loaded_once_by_id():
+    '''
+    A logged in request loads the user once, by primary key
+    '''
+    user = register('ctrluser1', 'ctrluser1@email.com', valid_password)
+    client = current_app.test_client()
+    client.post('/login', data={'email': 'ctrluser1@email.com',
+                                'password': valid_password})
+    with client.session_transaction() as session:
+        assert session['user_id'] == user.id
+
+    for url in ('/', '/profile_update', '/listing'):
+        # start from an empty identity map
+        db.session.remove()
+        with count_statements() as statements:
+            response = client.get(url)
+        assert response.status_code == 200
+        lookups = user_lookups(statements)
+        assert len(lookups) == 1
+        assert 'WHERE user.id = ?' in lookups[0]
+
+
+def test_current_user_required():
+    '''
+    Pages needing a user redirect to the login page without one
+    '''
+    client = current_app.test_client()
+    for url in ('/', '/profile_update', '/listing'):
+        response = client.get(url)
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith('/login')
+
+    # A session pointing to a missing user is not logged in
+    with client.session_transaction() as session:
+        session['user_id'] = 999999
+    assert client.get('/').status_code == 302
+
+
+def test_current_user_legacy_session():
+    '''
+    Sessions holding only the email keep working and get the user id
+    '''
+    user = register('ctrluser2', 'ctrluser2@email.com', valid_password)
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = 'ctrluser2@email.com'
+
+    assert client.get('/profile_update').status_code == 200
+    with client.session_transaction() as session:
+        assert session['user_id'] == user.id
+
+    client.get('/logout')
+    with client.session_transaction() as session:
+        assert 'user_id' not in session and 'logged_in' not in session
+
+
+def test_query_stats_headers():
+    '''
+    Responses report the statements of their request
+    '''
+    register('ctrluser3', 'ctrluser3@email.com', valid_password)
+    client = current_app.test_client()
+    client.post('/login', data={'email': 'ctrluser3@email.com',
+                                'password': valid_password})
+    db.session.remove()
+    with count_statements() as statements:
+        response = client.get('/')
+    assert response.headers['X-Query-Count'] == str(len(statements))
+    assert response.headers['X-Query-Repeats'] == '1'
+    assert float(response.headers['X-Query-Time']) > 0
+
+    current_app.config['SERVER_MODE'] = 'production'
+    try:
+        assert 'X-Query-Count' not in client.get('/').headers
+    finally:
+        current_app.config['SERVER_MODE'] = 'development'
+
+
+def test_query_stats_failed_statement():
+    '''
+    A statement that raises leaves nothing on its pooled connection
+    '''
+    with db.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.exec_driver_sql('SELECT * FROM no_such_table')
+        assert connection.exec_driver_sql('SELECT 1').scalar() == 1
+        assert 'query_start' not in connection.info
+
+
+def test_query_budget():
+    '''
+    A page running more statements than its budget fails, repeated
+    statements are logged
+    '''
+    register('ctrluser4', 'ctrluser4@email.com', valid_password)
+    client = current_app.test_client()
+    client.post('/login', data={'email': 'ctrluser4@email.com',
+                                'password': valid_password})
+    budgets = current_app.config['QUERY_BUDGETS']
+    current_app.config['QUERY_BUDGETS'] = dict(budgets, **{'qbay.home': 0})
+    try:
+        db.session.remove()
+        client.get('/')
+        assert False
+    except QueryBudgetExceeded as error:
+        assert 'GET / ran 2 statements, its budget is 0' in str(error)
+    finally:
+        current_app.config['QUERY_BUDGETS'] = budgets
+
+
+def test_repeated_statements_logged(caplog):
+    '''
+    The same statement run QUERY_REPEAT_LIMIT times is a likely N+1
+    '''
+    client = current_app.test_client()
+    current_app.config['QUERY_REPEAT_LIMIT'] = 1
+    try:
+        with caplog.at_level(logging.WARNING, logger='qbay.query_stats'):
+            client.get('/booking')
+    finally:
+        current_app.config['QUERY_REPEAT_LIMIT'] = 5
+    assert 'qbay.booking_get ran the same statement 1 times' in caplog.text
+
+
+def test_bookings_api_user():
+    '''
+    The batch API books for the logged in user, for others only with the
+    admin token, and caps the batch length
+    '''
+    user = register('ctrluser5', 'ctrluser5@email.com', valid_password)
+    other = register('ctrluser6', 'ctrluser6@email.com', valid_password)
+    client = current_app.test_client()
+    client.post('/login', data={'email': 'ctrluser5@email.com',
+                                'password': valid_password})
+
+    def post(items, headers={}):
+        return client.post('/api/bookings', json={'bookings': items},
+                           headers=headers)
+
+    # no such listing, but the user was accepted
+    item = {'listing_id': 0, 'start_date': '2030-01-01',
+            'end_date': '2030-01-02'}
+    for user_id in ({}, {'user_id': user.id}):
+        response = post([dict(item, **user_id)])
+        assert response.status_code == 200
+        assert response.get_json()['results'][0]['code'] == \
+            'listing_not_found'
+
+    response = post([item, dict(item, user_id=other.id)])
+    assert response.status_code == 403
+    current_app.config['ADMIN_TOKEN'] = 'secret'
+    try:
+        assert post([dict(item, user_id=other.id)],
+                    {'X-Admin-Token': 'wrong'}).status_code == 403
+        assert post([dict(item, user_id=other.id)],
+                    {'X-Admin-Token': 'secret'}).status_code == 200
+    finally:
+        current_app.config['ADMIN_TOKEN'] = None
+
+    assert post([item] * 101).status_code == 413
+
+
+@pytest.fixture
+def listings_app(tmp_path):
+    '''
+    An app on its own database, for tests adding listings, as the model
+    tests expect to find theirs first
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'listings.sqlite')})
+    with app.app_context():
+        init_db()
+        try:
+            yield app
+        finally:
+            db.session.remove()
+            db.engine.dispose()
+
+
+def test_conditional_get_etag(listings_app):
+    '''
+    Listing pages carry an ETag, a matching If-None-Match gets 304
+    without the page being read, and a listing change moves the ETag
+    '''
+    owner = register('ctrluser5', 'ctrluser5@email.com', valid_password)
+    listing = create_listing('etag listing', 'a listing behind an etag',
+                             100, date(2024, 1, 1), owner.id)
+    client = listings_app.test_client()
+    for i, url in enumerate(('/booking', '/listing/update/%i' % listing.id)):
+        response = client.get(url)
+        assert response.status_code == 200
+        etag, weak = response.get_etag()
+        assert weak
+        assert response.headers['Cache-Control'] == 'no-cache'
+
+        response = client.get(url, headers={'If-None-Match':
+                                            'W/"%s"' % etag})
+        assert response.status_code == 304
+        assert response.data == b''
+        # the catalog version only
+        assert response.headers['X-Query-Count'] == '1'
+        assert client.get(url, headers={
+            'If-None-Match': '"other"'}).status_code == 200
+
+        assert create_listing('etag listing %i' % i,
+                              'a listing behind an etag', 100,
+                              date(2024, 1, 1), owner.id)
+        response = client.get(url, headers={'If-None-Match':
+                                            'W/"%s"' % etag})
+        assert response.status_code == 200
+        assert response.get_etag()[0] != etag
+
+    # other cursors are other pages
+    assert client.get('/booking?after=%i' % listing.id).get_etag()[0] != \
+        client.get('/booking').get_etag()[0]
+
+    listings_app.config['ETAG_WEAK'] = False
+    assert client.get('/booking').get_etag()[1] is False
+
+
+def test_conditional_get_last_modified(listings_app, monkeypatch):
+    '''
+    Last-Modified is the second after the last listing change or the
+    start of the process, an If-Modified-Since from then on gets 304
+    unless If-None-Match is sent
+    '''
+    client = listings_app.test_client()
+    # no change yet, the pages date from the start
+    started = int(time.time()) - 200
+    monkeypatch.setattr(controllers, 'STARTED', started)
+    assert client.get('/booking').last_modified == datetime.fromtimestamp(
+        started + 1, timezone.utc)
+
+    changed = int(time.time()) - 100
+    db.session.execute(CatalogVersion.__table__.update()
+                       .values(version=changed))
+    db.session.commit()
+    response = client.get('/booking')
+    assert response.last_modified == datetime.fromtimestamp(
+        changed + 1, timezone.utc)
+
+    since = response.headers['Last-Modified']
+    assert client.get('/booking', headers={
+        'If-Modified-Since': since}).status_code == 304
+    before = 'Thu, 01 Jan 2015 00:00:00 GMT'
+    assert client.get('/booking', headers={
+        'If-Modified-Since': before}).status_code == 200
+    # If-None-Match wins
+    assert client.get('/booking', headers={
+        'If-Modified-Since': since,
+        'If-None-Match': '"other"'}).status_code == 200
+
+    # a change in the current second is not announced yet
+    owner = register('ctrluser6', 'ctrluser6@email.com', valid_password)
+    assert create_listing('last modified listing',
+                          'a listing changed just now', 100,
+                          date(2024, 1, 1), owner.id)
+    response = client.get('/booking', headers={'If-Modified-Since': since})
+    assert response.status_code == 200
+    assert response.last_modified is None or \
+        response.last_modified.timestamp() > changed + 1
+
+    # a restart, e.g. a deploy with new templates, dates the pages anew
+    monkeypatch.setattr(controllers, 'STARTED', changed + 50)
+    db.session.execute(CatalogVersion.__table__.update()
+                       .values(version=changed))
+    db.session.commit()
+    assert client.get('/booking', headers={
+        'If-Modified-Since': since}).status_code == 200
+
+
+def test_conditional_get_per_user():
+    '''
+    /listing depends on the user, its ETags differ between users and it
+    is kept by the browser only
+    '''
+    etags = []
+    for name in ('ctrluser7', 'ctrluser8'):
+        register(name, '%s@email.com' % name, valid_password)
+        client = current_app.test_client()
+        client.post('/login', data={'email': '%s@email.com' % name,
+                                    'password': valid_password})
+        response = client.get('/listing')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'private, no-cache'
+        assert 'Cookie' in response.vary
+        etags.append(response.get_etag()[0])
+        assert client.get('/listing', headers={
+            'If-None-Match': 'W/"%s"' % etags[0]}).status_code == \
+            (304 if len(etags) == 1 else 200)
+    assert etags[0] != etags[1]
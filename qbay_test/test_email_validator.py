@@ -0,0 +1,47 @@
+import time
+
+from qbay.email_validator import is_valid_email, EMAIL_PATTERN
+
+
+def test_valid_emails():
+    '''
+    Testing R1-3: emails following the addr-spec are accepted
+    '''
+    assert is_valid_email('an.eMa_il@gmail.uk.ca.com')
+    assert is_valid_email('a-b.c_d@my-host.io')
+    assert is_valid_email('0@email.com')
+
+
+def test_invalid_emails():
+    '''
+    Testing R1-3: everything else is rejected
+    '''
+    for email in ('im proper@gmail.com', 'improper@gmail..com',
+                  '.improper@gmail.com', 'improper@@gmail.com',
+                  'improper@gmail.', 'improper@.com', '_improper@.com',
+                  'i@mproper@.com', 'improper.@gmail.com',
+                  'im..proper@gmail.com', 'improper@gmail.c',
+                  'improper@gmailcom', 'im/proper@gmail.com',
+                  'improper@gmail.c0m', '', None, 42):
+        assert not is_valid_email(email)
+
+    # Longer than the User.email column
+    assert not is_valid_email('a' * 120 + '@gmail.com')
+
+
+def test_adversarial_emails():
+    '''
+    Crafted 10k character inputs are rejected in bounded time, even
+    without the length limit
+    '''
+    inputs = ['a' * 10000,
+              'a1' * 5000 + '!',
+              'a.' * 5000,
+              'a@' + 'b' * 10000 + '.',
+              'a@b' + '.cc' * 3333 + '.',
+              'a' * 9999 + '@']
+    start = time.perf_counter()
+    for email in inputs:
+        assert not is_valid_email(email)
+        assert EMAIL_PATTERN.fullmatch(email) is None
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,273 @@
+import time
+from datetime import date
+
+from flask import template_rendered
+
+from qbay import create_app, models
+from qbay.listing_cache import MemoryBackend, CachedListing, cache_events
+from qbay.models import db, init_db, register, create_listing, \
+    update_listing, cached_owner_listings, cache_fill, listings_changed, \
+    catalog_version
+
+'''
+This file tests the listing cache: its in-memory backend, the reads
+through it and the invalidation by create_listing and update_listing,
+and the cache of the rendered listings tables
+'''
+
+valid_password = 'Abc#123'
+
+
+class Today(date):
+    '''
+    A date whose today is inside the window update_listing accepts
+    '''
+    @classmethod
+    def today(cls):
+        return date(2024, 6, 1)
+
+
+def test_memory_backend():
+    '''
+    Entries are evicted least recently used first and expire after the
+    time to live, counters are kept
+    '''
+    evictions = cache_events.collect().get(('test', 'eviction'), 0)
+    cache = MemoryBackend(2, 60, 'test')
+    cache.set_many({'a': 1, 'b': 2})
+    assert cache.get_many(['a']) == {'a': 1}
+    cache.set_many({'c': 3})
+    assert cache.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+    assert cache_events.collect()[('test', 'eviction')] == evictions + 1
+
+    assert cache.incr('version', 0) == 0
+    assert cache.incr('version') == 1
+    cache.set_many({'d': 4, 'e': 5})
+    assert cache.incr('version', 0) == 1
+    cache.delete_many(['d'])
+    assert cache.get_many(['d', 'e']) == {'e': 5}
+
+    cache = MemoryBackend(2, 0.01, 'test')
+    cache.set_many({'a': 1})
+    time.sleep(0.02)
+    assert cache.get_many(['a']) == {}
+
+
+def test_listing_cache_reads(tmp_path, monkeypatch):
+    '''
+    Listing pages are served from the cache and the writes drop only
+    what they change
+    '''
+    # without the catalog version lookup of the ETags
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'cache.sqlite'),
+                      'LISTING_CACHE': True, 'LISTINGS_PAGE_SIZE': 2,
+                      'CONDITIONAL_GET': False})
+    with app.app_context():
+        init_db()
+        owner = register('cacheuser1', 'cacheuser1@email.com',
+                         valid_password)
+        listings = [create_listing('cached listing %i' % i,
+                                   'a listing read through the cache',
+                                   100, date(2024, 1, 1), owner.id)
+                    for i in range(3)]
+        client = app.test_client()
+
+        def queries(url):
+            response = client.get(url)
+            assert response.status_code == 200
+            return int(response.headers['X-Query-Count']), \
+                response.get_data(as_text=True)
+
+        hits = cache_events.collect().get(('listing', 'hit'), 0)
+        assert queries('/booking')[0] == 1
+        count, page = queries('/booking')
+        assert count == 0
+        assert 'cached listing 0' in page and '100.00' in page
+        assert cache_events.collect()[('listing', 'hit')] == hits + 3
+        assert queries('/create_listing')[0] == 0
+        assert queries('/listing/update/%i' % listings[0].id)[0] == 0
+
+        # an update reloads just that listing
+        monkeypatch.setattr(models, 'date', Today)
+        assert update_listing(listings[0], price=150.0)
+        monkeypatch.undo()
+        count, page = queries('/booking')
+        assert count == 1
+        assert '150.00' in page
+
+        # a new listing moves the pages and the owner's listings
+        assert [listing.id for listing in
+                cached_owner_listings(owner.id)] == \
+            [listing.id for listing in listings]
+        create_listing('cached listing 3', 'a listing read through the '
+                       'cache', 100, date(2024, 1, 1), owner.id)
+        owned = cached_owner_listings(owner.id)
+        assert len(owned) == 4
+        assert isinstance(owned[0], CachedListing)
+        assert queries('/booking')[0] == 1
+        assert 'cached listing 3' in queries(
+            '/booking?after=%i' % listings[1].id)[1]
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_listing_cache_fill_after_change():
+    '''
+    What was read before a change is not stored after it
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'LISTING_CACHE': True})
+    with app.app_context():
+        cache = app.extensions['listing_cache']
+        generation = cache.incr('listing:generation', 0)
+        listings_changed(listing_ids=[1])
+        cache_fill(cache, {'listing:1': 'stale'}, generation)
+        assert cache.get_many(['listing:1']) == {}
+
+        generation = cache.incr('listing:generation', 0)
+        cache_fill(cache, {'listing:1': 'fresh'}, generation)
+        assert cache.get_many(['listing:1']) == {'listing:1': 'fresh'}
+
+
+def test_fragment_cache(tmp_path, monkeypatch):
+    '''
+    The listings table is rendered once per catalog version
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'fragment.sqlite'),
+                      'FRAGMENT_CACHE': True})
+    rendered = []
+
+    def record(sender, template, context, **extra):
+        rendered.append(template.name)
+
+    template_rendered.connect(record, app)
+    with app.app_context():
+        init_db()
+        assert catalog_version() == 0
+        owner = register('fragmentuser1', 'fragmentuser1@email.com',
+                         valid_password)
+        listing = create_listing('fragment listing', 'a listing rendered '
+                                 'once per change', 100, date(2024, 1, 1),
+                                 owner.id)
+        created = catalog_version()
+        # at least the time of the change
+        assert created >= int(time.time()) - 1
+        client = app.test_client()
+
+        def get(url):
+            del rendered[:]
+            response = client.get(url)
+            assert response.status_code == 200
+            return response.get_data(as_text=True), \
+                rendered.count('listings_table.html'), \
+                int(response.headers['X-Query-Count'])
+
+        page, renders, _ = get('/booking')
+        assert renders == 1
+        assert 'fragment listing' in page and '100.00' in page
+        page, renders, statements = get('/booking')
+        assert renders == 0
+        # the catalog version only, shared with the ETag
+        assert statements == 1
+        assert 'fragment listing' in page and 'id="pager"' in page
+        # the same table is shared by /create_listing
+        assert get('/create_listing')[1] == 0
+        # other cursors are other fragments
+        assert get('/booking?after=%i' % listing.id)[1] == 1
+
+        monkeypatch.setattr(models, 'date', Today)
+        assert update_listing(listing, price=150.0)
+        monkeypatch.undo()
+        assert catalog_version() > created
+        page, renders, _ = get('/booking')
+        assert renders == 1 and '150.00' in page
+
+        create_listing('fragment listing 2', 'a listing rendered once '
+                       'per change', 100, date(2024, 1, 1), owner.id)
+        page, renders, _ = get('/create_listing')
+        assert renders == 1 and 'fragment listing 2' in page
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_fragment_cache_other_process(tmp_path):
+    '''
+    A table rendered for a new catalog version shows the change made
+    through another app, whose listing cache this one never saw
+    '''
+    config = {'SQLALCHEMY_DATABASE_URI':
+              'sqlite:///%s' % (tmp_path / 'shared.sqlite'),
+              'LISTING_CACHE': True, 'FRAGMENT_CACHE': True,
+              'CONDITIONAL_GET': False}
+    writer, reader = create_app(config), create_app(config)
+    with writer.app_context():
+        init_db()
+        owner = register('shareduser1', 'shareduser1@email.com',
+                         valid_password)
+        create_listing('shared listing 0', 'a listing seen by both apps',
+                       100, date(2024, 1, 1), owner.id)
+        owner_id = owner.id
+
+    client = reader.test_client()
+    with reader.app_context():
+        assert 'shared listing 0' in client.get('/booking').get_data(
+            as_text=True)
+
+    with writer.app_context():
+        create_listing('shared listing 1', 'a listing seen by both apps',
+                       100, date(2024, 1, 1), owner_id)
+        db.session.remove()
+        db.engine.dispose()
+
+    with reader.app_context():
+        page = client.get('/booking').get_data(as_text=True)
+        assert 'shared listing 0' in page and 'shared listing 1' in page
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_conditional_get_other_process(tmp_path, monkeypatch):
+    '''
+    The pages behind an ETag are read for its catalog version, so a
+    change made through another app is neither missed nor answered 304
+    '''
+    config = {'SQLALCHEMY_DATABASE_URI':
+              'sqlite:///%s' % (tmp_path / 'shared.sqlite'),
+              'LISTING_CACHE': True}
+    writer, reader = create_app(config), create_app(config)
+    with writer.app_context():
+        init_db()
+        owner = register('shareduser2', 'shareduser2@email.com',
+                         valid_password)
+        listing = create_listing('shared listing 2', 'a listing seen by '
+                                 'both apps', 100, date(2024, 1, 1),
+                                 owner.id)
+        owner_id, listing_id = owner.id, listing.id
+
+    client = reader.test_client()
+    url = '/listing/update/%i' % listing_id
+    with reader.app_context():
+        etags = {page: client.get(page).get_etag()[0]
+                 for page in ('/booking', url)}
+
+    with writer.app_context():
+        create_listing('shared listing 3', 'a listing seen by both apps',
+                       100, date(2024, 1, 1), owner_id)
+        monkeypatch.setattr(models, 'date', Today)
+        assert update_listing(db.session.get(models.Listing, listing_id),
+                              price=150.0)
+        monkeypatch.undo()
+        db.session.remove()
+        db.engine.dispose()
+
+    with reader.app_context():
+        for page, text in (('/booking', 'shared listing 3'),
+                           (url, '150.00')):
+            response = client.get(page, headers={
+                'If-None-Match': 'W/"%s"' % etags[page]})
+            assert response.status_code == 200
+            assert text in response.get_data(as_text=True)
+        db.session.remove()
+        db.engine.dispose()
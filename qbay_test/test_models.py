@@ -1,10 +1,19 @@
 from qbay.models import register, login, check_str_contains_lower, \
     check_str_contains_upper, check_str_contains_special, update_listing, \
-    User, Listing, create_listing, create_booking
+    User, Listing, create_listing, create_booking, find_booking_conflict, \
+    search_available_listings, create_bookings, BOOKING_OK, \
+    BOOKING_INVALID, BOOKING_NO_LISTING, BOOKING_NO_USER, \
+    BOOKING_OWN_LISTING, BOOKING_NO_FUNDS, BOOKING_CONFLICT, \
+    BOOKING_BATCH_CONFLICT, Booking, db, Occupancy, rebuild_occupancy, \
+    is_listing_free, occupancy_rate, calendars, available_listing_ids, \
+    page_listings, search_listings
+from flask import current_app
+from sqlalchemy import event
 from datetime import date, timedelta
 
 import string
 import random
+import threading
 
 valid_password = 'Abc#123'
 
@@ -304,6 +313,49 @@ def test_r3_1_update_user():
     assert user2.postal_code == new_postal_code
 
 
+def test_r3_1_update_profile_one_transaction():
+    '''
+      Testing R3-1: a profile update validates every field first and
+      writes them together in one commit, or not at all.
+    '''
+    user = register('userr31b', 'anemailr31b@email.com', valid_password)
+    other = register('userr31c', 'anemailr31c@email.com', valid_password)
+    assert user is not None and other is not None
+
+    commits = []
+
+    def record(conn):
+        commits.append(conn)
+
+    event.listen(db.engine, 'commit', record)
+    try:
+        results = user.update_profile(username='new userr31b',
+                                      email='newr31b@email.com',
+                                      ship_addr='1 Union St',
+                                      postal_code='K7L 3N6')
+    finally:
+        event.remove(db.engine, 'commit', record)
+    assert results == {'username': True, 'email': True,
+                       'ship_addr': True, 'postal_code': True}
+    assert len(commits) == 1
+
+    # one bad field leaves the others untouched
+    results = user.update_profile(username='other name',
+                                  postal_code='K7L3N6')
+    assert results == {'username': True, 'postal_code': False}
+    assert user.update_user(username='other name',
+                            postal_code='K7L3N6') is False
+    db.session.expire(user)
+    assert user.username == 'new userr31b'
+    assert user.postal_code == 'K7L 3N6'
+
+    # a taken email is reported per field too
+    results = user.update_profile(username='other name',
+                                  email=other.email)
+    assert results == {'username': True, 'email': False}
+    assert db.session.get(User, user.id).username == 'new userr31b'
+
+
 def test_r3_2_update_user():
     '''
       Testing R3-2: Postal code should be non-empty, alphanumeric-only,
@@ -1399,3 +1451,508 @@ def test_payload_create_booking_parameter_4():
 
     # No exceptions
     assert True
+
+
+def test_booking_backend_5():
+    """
+    A user cannot book a stay that fully contains an existing booking
+
+    Testing method: boundary testing
+    """
+    user1 = register(name="bookingbackend5a",
+                     email="bookingbackend5a@email.com",
+                     password="Password21$")
+    user2 = register(name="bookingbackend5b",
+                     email="bookingbackend5b@email.com",
+                     password="Password21$")
+    user2.balance = 10000.00
+
+    listing = create_listing(
+        "bookingbackend5a",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), user1.id)
+
+    booking1 = create_booking(user2.id, listing.id,
+                              start_date=date(2022, 3, 10),
+                              end_date=date(2022, 3, 12))
+    assert booking1 is not None
+
+    # New stay surrounds the existing one
+    assert create_booking(user2.id, listing.id,
+                          start_date=date(2022, 3, 1),
+                          end_date=date(2022, 3, 20)) is None
+
+    # Touching either end of the existing stay
+    assert create_booking(user2.id, listing.id,
+                          start_date=date(2022, 3, 12),
+                          end_date=date(2022, 3, 14)) is None
+    assert create_booking(user2.id, listing.id,
+                          start_date=date(2022, 3, 8),
+                          end_date=date(2022, 3, 10)) is None
+
+    # Adjacent stays on both sides are fine
+    assert create_booking(user2.id, listing.id,
+                          start_date=date(2022, 3, 13),
+                          end_date=date(2022, 3, 14)) is not None
+    assert create_booking(user2.id, listing.id,
+                          start_date=date(2022, 3, 8),
+                          end_date=date(2022, 3, 9)) is not None
+
+    # A stay between two existing stays conflicts with both
+    assert find_booking_conflict(listing.id, date(2022, 3, 9),
+                                 date(2022, 3, 13)) is not None
+    assert find_booking_conflict(listing.id, date(2022, 3, 15),
+                                 date(2022, 3, 30)) is None
+
+
+def test_booking_backend_nested_stays():
+    """
+    Stays nested in one another, as older databases may hold, still
+    conflict with every stay they overlap
+
+    Testing method: boundary testing
+    """
+    owner = register(name="nestedowner", email="nestedowner@email.com",
+                     password="Password21$")
+    guest = register(name="nestedguest", email="nestedguest@email.com",
+                     password="Password21$")
+    guest.balance = 10000.00
+    listing = create_listing(
+        "nestedlisting",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+
+    # written directly, create_booking rejects the surrounding stay
+    db.session.execute(Booking.__table__.insert(), [
+        {'user_id': guest.id, 'listing_id': listing.id,
+         'start_date': date(2033, 1, 5), 'end_date': date(2033, 1, 6)},
+        {'user_id': guest.id, 'listing_id': listing.id,
+         'start_date': date(2033, 1, 1), 'end_date': date(2033, 1, 30)},
+    ])
+    db.session.commit()
+
+    assert find_booking_conflict(listing.id, date(2033, 1, 10),
+                                 date(2033, 1, 12)) is not None
+    assert create_booking(guest.id, listing.id, date(2033, 1, 10),
+                          date(2033, 1, 12)) is None
+    found, next_after = search_available_listings(
+        date(2033, 1, 10), date(2033, 1, 12), after_id=listing.id - 1,
+        page_size=1)
+    assert listing.id not in [found_listing.id for found_listing in found]
+    results = create_bookings([
+        {'user_id': guest.id, 'listing_id': listing.id,
+         'start_date': date(2033, 1, 10), 'end_date': date(2033, 1, 12)}])
+    assert results == [(BOOKING_CONFLICT, None)]
+    assert find_booking_conflict(listing.id, date(2033, 1, 31),
+                                 date(2033, 2, 2)) is None
+
+    # the occupancy table holds each day once, for the earliest booking
+    rebuild_occupancy(chunk_size=1)
+    inner, outer = Booking.query.filter_by(listing_id=listing.id) \
+        .order_by(Booking.id).all()
+    days = {row.day: row.booking_id for row in
+            Occupancy.query.filter_by(listing_id=listing.id)}
+    assert len(days) == 30
+    assert days[date(2033, 1, 5)] == days[date(2033, 1, 6)] == inner.id
+    assert days[date(2033, 1, 1)] == days[date(2033, 1, 30)] == outer.id
+
+
+def test_search_available_listings():
+    """
+    Only listings free for the whole stay are returned, page by page
+
+    Testing method: partition testing
+    """
+    owner = register(name="searchowner", email="searchowner@email.com",
+                     password="Password21$")
+    guest = register(name="searchguest", email="searchguest@email.com",
+                     password="Password21$")
+    guest.balance = 10000.00
+
+    listings = [create_listing(
+        "searchlisting%i" % i,
+        "This is a lot of descriptions and it is about a house",
+        100.00 * (i + 1), date(2022, 6, 1), owner.id) for i in range(4)]
+    ids = [listing.id for listing in listings]
+
+    # Book listing 0 and 2 around the searched window
+    assert create_booking(guest.id, ids[0], date(2030, 5, 1),
+                          date(2030, 5, 10)) is not None
+    assert create_booking(guest.id, ids[2], date(2030, 4, 1),
+                          date(2030, 4, 30)) is not None
+
+    def search(*args, **kwargs):
+        found, next_after = search_available_listings(
+            *args, after_id=ids[0] - 1, **kwargs)
+        return [listing.id for listing in found if listing.id in ids]
+
+    # Booked listings overlapping the stay are excluded
+    assert search(date(2030, 4, 28), date(2030, 5, 2),
+                  page_size=100) == [ids[1], ids[3]]
+    # A stay fully inside an existing booking is excluded too
+    assert search(date(2030, 5, 3), date(2030, 5, 4),
+                  page_size=100) == [ids[1], ids[2], ids[3]]
+    # Right after both bookings everything is free
+    assert search(date(2030, 5, 11), date(2030, 5, 12),
+                  page_size=100) == ids
+    # Max price filter
+    assert search(date(2030, 5, 11), date(2030, 5, 12),
+                  max_price=200.00, page_size=100) == ids[:2]
+
+    # Keyset pagination walks the same results in order
+    found, next_after = search_available_listings(
+        date(2030, 5, 11), date(2030, 5, 12), after_id=ids[0] - 1,
+        page_size=2)
+    assert [listing.id for listing in found] == ids[:2]
+    assert next_after == ids[1]
+    found, next_after = search_available_listings(
+        date(2030, 5, 11), date(2030, 5, 12), after_id=next_after,
+        page_size=2)
+    assert [listing.id for listing in found] == ids[2:]
+
+    # Invalid inputs
+    assert search_available_listings(date(2030, 5, 2),
+                                     date(2030, 5, 1)) is None
+    assert search_available_listings("2030-05-01", date(2030, 5, 2)) is None
+    assert search_available_listings(date(2030, 5, 1), date(2030, 5, 2),
+                                     max_price="100") is None
+    assert search_available_listings(date(2030, 5, 1), date(2030, 5, 2),
+                                     page_size=0) is None
+
+
+def test_create_bookings():
+    """
+    A batch of bookings gets one result code per item and conflicts are
+    found against stored bookings and inside the batch
+
+    Testing method: partition testing
+    """
+    owner = register(name="batchowner", email="batchowner@email.com",
+                     password="Password21$")
+    guest = register(name="batchguest", email="batchguest@email.com",
+                     password="Password21$")
+    poor = register(name="batchpoor", email="batchpoor@email.com",
+                    password="Password21$")
+    guest.balance = 10000.00
+    poor.balance = 0.00
+
+    listing1 = create_listing(
+        "batchlisting1",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+    listing2 = create_listing(
+        "batchlisting2",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+
+    stored = create_booking(guest.id, listing1.id,
+                            date(2032, 1, 10), date(2032, 1, 20))
+    assert stored is not None
+
+    def item(listing, start, end, user=guest):
+        return {'user_id': user.id, 'listing_id': listing.id,
+                'start_date': start, 'end_date': end}
+
+    results = create_bookings([
+        item(listing1, date(2032, 1, 1), date(2032, 1, 5)),
+        item(listing1, date(2032, 1, 5), date(2032, 1, 7)),
+        item(listing1, date(2032, 1, 15), date(2032, 1, 25)),
+        item(listing1, date(2032, 1, 8), date(2032, 1, 30)),
+        item(listing2, date(2032, 1, 8), date(2032, 1, 30)),
+        item(listing2, date(2032, 2, 1), date(2032, 2, 2), user=owner),
+        item(listing2, date(2032, 2, 1), date(2032, 2, 2), user=poor),
+        {'user_id': guest.id, 'listing_id': 0,
+         'start_date': date(2032, 2, 1), 'end_date': date(2032, 2, 2)},
+        {'user_id': 0, 'listing_id': listing2.id,
+         'start_date': date(2032, 2, 1), 'end_date': date(2032, 2, 2)},
+        item(listing2, "2032-02-01", date(2032, 2, 2)),
+        item(listing2, date(2032, 2, 2), date(2032, 2, 1)),
+        "not a booking",
+    ])
+    codes = [code for code, booking in results]
+    assert codes == [BOOKING_OK, BOOKING_BATCH_CONFLICT, BOOKING_CONFLICT,
+                     BOOKING_CONFLICT, BOOKING_OK, BOOKING_OWN_LISTING,
+                     BOOKING_NO_FUNDS, BOOKING_NO_LISTING, BOOKING_NO_USER,
+                     BOOKING_INVALID, BOOKING_INVALID, BOOKING_INVALID]
+
+    # Accepted bookings were stored
+    assert results[0][1].id is not None
+    assert results[4][1].id is not None
+    assert all(booking is None for code, booking in results
+               if code != BOOKING_OK)
+    assert find_booking_conflict(listing2.id, date(2032, 1, 10),
+                                 date(2032, 1, 10)).id == results[4][1].id
+
+    # Only lists are accepted
+    assert create_bookings("not a list") is None
+    assert create_bookings([]) == []
+
+
+def test_booking_concurrent_stress():
+    """
+    Concurrent bookings of the same listing never overlap
+
+    Testing method: stress testing, every thread has its own app
+    context and therefore its own session and connection
+    """
+    owner = register(name="stressowner", email="stressowner@email.com",
+                     password="Password21$")
+    listing = create_listing(
+        "stresslisting",
+        "This is a lot of descriptions and it is about a house",
+        10.00, date(2022, 6, 1), owner.id)
+    guests = [register(name="stressguest%i" % i,
+                       email="stressguest%i@email.com" % i,
+                       password="Password21$") for i in range(8)]
+    guest_ids = [guest.id for guest in guests]
+    listing_id = listing.id
+
+    attempts = 25
+    first = date(2033, 1, 1)
+    barrier = threading.Barrier(len(guest_ids))
+    errors = []
+    app = current_app._get_current_object()
+
+    def book(user_id):
+        with app.app_context():
+            barrier.wait()
+            try:
+                for i in range(attempts):
+                    # every thread asks for the same overlapping stays
+                    start = first + timedelta(days=i)
+                    create_booking(user_id, listing_id, start,
+                                   start + timedelta(days=1))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=book, args=(user_id,))
+               for user_id in guest_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+    stays = Booking.query.filter_by(listing_id=listing_id) \
+        .order_by(Booking.start_date).all()
+    # at least every other day was booked
+    assert len(stays) >= attempts // 2
+    # and no two stays overlap
+    for before, after in zip(stays, stays[1:]):
+        assert before.end_date < after.start_date
+
+
+def test_occupancy_table():
+    """
+    The occupancy table answers the same as the booking table, both
+    when maintained by create_booking and when rebuilt in bulk
+
+    Testing method: partition testing
+    """
+    owner = register(name="occupancyowner",
+                     email="occupancyowner@email.com",
+                     password="Password21$")
+    guest = register(name="occupancyguest",
+                     email="occupancyguest@email.com",
+                     password="Password21$")
+    guest.balance = 10000.00
+    listing = create_listing(
+        "occupancylisting",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+
+    # Booked before the table was enabled
+    assert create_booking(guest.id, listing.id, date(2034, 3, 1),
+                          date(2034, 3, 3)) is not None
+
+    current_app.config['OCCUPANCY_TABLE'] = True
+    try:
+        assert rebuild_occupancy(chunk_size=7) == Occupancy.query.count()
+
+        # Maintained incrementally from now on
+        assert create_booking(guest.id, listing.id, date(2034, 3, 10),
+                              date(2034, 3, 11)) is not None
+        results = create_bookings([
+            {'user_id': guest.id, 'listing_id': listing.id,
+             'start_date': date(2034, 3, 20),
+             'end_date': date(2034, 3, 24)}])
+        assert results[0][0] == BOOKING_OK
+
+        days = [date(2034, 3, 1) + timedelta(days=i) for i in range(31)]
+        from_table = [is_listing_free(listing.id, day) for day in days]
+        rate = occupancy_rate(listing.id, days[0], days[-1])
+    finally:
+        current_app.config['OCCUPANCY_TABLE'] = False
+
+    from_bookings = [is_listing_free(listing.id, day) for day in days]
+    assert from_table == from_bookings
+    assert from_table.count(False) == 10
+    assert rate == occupancy_rate(listing.id, days[0], days[-1]) == 10 / 31
+
+    # Partial overlap with the period is counted per day
+    assert occupancy_rate(listing.id, date(2034, 3, 3),
+                          date(2034, 3, 4)) == 0.5
+    assert occupancy_rate(listing.id, date(2034, 3, 4),
+                          date(2034, 3, 3)) is None
+
+
+def test_bitmap_calendar_bookings():
+    """
+    Bookings checked against the bitmap calendars give the same answers
+    as the booking table, and calendars follow new bookings
+
+    Testing method: partition testing
+    """
+    owner = register(name="calendarowner",
+                     email="calendarowner@email.com",
+                     password="Password21$")
+    guest = register(name="calendarguest",
+                     email="calendarguest@email.com",
+                     password="Password21$")
+    guest.balance = 10000.00
+    listing1 = create_listing(
+        "calendarlisting1",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+    listing2 = create_listing(
+        "calendarlisting2",
+        "This is a lot of descriptions and it is about a house",
+        100.00, date(2022, 6, 1), owner.id)
+    today = date.today()
+
+    def day(offset):
+        return today + timedelta(days=offset)
+
+    # Booked before the calendars were enabled
+    assert create_booking(guest.id, listing1.id, day(10), day(12))
+
+    current_app.config['BITMAP_CALENDAR'] = True
+    try:
+        assert create_booking(guest.id, listing1.id, day(12), day(13)) \
+            is None
+        assert create_booking(guest.id, listing1.id, day(5), day(20)) \
+            is None
+        assert create_booking(guest.id, listing1.id, day(13), day(14))
+        # The calendar was updated in place with the new stay
+        assert not calendars()[listing1.id].is_free(day(14), day(14))
+        assert create_booking(guest.id, listing1.id, day(14), day(15)) \
+            is None
+
+        # Stays outside the window use the booking table
+        assert create_booking(guest.id, listing2.id, day(300), day(400))
+        assert create_booking(guest.id, listing2.id, day(399), day(401)) \
+            is None
+
+        # A batch drops the calendars of its listings
+        results = create_bookings([
+            {'user_id': guest.id, 'listing_id': listing1.id,
+             'start_date': day(30), 'end_date': day(31)}])
+        assert results[0][0] == BOOKING_OK
+        assert listing1.id not in calendars()
+        assert create_booking(guest.id, listing1.id, day(31), day(32)) \
+            is None
+
+        ids = [listing1.id, listing2.id]
+        assert available_listing_ids(ids, day(0), day(9)) == ids
+        assert available_listing_ids(ids, day(11), day(11)) == \
+            [listing2.id]
+        assert available_listing_ids(ids, day(350), day(351)) == \
+            [listing1.id]
+        assert available_listing_ids(ids, day(2), day(1)) is None
+    finally:
+        current_app.config['BITMAP_CALENDAR'] = False
+
+
+def test_page_listings():
+    """
+    Listings are paged forwards and backwards by id without gaps
+
+    Testing method: partition testing
+    """
+    owner = register(name="pageowner", email="pageowner@email.com",
+                     password="Password21$")
+    for i in range(5):
+        create_listing("pagelisting%i" % i,
+                       "This is a lot of descriptions and it is about a house",
+                       100.00, date(2022, 6, 1), owner.id)
+    ids = [listing.id for listing in Listing.query.order_by(Listing.id)]
+
+    # Walk forwards over every listing
+    seen = []
+    listings, prev_before, next_after = page_listings(page_size=3)
+    assert prev_before is None
+    pages = [listings]
+    while next_after is not None:
+        listings, prev_before, next_after = page_listings(
+            after_id=next_after, page_size=3)
+        assert prev_before == listings[0].id
+        pages.append(listings)
+    for page in pages:
+        assert 0 < len(page) <= 3
+        seen.extend(listing.id for listing in page)
+    assert seen == ids
+
+    # Walk back from the last page
+    before_id = pages[-1][0].id
+    for page in reversed(pages[:-1]):
+        listings, prev_before, next_after = page_listings(
+            before_id=before_id, page_size=3)
+        assert listings == page
+        assert next_after == page[-1].id
+        before_id = prev_before
+    assert before_id is None
+
+    # Nothing before the first listing
+    assert page_listings(before_id=ids[0], page_size=3) == ([], None, None)
+
+
+def test_search_listings():
+    """
+    Text search finds listings containing every word, best match first,
+    and follows changes of titles and descriptions
+
+    Testing method: partition testing
+    """
+    owner = register(name="textowner", email="textowner@email.com",
+                     password="Password21$")
+    lake = create_listing("Quokka lake house",
+                          "A quiet quokka cabin right next to the lake",
+                          100.00, date(2022, 6, 1), owner.id)
+    loft = create_listing("Quokka city loft",
+                          "Modern loft downtown with a view of the lake",
+                          100.00, date(2022, 6, 1), owner.id)
+    create_listing("Quokka farm",
+                   "Old farm house in the middle of the fields",
+                   100.00, date(2022, 6, 1), owner.id)
+
+    def titles(*args, **kwargs):
+        listings, next_page = search_listings(*args, **kwargs)
+        return [listing.title for listing in listings]
+
+    # Every word must match, case does not matter
+    assert titles("quokka lake") == [lake.title, loft.title]
+    assert titles("QUOKKA loft") == [loft.title]
+    assert titles("quokka submarine") == []
+    # Search syntax is ignored instead of failing
+    assert titles('quokka" farm*') == ["Quokka farm"]
+    assert titles("   ") == []
+
+    # Pages
+    listings, next_page = search_listings("quokka", page_size=2)
+    assert len(listings) == 2 and next_page == 2
+    listings, next_page = search_listings("quokka", page=2, page_size=2)
+    assert len(listings) == 1 and next_page is None
+
+    # Changes are searchable
+    loft.description = "Modern loft downtown with a view of the river"
+    db.session.commit()
+    assert titles("quokka lake") == [lake.title]
+    assert titles("quokka river") == [loft.title]
+
+    # Invalid inputs
+    assert search_listings(None) is None
+    assert search_listings("lake", page=0) is None
+    assert search_listings("lake", page_size=1000) is None
@@ -0,0 +1,107 @@
+import time
+
+from qbay import create_app
+from qbay.profiler import Profiler, signature
+
+'''
+This file tests the sampling request profiler and its /admin endpoints
+'''
+
+
+def slow_page():
+    time.sleep(0.05)
+    return 'done'
+
+
+def profiled_app(**config):
+    '''
+    An app with the profiler on and a route sleeping 50 ms
+    '''
+    app = create_app(dict({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                           'PROFILER': True, 'PROFILE_INTERVAL_MS': 1,
+                           'ADMIN_TOKEN': 'secret'}, **config))
+    app.add_url_rule('/slow', 'slow', slow_page)
+    return app
+
+
+def test_profiler_sample():
+    '''
+    A sample counts the stack of every profiled thread under its route
+    '''
+    profiler = Profiler(0.001)
+    profiler.start('qbay.home')
+    profiler.sample()
+    profiler.stop()
+    profiler.sample()
+
+    summary = profiler.summary()
+    assert summary['qbay.home']['requests'] == 1
+    assert summary['qbay.home']['samples'] == 1
+    line, = profiler.collapsed().splitlines()
+    assert line.startswith('qbay.home;')
+    assert line.endswith(
+        'qbay_test.test_profiler:test_profiler_sample;'
+        'qbay.profiler:sample 1')
+    assert profiler.collapsed('qbay.listing') == '\n'
+
+
+def test_profiler_signed_request():
+    '''
+    Only requests signed with the admin token for their path, and not
+    expired, are profiled when the sample rate is 0
+    '''
+    app = profiled_app()
+    client = app.test_client()
+    admin = {'X-Admin-Token': 'secret'}
+    client.get('/slow')
+    client.get('/slow', headers={'X-Profile': signature('secret', '/')})
+    client.get('/slow', headers={'X-Profile': signature('wrong', '/slow')})
+    # expired, or with the expiry changed
+    client.get('/slow', headers={
+        'X-Profile': signature('secret', '/slow', ttl=-1)})
+    expiry, digest = signature('secret', '/slow').split(':')
+    client.get('/slow', headers={
+        'X-Profile': '%i:%s' % (int(expiry) + 3600, digest)})
+    client.get('/slow', headers={'X-Profile': digest})
+    assert client.get('/admin/profiles', headers=admin).json['routes'] == {}
+
+    client.get('/slow', headers={'X-Profile': signature('secret', '/slow')})
+    routes = client.get('/admin/profiles', headers=admin).json['routes']
+    assert routes['slow']['requests'] == 1
+    assert routes['slow']['samples'] > 0
+    assert routes['slow']['top'][0][0] == 'qbay_test.test_profiler:slow_page'
+
+    response = client.get('/admin/profiles/collapsed?route=slow',
+                          headers=admin)
+    assert response.mimetype == 'text/plain'
+    for line in response.get_data(as_text=True).splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('slow;')
+        assert int(count) > 0
+
+
+def test_profiler_sample_rate():
+    '''
+    With a sample rate of 1 every request is profiled
+    '''
+    app = profiled_app(PROFILE_SAMPLE_RATE=1.0)
+    client = app.test_client()
+    for _ in range(3):
+        client.get('/slow')
+    assert client.get('/admin/profiles').status_code == 404
+    routes = client.get('/admin/profiles',
+                        headers={'X-Admin-Token': 'secret'}).json['routes']
+    assert routes['slow']['requests'] == 3
+
+
+def test_profiler_off():
+    '''
+    Without PROFILER the hooks and endpoints are not registered
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'ADMIN_TOKEN': 'secret'})
+    assert 'profiler' not in app.blueprints
+    assert 'profiler' not in app.extensions
+    response = app.test_client().get('/admin/profiles',
+                                     headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 404
@@ -0,0 +1,181 @@
+from contextlib import contextmanager
+from datetime import date
+
+from sqlalchemy import event
+
+from flask import current_app
+from qbay import models
+from qbay.models import db, register, login, create_listing, \
+    update_listing, create_booking, create_bookings, find_booking_conflict, \
+    page_listings, search_available_listings, search_listings, \
+    is_listing_free, occupancy_rate, available_listing_ids, calendars
+
+'''
+This file runs EXPLAIN (MySQL) or EXPLAIN QUERY PLAN (sqlite) on every
+query the models and controllers issue on their hot paths and fails if
+one of them reads a whole table.
+'''
+
+valid_password = 'Abc#123'
+
+
+class Today(date):
+    '''
+    A date whose today is inside the window update_listing accepts
+    '''
+    @classmethod
+    def today(cls):
+        return date(2024, 6, 1)
+
+
+@contextmanager
+def capture_queries():
+    '''
+    Collects the reads, updates and deletes run inside the with block
+    '''
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, many):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if not many and verb in ('SELECT', 'UPDATE', 'DELETE'):
+            queries.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def full_scans(queries):
+    '''
+    Explains every captured query
+      Returns:
+        A list of (statement, table) for each full table scan
+    '''
+    tables = set(db.metadata.tables)
+    scans = []
+    with db.engine.connect() as conn:
+        for statement, parameters in queries:
+            if conn.dialect.name == 'mysql':
+                rows = conn.exec_driver_sql('EXPLAIN ' + statement,
+                                            parameters).mappings()
+                scans += [(statement, row['table']) for row in rows
+                          if row['type'] == 'ALL']
+                continue
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                        parameters)
+            for row in rows:
+                words = row[-1].split()
+                # SEARCH uses an index, SCAN of a virtual table is fts5
+                if words[0] == 'SCAN' and words[1] in tables \
+                   and 'VIRTUAL' not in words:
+                    scans.append((statement, words[1]))
+    return scans
+
+
+def test_full_scan_detected():
+    '''
+    The checker itself reports a scan of an unindexed column
+    '''
+    query = ('SELECT id FROM review WHERE review_text = ?', ('x',))
+    assert full_scans([query]) == [(query[0], 'review')]
+    query = ('SELECT id FROM review WHERE listing_id = ?', (1,))
+    assert full_scans([query]) == []
+
+
+def test_model_queries_use_indexes(monkeypatch):
+    '''
+    Registration, login, profile, listing, booking and search queries
+    '''
+    with capture_queries() as queries:
+        owner = register('planowner', 'planowner@email.com',
+                         valid_password)
+        guest = register('planguest', 'planguest@email.com',
+                         valid_password)
+        assert login('planguest@email.com', valid_password) is not None
+        assert guest.update_user(username='plan guest',
+                                 email='planguest2@email.com',
+                                 ship_addr='1 Union St',
+                                 postal_code='K7L 3N6')
+        guest.balance = 10000.00
+
+        listing = create_listing(
+            'plan listing', 'This is a lot of descriptions about a house',
+            100.00, date(2022, 6, 1), owner.id)
+        monkeypatch.setattr(models, 'date', Today)
+        assert update_listing(listing, title='plan listing two',
+                              price=120.00) is not None
+        monkeypatch.undo()
+
+        assert create_booking(guest.id, listing.id, date(2035, 1, 1),
+                              date(2035, 1, 3)) is not None
+        create_bookings([{'user_id': guest.id, 'listing_id': listing.id,
+                          'start_date': date(2035, 2, 1),
+                          'end_date': date(2035, 2, 2)}])
+        find_booking_conflict(listing.id, date(2035, 1, 2),
+                              date(2035, 1, 5))
+
+        page_listings(after_id=listing.id - 1)
+        page_listings(before_id=listing.id + 1)
+        search_available_listings(date(2035, 1, 1), date(2035, 1, 3),
+                                  max_price=200)
+        search_listings('plan listing')
+
+    assert queries
+    assert full_scans(queries) == []
+
+
+def test_cached_model_queries_use_indexes():
+    '''
+    The occupancy table and bitmap calendar paths
+    '''
+    owner = register('planowner2', 'planowner2@email.com', valid_password)
+    guest = register('planguest3', 'planguest3@email.com', valid_password)
+    guest.balance = 10000.00
+    listing = create_listing(
+        'plan listing three', 'This is a lot of descriptions about a house',
+        100.00, date(2022, 6, 1), owner.id)
+
+    current_app.config['OCCUPANCY_TABLE'] = True
+    current_app.config['BITMAP_CALENDAR'] = True
+    try:
+        with capture_queries() as queries:
+            assert create_booking(guest.id, listing.id, date(2035, 3, 1),
+                                  date(2035, 3, 3)) is not None
+            is_listing_free(listing.id, date(2035, 3, 2))
+            occupancy_rate(listing.id, date(2035, 3, 1), date(2035, 3, 31))
+            available_listing_ids([listing.id], date(2035, 3, 2),
+                                  date(2035, 3, 4))
+    finally:
+        current_app.config['OCCUPANCY_TABLE'] = False
+        current_app.config['BITMAP_CALENDAR'] = False
+        calendars().clear()
+
+    assert queries
+    assert full_scans(queries) == []
+
+
+def test_controller_queries_use_indexes():
+    '''
+    The pages a logged in user loads
+    '''
+    owner = register('planowner3', 'planowner3@email.com', valid_password)
+    listing = create_listing(
+        'plan listing four', 'This is a lot of descriptions about a house',
+        100.00, date(2022, 6, 1), owner.id)
+    client = current_app.test_client()
+    client.post('/login', data={'email': 'planowner3@email.com',
+                                'password': valid_password})
+
+    urls = ['/', '/profile_update', '/listing', '/booking',
+            '/booking?after=%i' % listing.id, '/create_listing',
+            '/listing/update/%i' % listing.id,
+            '/search?start_date=2035-01-01&end_date=2035-01-03',
+            '/listings/search?q=plan']
+    with capture_queries() as queries:
+        for url in urls:
+            assert client.get(url).status_code == 200
+
+    assert queries
+    assert full_scans(queries) == []
@@ -0,0 +1,36 @@
+from qbay.__main__ import parse_args
+
+'''
+This file tests the command line of python -m qbay
+'''
+
+
+def test_server_defaults_from_config(monkeypatch):
+    '''
+    The server options default to the settings in the environment
+    '''
+    args = parse_args([])
+    assert args.command == 'run'
+    assert args.production is False
+    assert args.port == 8081
+    assert args.threads == 4
+    assert args.workers >= 1
+
+    monkeypatch.setenv('server_mode', 'production')
+    monkeypatch.setenv('server_workers', '3')
+    args = parse_args([])
+    assert args.production is True
+    assert args.workers == 3
+
+
+def test_server_options():
+    '''
+    Command line options override the settings
+    '''
+    args = parse_args(['--production', '--port', '9000', '--workers', '3',
+                       '--threads', '8', '--keepalive', '2', '--timeout',
+                       '60', '--max-requests', '0'])
+    assert args.production is True
+    assert (args.port, args.workers, args.threads) == (9000, 3, 8)
+    assert (args.keepalive, args.timeout, args.max_requests) == (2, 60, 0)
+    assert parse_args(['rebuild-occupancy']).command == 'rebuild-occupancy'
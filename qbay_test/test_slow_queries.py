@@ -0,0 +1,112 @@
+import logging
+
+import pytest
+
+from qbay import create_app
+from qbay.models import db, init_db
+from qbay.slow_queries import SlowQueryLog, fingerprint, format_summary
+
+'''
+This file tests the statement fingerprints, the slow query log and the
+/admin/slow_queries endpoint
+'''
+
+
+def test_fingerprint():
+    '''
+    Literals, placeholders and lists of them are replaced
+    '''
+    assert fingerprint("SELECT * FROM user WHERE email = 'a@b.com'") == \
+        'SELECT * FROM user WHERE email = ?'
+    assert fingerprint("SELECT * FROM user WHERE name = 'it''s'") == \
+        'SELECT * FROM user WHERE name = ?'
+    assert fingerprint('SELECT *\n  FROM listing  LIMIT 20 OFFSET 40') == \
+        'SELECT * FROM listing LIMIT ? OFFSET ?'
+    # IN lists of any length share a fingerprint
+    assert fingerprint('SELECT * FROM listing WHERE id IN (?, ?, ?)') == \
+        fingerprint('SELECT * FROM listing WHERE id IN (%s)') == \
+        'SELECT * FROM listing WHERE id IN (...)'
+    assert fingerprint('SELECT * FROM booking WHERE user_id = %(user_id)s') \
+        == 'SELECT * FROM booking WHERE user_id = ?'
+    # digits inside names stay
+    assert fingerprint('SELECT user1.id FROM user AS user1') == \
+        'SELECT user1.id FROM user AS user1'
+
+
+def test_slow_query_log(caplog):
+    '''
+    Runs are aggregated by fingerprint and the slower ones logged with
+    their route
+    '''
+    log = SlowQueryLog(0.1, 10)
+    with caplog.at_level(logging.WARNING, logger='qbay.slow_queries'):
+        for i in range(100):
+            log.record('SELECT * FROM listing WHERE id = %i' % i,
+                       (i + 1) / 1000, 'qbay.listing')
+        log.record('SELECT * FROM listing WHERE id = 1', 0.25,
+                   'qbay.booking_get')
+    row, = log.summary()
+    assert row['fingerprint'] == 'SELECT * FROM listing WHERE id = ?'
+    assert row['count'] == 101
+    assert row['slow'] == 1
+    assert row['routes'] == ['qbay.booking_get']
+    assert row['max_ms'] == pytest.approx(250)
+    assert row['p50_ms'] == pytest.approx(51)
+    assert row['p99_ms'] == pytest.approx(100)
+
+    slow, = [record for record in caplog.records
+             if record.name == 'qbay.slow_queries']
+    assert 'qbay.booking_get' in slow.getMessage()
+    assert '250.0 ms' in slow.getMessage()
+    assert 'SELECT' in format_summary(log.summary()).splitlines()[1]
+
+
+def test_slow_query_log_bounded():
+    '''
+    The least recently run fingerprint is dropped first
+    '''
+    log = SlowQueryLog(1, 3)
+    for table in ('user', 'listing', 'booking'):
+        log.record('SELECT * FROM %s' % table, 0.001)
+    log.record('SELECT * FROM user', 0.001)
+    log.record('SELECT * FROM review', 0.001)
+    assert sorted(row['fingerprint'] for row in log.summary()) == [
+        'SELECT * FROM booking', 'SELECT * FROM review',
+        'SELECT * FROM user']
+
+
+def test_slow_queries_endpoint(tmp_path):
+    '''
+    The endpoint needs the admin token and shows the statements of the
+    routes
+    '''
+    app = create_app({'SQLALCHEMY_DATABASE_URI':
+                      'sqlite:///%s' % (tmp_path / 'slow.sqlite'),
+                      'SLOW_QUERY_LOG': True, 'SLOW_QUERY_MS': 0,
+                      'ADMIN_TOKEN': 'secret'})
+    with app.app_context():
+        init_db()
+        client = app.test_client()
+        client.post('/login', data={'email': 'nobody@test.com',
+                                    'password': 'Abc#123'})
+        assert client.get('/admin/slow_queries').status_code == 404
+        response = client.get('/admin/slow_queries',
+                              headers={'X-Admin-Token': 'wrong'})
+        assert response.status_code == 404
+
+        response = client.get('/admin/slow_queries',
+                              headers={'X-Admin-Token': 'secret'})
+        assert response.status_code == 200
+        assert response.json['threshold_ms'] == 0
+        logins = [row for row in response.json['queries']
+                  if 'qbay.login_post' in row['routes']]
+        assert logins and logins[0]['count'] >= 1
+        db.session.remove()
+        db.engine.dispose()
+
+    # off unless enabled, even with a token
+    app = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                      'ADMIN_TOKEN': 'secret'})
+    response = app.test_client().get('/admin/slow_queries',
+                                     headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 404
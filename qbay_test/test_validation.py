@@ -0,0 +1,60 @@
+from qbay.validation import broken_requirement, validate, validate_many
+
+
+def test_username_requirements():
+    '''
+    Testing R1-5 and R1-6 through the shared rules
+    '''
+    assert validate('username', 'user 1')
+    assert broken_requirement('username', '') == 'R1-5'
+    assert broken_requirement('username', 'ab') == 'R1-6'
+    assert broken_requirement('username', 'a' * 20) == 'R1-6'
+    assert broken_requirement('username', ' user') == 'R1-5'
+    assert broken_requirement('username', 'user!') == 'R1-5'
+    assert broken_requirement('username', None) == 'type'
+
+
+def test_password_requirements():
+    '''
+    Testing R1-1 and R1-4 through the shared rules
+    '''
+    assert validate('password', 'Abc#123')
+    assert broken_requirement('password', '') == 'R1-1'
+    assert broken_requirement('password', 'Ab#1') == 'R1-4'
+    assert broken_requirement('password', 'abcdefg') == 'R1-4'
+    assert broken_requirement('password', 123456) == 'type'
+
+
+def test_email_and_postal_code_requirements():
+    '''
+    Testing R1-1, R1-3 and R3-3 through the shared rules
+    '''
+    assert validate('email', 'an.eMa_il@gmail.uk.ca.com')
+    assert broken_requirement('email', '') == 'R1-1'
+    assert broken_requirement('email', 'improper@gmail..com') == 'R1-3'
+    assert validate('postal_code', 'K7L 3N6')
+    assert broken_requirement('postal_code', 'K7L3N6') == 'R3-3'
+
+
+def test_title_requirements():
+    '''
+    Testing R4-1 and R4-2 through the shared rules
+    '''
+    assert validate('title', 'A nice house 2')
+    assert broken_requirement('title', '') == 'R4-1'
+    assert broken_requirement('title', 'a' * 81) == 'R4-2'
+    assert broken_requirement('title', 'house ') == 'R4-1'
+    assert broken_requirement('title', 'house\n') == 'R4-1'
+    assert broken_requirement('title', "house'; --") == 'R4-1'
+
+
+def test_validate_many():
+    '''
+    A batch gets the first broken requirement of every record
+    '''
+    assert validate_many([
+        {'username': 'user 1', 'email': 'a@b.com', 'password': 'Abc#123'},
+        {'username': 'user 1', 'email': 'a@b', 'password': 'Abc#123'},
+        {'username': 'u', 'email': 'a@b', 'password': ''},
+        {},
+    ]) == [None, 'R1-3', 'R1-6', None]